@@ -0,0 +1,315 @@
+'''
+_batch.py implements a batched engine that plays K independent random
+games in lock-step using NumPy arrays, for offline data generation.
+
+Features:
+- board state of every game as arrays of shape K x n*n.
+- vectorized legal-move masks and random move selection.
+- vectorized cycle detection, using component labels over the 
+    cells connected by each mark.
+- vectorized collapse propagation over the mark arrays.
+- vectorized krist scoring, mirroring Game.kristScore().
+- validation of every move against 'Server'/'Game'.
+
+Marks are numbered by move number as in Server, odd numbers are x.
+
+Requires NumPy.
+'''
+
+import time
+import numpy as np
+
+# directions walked by Game.kristScore()
+DIRECTIONS = ((0,1), (1,0), (1,1), (1,-1))
+
+class BatchGame:
+    def __init__(self, numGames, board_size, seed=None):
+        '''
+        Initialize 'numGames' empty boards of size 'board_size'.
+        - stableMark: number of the classical mark in each cell, or -1.
+        - markA, markB: cells of each mark number, or -1.
+        - comp: component label of each cell. Two cells are connected
+            by spooky marks iff they share a label.
+        - moveNum: number of the next move to place.
+        - cycle: a collapse is pending on mark 'cycleMark'.
+        - done: the game is over.
+        - rng: numpy random generator.
+        '''
+        self.numGames = numGames
+        self.board_size = board_size
+        self.numCells = board_size*board_size
+        self.numMarks = 2*self.numCells + 2
+
+        K = numGames
+        self.stableMark = np.full((K, self.numCells), -1, np.int32)
+        self.markA = np.full((K, self.numMarks), -1, np.int32)
+        self.markB = np.full((K, self.numMarks), -1, np.int32)
+        self.comp = np.tile(np.arange(self.numCells, dtype=np.int32), (K, 1))
+        self.moveNum = np.ones(K, np.int32)
+        self.cycle = np.zeros(K, bool)
+        self.cycleMark = np.zeros(K, np.int32)
+        self.done = np.zeros(K, bool)
+
+        self.rng = np.random.default_rng(seed)
+
+    def legalMask(self):
+        '''
+        Returns a K x n*n boolean array of the cells a move can be
+        placed in.
+        '''
+        return self.stableMark < 0
+
+    def collapseMoves(self):
+        '''
+        Returns the two cells of the pending collapse of each game.
+        '''
+        games = np.arange(self.numGames)
+        return (self.markA[games, self.cycleMark], 
+            self.markB[games, self.cycleMark])
+
+    def randomPlacements(self, games):
+        '''
+        Returns two distinct random legal cells, ordered by index, for
+        each game in 'games'.
+        '''
+        keys = self.rng.random((len(games), self.numCells))
+        keys[self.stableMark[games] >= 0] = 2.0
+        cells = np.argpartition(keys, 1, axis=1)[:, :2]
+        return cells.min(axis=1), cells.max(axis=1)
+
+    def place(self, games, a, b):
+        '''
+        Places the next mark of each game in 'games' on cells 'a' and
+        'b'. Detects cycles and connects the cells otherwise.
+        '''
+        m = self.moveNum[games]
+        self.markA[games, m] = a
+        self.markB[games, m] = b
+
+        comp = self.comp[games]
+        ca = comp[np.arange(len(games)), a]
+        cb = comp[np.arange(len(games)), b]
+        cycle = ca == cb
+        self.comp[games] = np.where(comp == ca[:, None], cb[:, None], comp)
+
+        self.cycle[games] = cycle
+        self.cycleMark[games] = np.where(cycle, m, self.cycleMark[games])
+        self.moveNum[games] = m + 1
+
+    def collapse(self, games, cells):
+        '''
+        Collapses the pending mark of each game in 'games' into 
+        'cells', then propagates the collapse to every mark forced out
+        of an evaluated cell.
+        '''
+        stableMark = self.stableMark[games]
+        rows = np.arange(len(games))
+        stableMark[rows, cells] = self.cycleMark[games]
+
+        markA = self.markA[games]
+        markB = self.markB[games]
+        placed = markA >= 0
+        markA = np.where(placed, markA, 0)
+        markB = np.where(placed, markB, 0)
+        nums = np.arange(self.numMarks)
+
+        # A mark is forced into one of its cells when its other cell
+        # was evaluated with a different mark.
+        while True:
+            A = np.take_along_axis(stableMark, markA, 1)
+            B = np.take_along_axis(stableMark, markB, 1)
+            forceB = placed & (A >= 0) & (A != nums) & (B < 0)
+            forceA = placed & (B >= 0) & (B != nums) & (A < 0)
+            if not (forceA.any() or forceB.any()):
+                break
+
+            g, m = np.nonzero(forceB)
+            stableMark[g, markB[g, m]] = m
+            g, m = np.nonzero(forceA)
+            stableMark[g, markA[g, m]] = m
+
+        self.stableMark[games] = stableMark
+        self.cycle[games] = False
+
+    def step(self):
+        '''
+        Plays one random action in every game that is not over: the
+        collapse of a pending cycle, or a placement. Returns a tuple
+        (kind, a, b) of arrays describing the action of each game. 
+        kind is 0 if the game is over, 1 for a collapse at 'a' and 2
+        for a placement at 'a' and 'b'.
+        '''
+        K = self.numGames
+        kind = np.zeros(K, np.int8)
+        a = np.full(K, -1, np.int32)
+        b = np.full(K, -1, np.int32)
+
+        games = np.nonzero(~self.done & self.cycle)[0]
+        if len(games):
+            pos0 = self.markA[games, self.cycleMark[games]]
+            pos1 = self.markB[games, self.cycleMark[games]]
+            cells = np.where(self.rng.random(len(games)) < 0.5, pos0, pos1)
+            self.collapse(games, cells)
+            kind[games] = 1
+            a[games] = cells
+
+        games = np.nonzero(~self.done & ~self.cycle & (kind == 0))[0]
+        if len(games):
+            pos0, pos1 = self.randomPlacements(games)
+            self.place(games, pos0, pos1)
+            kind[games] = 2
+            a[games] = pos0
+            b[games] = pos1
+
+        self.done |= ~self.cycle & (self.legalMask().sum(axis=1) < 2)
+        return kind, a, b
+
+    def run(self):
+        '''
+        Plays every game to the end. Returns the number of steps.
+        '''
+        steps = 0
+        while not self.done.all():
+            self.step()
+            steps += 1
+        return steps
+
+    def players(self):
+        '''
+        Returns a K x n x n array of the classical mark of each cell:
+        0 if not stable, 1 for x and 2 for o.
+        '''
+        grid = np.where(self.stableMark < 0, 0, 
+            np.where(self.stableMark % 2 == 1, 1, 2))
+        n = self.board_size
+        return grid.reshape(self.numGames, n, n)
+
+    def runLengths(self, same, di, dj):
+        '''
+        Returns, for each cell, the length of the run of 'same' cells
+        ending at that cell in direction (di,dj).
+        '''
+        n = self.board_size
+        run = np.zeros(same.shape, np.int32)
+        if di == 0:
+            run[:, :, 0] = same[:, :, 0]
+            for j in range(1, n):
+                run[:, :, j] = same[:, :, j]*(run[:, :, j-1] + 1)
+            return run
+
+        run[:, 0, :] = same[:, 0, :]
+        for i in range(1, n):
+            prev = np.zeros((same.shape[0], n), np.int32)
+            if dj == 0:
+                prev = run[:, i-1, :]
+            elif dj == 1:
+                prev[:, 1:] = run[:, i-1, :-1]
+            else:
+                prev[:, :-1] = run[:, i-1, 1:]
+            run[:, i, :] = same[:, i, :]*(prev + 1)
+        return run
+
+    def kristScore(self):
+        '''
+        Returns arrays (maxLen, kristX, kristO), see Game.kristScore().
+        '''
+        grid = self.players()
+        value = np.zeros(grid.shape, np.int32)
+        for player in (1, 2):
+            same = (grid == player).astype(np.int32)
+            for di, dj in DIRECTIONS:
+                value = np.maximum(value, self.runLengths(same, di, dj))
+
+        maxLen = np.maximum(1, value.max(axis=(1, 2)))
+        best = value == maxLen[:, None, None]
+        kristX = (best & (grid == 1)).sum(axis=(1, 2))
+        kristO = (best & (grid == 2)).sum(axis=(1, 2))
+        return maxLen, kristX, kristO
+
+    def winners(self):
+        '''
+        Returns an array holding 1 where x won, 2 where o won and 0 
+        for a draw.
+        '''
+        maxLen, kristX, kristO = self.kristScore()
+        return np.where(kristX > kristO, 1, np.where(kristO > kristX, 2, 0))
+
+    def cellMarks(self, k, cell):
+        '''
+        Returns the marks placed in 'cell' of game 'k' as mark values.
+        '''
+        marks = list()
+        for m in range(1, self.moveNum[k]):
+            if self.markA[k, m] == cell or self.markB[k, m] == cell:
+                marks.append(('x' if m % 2 else 'o') + str(m))
+        return marks
+
+def validate(numGames=100, board_size=4, seed=0, bitboard=False):
+    '''
+    Plays 'numGames' random games on a BatchGame and replays every 
+    action on a Server, comparing the board, the pending collapse and
+    the final krist score after every step. Returns the number of 
+    actions checked, raises AssertionError on the first mismatch.
+    '''
+    from server import Server
+
+    batch = BatchGame(numGames, board_size, seed)
+    servers = [Server(board_size, bitboard) for k in range(numGames)]
+    n = board_size
+
+    def position(cell):
+        return (int(cell)//n, int(cell)%n)
+
+    checked = 0
+    while not batch.done.all():
+        kind, a, b = batch.step()
+        for k in range(numGames):
+            if kind[k] == 0:
+                continue
+
+            server = servers[k]
+            if kind[k] == 1:
+                server.playAction((position(a[k]),))
+            else:
+                server.playAction((position(a[k]), position(b[k])))
+
+            game = server.game
+            assert game.cycleDetected == batch.cycle[k], (k, 'cycle')
+            for cell in range(batch.numCells):
+                stable = game.board.getStable(position(cell))
+                m = batch.stableMark[k, cell]
+                if m < 0:
+                    assert stable is None, (k, cell, stable)
+                    assert (list(game.board.getMarks(position(cell))) == 
+                        batch.cellMarks(k, cell)), (k, cell)
+                else:
+                    assert stable == ('x' if m % 2 else 'o') + str(m), (k, cell)
+            checked += 1
+
+    maxLen, kristX, kristO = batch.kristScore()
+    for k in range(numGames):
+        length, krists = servers[k].kristScore()
+        assert (length, krists['x'], krists['o']) == (maxLen[k], 
+            kristX[k], kristO[k]), (k, 'krist')
+        assert servers[k].gameOver(), (k, 'terminal')
+
+    return checked
+
+if __name__ == '__main__':
+    import sys
+
+    board_size = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    numGames = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+
+    checked = validate(200, board_size)
+    print('Validated', checked, 'actions against Game.')
+
+    start = time.time()
+    batch = BatchGame(numGames, board_size, 0)
+    steps = batch.run()
+    winners = batch.winners()
+    seconds = time.time() - start
+    print('{} games of size {} in {} steps, {:.0f} games/sec'.format(
+        numGames, board_size, steps, numGames/seconds))
+    print('x wins:', (winners == 1).sum(), ' o wins:', (winners == 2).sum(),
+        ' draws:', (winners == 0).sum())
@@ -0,0 +1,250 @@
+'''
+_bitboard.py implements a compact board engine for the game.
+
+Features:
+- stable x, stable o and spooky cells stored as integer bitboards.
+- marks of every cell stored as integer bitsets in a flat list indexed
+    by the cell index (see Game.getCellIndex).
+- same cell-level interface as '_game.DictBoard', so that 'Game' can
+    run on either engine.
+- krist counters read from the stable bitboards, see 'BitKristCounter'.
+
+The engine saves memory more than time: an empty board takes 864 bytes
+on 4x4 and 2396 on 8x8 against 2720 and 9728 for a 'DictBoard', and 
+the krist counters keep two bitboards instead of a table of runs per
+cell. Krist updates are the only part of a move it makes cheaper, 
+make_move() takes about 7 us against 9 to 10 us on a 'DictBoard' over
+4x4 to 8x8 boards. The union-find, hash and move tree updates of 
+'Game' cost the same on both engines, so moves are not an order of 
+magnitude cheaper. Compare with 'python3 benchmark.py --bitboard'.
+'''
+
+# Maps each mark value to its bit in a cell's mark bitset and back.
+# Marks are numbered by move number, 'o' marks use the odd bits.
+_markBits = dict()
+_markValues = dict()
+
+def markBit(markValue):
+    '''
+    Returns the bit position of 'markValue' in a mark bitset.
+    '''
+    bit = _markBits.get(markValue)
+    if bit is None:
+        bit = int(markValue[1:])*2 + (markValue[0] == 'o')
+        _markBits[markValue] = bit
+        _markValues[bit] = markValue
+
+    return bit
+
+def markValue(bit):
+    '''
+    Returns the mark value stored at position 'bit' of a mark bitset.
+    '''
+    return _markValues[bit]
+
+class BitBoard:
+    def __init__(self, board_size):
+        '''
+        Initialize the bitboards of an empty board.
+        - stableX, stableO: bit i is set if cell i holds a classical
+            x or o.
+        - occupied: bit i is set if cell i holds at least one spooky
+            mark.
+        - marks: mark bitsets of each cell, indexed by cell index.
+        - stable: classical mark value of each cell, or None.
+        - positions: (row,col) of each cell index.
+        '''
+        self.board_size = board_size
+        self.numCells = board_size*board_size
+        self.full = (1 << self.numCells) - 1
+
+        self.stableX = 0
+        self.stableO = 0
+        self.occupied = 0
+        self.marks = [0]*self.numCells
+        self.stable = [None]*self.numCells
+
+        self.positions = [(i//board_size, i%board_size) 
+            for i in range(self.numCells)]
+
+        # list of non-stable positions, cached until 'stableX' or
+        # 'stableO' changes.
+        self.unstableMask = self.full
+        self.unstableList = self.positions[:]
+
+    def index(self, pos):
+        return pos[0]*self.board_size + pos[1]
+
+    def keys(self):
+        return self.positions
+
+    def getStable(self, pos):
+        return self.stable[pos[0]*self.board_size + pos[1]]
+
+    def getMarks(self, pos):
+        '''
+        Returns a list of the marks placed in 'pos', in the order they
+        were played.
+        '''
+        bits = self.marks[pos[0]*self.board_size + pos[1]]
+        marksList = list()
+        while bits:
+            low = bits & -bits
+            marksList.append(_markValues[low.bit_length()-1])
+            bits ^= low
+
+        return marksList
+
+    def hasMark(self, pos, markValue):
+        return (self.marks[pos[0]*self.board_size + pos[1]] 
+            >> markBit(markValue)) & 1 == 1
+
+    def addMark(self, pos, markValue):
+        i = pos[0]*self.board_size + pos[1]
+        self.marks[i] |= 1 << markBit(markValue)
+        self.occupied |= 1 << i
+
+    def removeMark(self, pos, markValue):
+        i = pos[0]*self.board_size + pos[1]
+        self.marks[i] &= ~(1 << markBit(markValue))
+        if not self.marks[i]:
+            self.occupied &= ~(1 << i)
+
+    def setStable(self, pos, markValue):
+        i = pos[0]*self.board_size + pos[1]
+        self.stable[i] = markValue
+        if markValue[0] == 'x':
+            self.stableX |= 1 << i
+        else:
+            self.stableO |= 1 << i
+
+    def clearStable(self, pos):
+        i = pos[0]*self.board_size + pos[1]
+        self.stable[i] = None
+        self.stableX &= ~(1 << i)
+        self.stableO &= ~(1 << i)
+
+    def spooky(self):
+        '''
+        Returns the bitboard of non-stable cells holding spooky marks.
+        '''
+        return self.occupied & ~(self.stableX | self.stableO)
+
+    def unstable(self):
+        '''
+        Returns the bitboard of cells that are not stable.
+        '''
+        return self.full & ~(self.stableX | self.stableO)
+
+    def unstableCells(self):
+        '''
+        Returns a list of non-stable positions in row-major order.
+        '''
+        bits = self.unstable()
+        if bits != self.unstableMask:
+            posList = list()
+            self.unstableMask = bits
+            while bits:
+                low = bits & -bits
+                posList.append(self.positions[low.bit_length()-1])
+                bits ^= low
+            self.unstableList = posList
+
+        return self.unstableList[:]
+
+    def countUnstable(self):
+        return bin(self.unstable()).count('1')
+
+class BitKristCounter:
+    def __init__(self, board_size, maxLength=None):
+        '''
+        Krist counters of a 'BitBoard' game, with the interface of
+        '_krist.KristCounter'. add() and remove() only set the bit of
+        the cell in the bitboard of its player. The krists are found
+        when first read after a change, by shifting the bitboards
+        along the four directions of krist scoring.
+        - stable: bitboards of the stable cells of x and o.
+        - numStable: number of stable cells.
+        - edges: for each direction, the shift of a step and the mask
+            of the cells a step can end in without wrapping a row.
+        - counts: the longest krist and the number of krists of that
+            length of each player, or None until read.
+        '''
+        if maxLength is None:
+            maxLength = board_size
+        if maxLength < 1 or maxLength > board_size:
+            raise ValueError('Win length out of range 1-{0}.'.format(
+                board_size))
+
+        n = board_size
+        full = (1 << n*n) - 1
+        firstCol = 0
+        lastCol = 0
+        for row in range(n):
+            firstCol |= 1 << row*n
+            lastCol |= 1 << (row*n + n-1)
+
+        self.board_size = board_size
+        self.maxLength = maxLength
+        self.stable = [0, 0]
+        self.numStable = 0
+        self.edges = ((1, full & ~firstCol), (n, full), 
+            (n+1, full & ~firstCol), (n-1, full & ~lastCol))
+        self.counts = None
+
+    def add(self, cell, player):
+        '''
+        Counts the cell index 'cell' as stable for 'player' (0: x,
+        1: o).
+        '''
+        self.stable[player] |= 1 << cell
+        self.numStable += 1
+        self.counts = None
+
+    def remove(self, cell, player):
+        '''
+        Inverse of add().
+        '''
+        self.stable[player] &= ~(1 << cell)
+        self.numStable -= 1
+        self.counts = None
+
+    def count(self):
+        '''
+        Returns the longest krist, capped at 'maxLength', and the 
+        bitboards of the cells where a krist of that length ends for
+        each player. runs[player][d] holds the cells ending a run of
+        'length' cells in direction d.
+        '''
+        runs = [[mask]*4 for mask in self.stable]
+        ends = list(self.stable)
+        length = 1
+        while length < self.maxLength:
+            longer = [0, 0]
+            for p in (0, 1):
+                mask = self.stable[p]
+                for d in range(4):
+                    shift, edge = self.edges[d]
+                    runs[p][d] = mask & edge & (runs[p][d] << shift)
+                    longer[p] |= runs[p][d]
+            if not (longer[0] or longer[1]):
+                break
+            ends = longer
+            length += 1
+        return length, ends
+
+    @property
+    def maxLen(self):
+        if self.counts is None:
+            length, ends = self.count()
+            self.counts = (length, bin(ends[0]).count('1'), 
+                bin(ends[1]).count('1'))
+        return self.counts[0]
+
+    def score(self):
+        '''
+        Returns the length of the longest krist, and the number of
+        krists of that length made by each player.
+        '''
+        maxLen = self.maxLen
+        return maxLen, {'x': self.counts[1], 'o': self.counts[2]}
@@ -0,0 +1,421 @@
+'''
+_book.py implements opening books: statistics of the moves played from
+the first positions of saved games, for computer players.
+
+Features:
+- builds a book from a directory of saved games in either format
+    (text grammar of printTree() or _record.py), one file at a time.
+    Every branch of a saved moves tree is a game.
+- positions are keyed by the smallest zobrist hash among the 8
+    symmetries of the board, so rotated and mirrored games share their
+    statistics. Moves are stored in the same symmetry as the key.
+- for each move: the number of finished games it was played in, and
+    the wins of x and of o among them.
+- compact file of sorted position keys, looked up by binary search
+    over a memory map.
+- best move of a server state, see BookPlayer in _players.py.
+
+Format (little-endian):
+- header: magic 'Q3TO', version, board size, win length (0 if none),
+    number of plies covered, number of positions, number of moves.
+- keys: position keys, sorted.
+- starts: index of the first move of each position, followed by the
+    number of moves.
+- moves: cell indices of the move (cell1 is NONE for a collapse),
+    number of games, wins of x, wins of o.
+
+Usage: python3 _book.py <directory> <output> [size=<n>] [plies=<k>]
+[win=<k>] builds a book of the first k (default 8) plies of the games
+of size n (default: size of the first game read) found in <directory>.
+'''
+
+import bisect
+import mmap
+import os
+import struct
+import sys
+
+from _game import Game
+from _record import (RecordFile, RecordError, TreeReplay, isRecord,
+    textRecords, decodeMove, NONE)
+from _zobrist import getKeys, player
+
+MAGIC = b'Q3TO'
+VERSION = 1
+HEADER = struct.Struct('<4sHHHHII')
+KEY = struct.Struct('<Q')
+START = struct.Struct('<I')
+MOVE = struct.Struct('<HHIII')
+
+def symmetries(board_size):
+    '''
+    Returns the 8 symmetries of the board, each as the list of the
+    cell index every cell index is mapped to.
+    '''
+    n = board_size
+    maps = list()
+    for transpose in (False, True):
+        for flipRows in (False, True):
+            for flipCols in (False, True):
+                cells = list()
+                for i in range(n*n):
+                    r, c = i//n, i%n
+                    if transpose:
+                        r, c = c, r
+                    if flipRows:
+                        r = n-1-r
+                    if flipCols:
+                        c = n-1-c
+                    cells.append(r*n + c)
+                maps.append(cells)
+    return maps
+
+def positionKey(game, maps):
+    '''
+    Returns (key, symmetry) of the position of 'game': the smallest
+    hash of the position among the symmetries 'maps', computed as
+    Game.computeHash(), and the index of the symmetry giving it.
+    '''
+    keys = getKeys(game.board_size)
+    hashes = [keys.side if game.plies % 2 else 0]*len(maps)
+
+    if game.cycleDetected:
+        i0 = game.getCellIndex(game.cyclePos[0])
+        i1 = game.getCellIndex(game.cyclePos[1])
+        for s, cells in enumerate(maps):
+            hashes[s] ^= keys.collapse(cells[i0], cells[i1])
+
+    for markValue, posList in game.markPos.items():
+        if not game.isLive(markValue):
+            continue
+        i0 = game.getCellIndex(posList[0])
+        if len(posList) == 1:
+            for s, cells in enumerate(maps):
+                hashes[s] ^= keys.half(cells[i0], player(markValue))
+        else:
+            i1 = game.getCellIndex(posList[1])
+            for s, cells in enumerate(maps):
+                hashes[s] ^= keys.edge(cells[i0], cells[i1],
+                    player(markValue))
+
+    for pos in game.board.keys():
+        markValue = game.board.getStable(pos)
+        if markValue is not None:
+            i = game.getCellIndex(pos)
+            for s, cells in enumerate(maps):
+                hashes[s] ^= keys.stable(cells[i], player(markValue))
+
+    key = min(hashes)
+    return key, hashes.index(key)
+
+# -------------------------------------------------------------------
+# Building.
+class BookBuilder:
+    def __init__(self, board_size=None, maxPlies=8, winLength=None):
+        '''
+        Accumulates the moves of saved games.
+        - board_size: size of the games kept, or None for the size of
+            the first game added.
+        - maxPlies: moves are counted from positions with fewer
+            placements.
+        - stats: map from position key to a map from move to
+            [games, wins of x, wins of o].
+        - files, skipped: number of files added and rejected.
+        - games: number of finished games in the files added, the
+            leaves of their moves trees.
+        '''
+        self.board_size = board_size
+        self.maxPlies = maxPlies
+        self.winLength = winLength
+        self.maps = None
+        self.stats = dict()
+        self.files = 0
+        self.skipped = 0
+        self.games = 0
+
+    def addDirectory(self, directory):
+        '''
+        Adds every saved game found under 'directory'.
+        '''
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith('.q3i') or name.endswith('.q3i.tmp'):
+                    continue
+                self.addFile(os.path.join(root, name))
+
+    def addFile(self, filePath):
+        '''
+        Adds the saved game 'filePath'. Returns False if it is not a
+        valid saved game of the size of the book.
+        '''
+        try:
+            if isRecord(filePath):
+                record = RecordFile(filePath)
+                try:
+                    board_size, records = record.board_size, list(record)
+                finally:
+                    record.close()
+            else:
+                file = open(filePath, 'r')
+                try:
+                    board_size, records, current = textRecords(file)
+                finally:
+                    file.close()
+
+            if self.board_size is None and board_size > 0:
+                self.board_size = board_size
+            if board_size != self.board_size:
+                raise RecordError('Board size of another book.')
+
+            self.addRecords(records)
+
+        except (OSError, ValueError, RecordError):
+            self.skipped += 1
+            return False
+
+        self.files += 1
+        return True
+
+    def addRecords(self, records):
+        '''
+        Replays the moves tree of 'records' (see _record.py) with a
+        'TreeReplay', which rejects the first move that is not legal.
+        The statistics of a file are only added once all of its moves
+        were found legal.
+        '''
+        if self.maps is None:
+            self.maps = symmetries(self.board_size)
+
+        if not len(records) or records[0][1] >= 0:
+            raise RecordError('Missing INIT_STATE.')
+
+        game = Game(self.board_size, False, self.winLength)
+        replay = TreeReplay(game, record=False)
+        stats = list()
+
+        # one frame per depth, as the frames of 'replay': [key, move,
+        # collapse, games, x wins, o wins, number of children].
+        frames = [[None, None, False, 0, 0, 0, 0]]
+        for depth, parent, flags, number, cell0, cell1 in records[1:]:
+            if depth < 1 or depth > len(frames):
+                raise RecordError('Invalid depth in record.')
+            while len(frames) > depth:
+                self.popFrame(game, frames, stats)
+                replay.pop()
+
+            move = decodeMove(flags, number, cell0, cell1, self.board_size)
+            collapse = move.isCollapse()
+            frames[-1][6] += 1
+
+            # a collapse chain is played at once by its first move, the
+            # next ones are only checked to follow it.
+            key = None
+            action = None
+            if game.plies < self.maxPlies and not (collapse and 
+                    frames[-1][2]):
+                key, symmetry = positionKey(game, self.maps)
+                cells = self.maps[symmetry]
+                if collapse:
+                    action = (cells[cell0], NONE)
+                else:
+                    action = (min(cells[cell0], cells[cell1]),
+                        max(cells[cell0], cells[cell1]))
+
+            replay.add(depth, move)
+            frames.append([key, action, collapse, 0, 0, 0, 0])
+
+        while len(frames) > 1:
+            self.popFrame(game, frames, stats)
+            replay.pop()
+        self.games += frames[0][3]
+
+        for key, action, games, xWins, oWins in stats:
+            counts = self.stats.setdefault(key, dict()).setdefault(action,
+                [0, 0, 0])
+            counts[0] += games
+            counts[1] += xWins
+            counts[2] += oWins
+
+    def popFrame(self, game, frames, stats):
+        '''
+        Leaves the move of the last frame, before it is undone. A leaf
+        counts as a game if it is finished.
+        '''
+        key, action, collapse, games, xWins, oWins, children = frames.pop()
+        if not children and not game.cycleDetected and game.gameOver():
+            winner = game.getWinner()
+            games = 1
+            xWins = 1 if winner == 'x' else 0
+            oWins = 1 if winner == 'o' else 0
+
+        if key is not None and games:
+            stats.append((key, action, games, xWins, oWins))
+
+        parent = frames[-1]
+        parent[3] += games
+        parent[4] += xWins
+        parent[5] += oWins
+
+    def write(self, filePath):
+        '''
+        Writes the book in a single write.
+        '''
+        keys = sorted(self.stats.keys())
+        numMoves = sum(len(self.stats[key]) for key in keys)
+
+        data = bytearray(HEADER.size + KEY.size*len(keys) +
+            START.size*(len(keys)+1) + MOVE.size*numMoves)
+        HEADER.pack_into(data, 0, MAGIC, VERSION, self.board_size or 0,
+            self.winLength if self.winLength is not None else 0,
+            self.maxPlies, len(keys), numMoves)
+
+        offset = HEADER.size
+        for key in keys:
+            KEY.pack_into(data, offset, key)
+            offset += KEY.size
+
+        start = 0
+        for key in keys + [None]:
+            START.pack_into(data, offset, start)
+            offset += START.size
+            if key is not None:
+                start += len(self.stats[key])
+
+        for key in keys:
+            moves = self.stats[key]
+            for action in sorted(moves.keys()):
+                MOVE.pack_into(data, offset, *(action + tuple(moves[action])))
+                offset += MOVE.size
+
+        file = open(filePath, 'wb')
+        file.write(data)
+        file.close()
+
+# -------------------------------------------------------------------
+# Lookup.
+class OpeningBook:
+    def __init__(self, filePath):
+        '''
+        Opens a book for reading through mmap.
+        - board_size, winLength, maxPlies: from the header.
+        - count: number of positions.
+        '''
+        self.file = open(filePath, 'rb')
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.mmap) < HEADER.size:
+            self.close()
+            raise RecordError('File too short for a book header.')
+
+        magic, version, self.board_size, winLength, self.maxPlies, \
+            self.count, numMoves = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise RecordError('Not an opening book.')
+
+        self.starts = HEADER.size + KEY.size*self.count
+        self.moves = self.starts + START.size*(self.count+1)
+        if len(self.mmap) != self.moves + MOVE.size*numMoves:
+            self.close()
+            raise RecordError('Truncated opening book.')
+
+        self.winLength = winLength if winLength else None
+        self.maps = symmetries(self.board_size)
+        self.inverse = list()
+        for cells in self.maps:
+            inverse = [0]*len(cells)
+            for i, j in enumerate(cells):
+                inverse[j] = i
+            self.inverse.append(inverse)
+
+        self.view = memoryview(self.mmap)
+        self.keys = self.view[HEADER.size:self.starts].cast('Q')
+
+    def matches(self, game):
+        return (game.board_size == self.board_size and
+            game.winLength == self.winLength)
+
+    def lookup(self, key):
+        '''
+        Returns the moves of the position 'key' as a list of (cell0,
+        cell1, games, wins of x, wins of o), empty if it is not in the
+        book.
+        '''
+        i = bisect.bisect_left(self.keys, key)
+        if i == self.count or self.keys[i] != key:
+            return []
+
+        first, = START.unpack_from(self.mmap, self.starts + START.size*i)
+        end, = START.unpack_from(self.mmap, self.starts + START.size*(i+1))
+        return [MOVE.unpack_from(self.mmap, self.moves + MOVE.size*j)
+            for j in range(first, end)]
+
+    def bestAction(self, server, maxPlies=None, minGames=1):
+        '''
+        Returns the action of the best score for the side to move in
+        the state of 'server', among the moves played in at least
+        'minGames' games, or None. A draw counts as half a win. Only
+        the first 'maxPlies' plies (default: all of the book) are
+        looked up.
+        '''
+        game = server.game
+        if maxPlies is None or maxPlies > self.maxPlies:
+            maxPlies = self.maxPlies
+        if not self.matches(game) or game.plies >= maxPlies:
+            return None
+        if server.curr_state[1:] not in ('_0', '_COLLAPSE'):
+            return None
+
+        key, symmetry = positionKey(game, self.maps)
+        inverse = self.inverse[symmetry]
+        side = server.curr_state[0].lower()
+
+        n = self.board_size
+        legal = game.moveCells()
+        best = None
+        bestScore = None
+        for cell0, cell1, games, xWins, oWins in self.lookup(key):
+            if games < minGames or (cell1 == NONE) != game.cycleDetected:
+                continue
+
+            action = tuple(sorted((inverse[i]//n, inverse[i]%n)
+                for i in (cell0, cell1) if i != NONE))
+            if any(pos not in legal for pos in action):
+                continue
+
+            wins = xWins if side == 'x' else oWins
+            score = ((wins + 0.5*(games - xWins - oWins))/games, games)
+            if best is None or score > bestScore:
+                best = action
+                bestScore = score
+
+        return best
+
+    def close(self):
+        if hasattr(self, 'keys'):
+            self.keys.release()
+            self.view.release()
+        self.mmap.close()
+        self.file.close()
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print('Usage: python3 _book.py <directory> <output> [size=<n>] '
+            '[plies=<k>] [win=<k>]')
+        sys.exit(1)
+
+    builder = BookBuilder()
+    for arg in sys.argv[3:]:
+        if arg[0:5] == 'size=':
+            builder.board_size = int(arg[5:])
+        elif arg[0:6] == 'plies=':
+            builder.maxPlies = int(arg[6:])
+        elif arg[0:4] == 'win=':
+            builder.winLength = int(arg[4:])
+
+    builder.addDirectory(sys.argv[1])
+    builder.write(sys.argv[2])
+    print(str(len(builder.stats))+' positions from '+str(builder.games)+
+        ' games in '+str(builder.files)+' files saved to '+sys.argv[2]+', '+
+        str(builder.skipped)+' files skipped.')
@@ -3,53 +3,116 @@
 game.py implements the algorithms required for running the game.
 
 Features:
-- board representation.
+- board representation, using a dict of cells or bitboards.
 - state transitions.
+- make/unmake of moves for search.
+- krist scoring, maintained incrementally, see _krist.py, or read
+    from bitboards on the bitboard engine, see _bitboard.py.
 - movesTree updates.
+- legality of moves read from saved games.
 - cycle detection.
+- set of legal cells, maintained through placement, collapse and
+    undo.
+- zobrist hashing of the position, computed on first use and then
+    maintained incrementally.
 - 'cycle collapse' algorithm.
-- depth-first traversals to write tree to stdio/file and resetting
-    a tree to some position.
+- depth-first traversals to write tree to stdio/file.
+- index of the moveNodes by id and by move, jumping to any
+    moveNode through their common ancestor.
+- optional bound on the moveNodes kept in memory, cold branches are
+    spilled to disk, see _spill.py.
+- immutable states of any moveNode, see _state.py.
 '''
 
-from _move import Move, MoveNode
+import bisect
+import collections
+import sys
+
+from _move import Move, MoveNode, NO_CHILDREN
+from _record import encodeMove, decodeMove, moveCode
+from _spill import Branch, SpillStore
+from _state import initialState
+from _bitboard import BitBoard, BitKristCounter
+from _zobrist import getKeys, player
+from _krist import KristCounter
 
 # -------------------------------------------------------------------
-# Implementation of the Union Find Data Structure. Uses path
-# compression and the rank heuristic to speedup union and find
-# operations.
+# Implementation of the Union Find Data Structure. Uses the rank
+# heuristic to speedup union and find operations. Paths are not
+# compressed so that every union can be rolled back in O(1) from
+# 'history', which logs (key, child, rankBumped, cycle) per union.
 class UnionFind:
-    def __init__(self):
+    def __init__(self, stats=None):
         self.par = {}
         self.rank = {}
+        self.history = []
+        self.stats = stats
 
     def makeSet(self, u):
         self.par[u] = u
         self.rank[u] = 0
 
     def find(self, u):
-        if self.par[u] != u:
-            self.par[u] = self.find(self.par[u])
+        while self.par[u] != u:
+            u = self.par[u]
 
-        return self.par[u]
+        return u
 
-    def union(self, u, v):
+    def union(self, u, v, key=None):
+        '''
+        Connects the sets containing u and v and logs the change under
+        'key'. Returns False if u and v were already connected.
+        '''
         ru = self.find(u)
         rv = self.find(v)
+        if self.stats is not None:
+            self.stats.count('union')
 
         if ru == rv:
+            self.history.append((key, None, False, True))
             return False
 
         if self.rank[ru] > self.rank[rv]:
             self.par[rv] = ru
+            self.history.append((key, rv, False, False))
 
         else:
             self.par[ru] = rv
-            if self.rank[ru] == self.rank[rv]:
+            rankBumped = self.rank[ru] == self.rank[rv]
+            if rankBumped:
                 self.rank[rv] += 1
+            self.history.append((key, ru, rankBumped, False))
 
         return True
 
+    def rollback(self):
+        '''
+        Reverts the most recent union and returns its key.
+        '''
+        key, child, rankBumped, cycle = self.history.pop()
+        if self.stats is not None:
+            self.stats.count('rollback')
+        if child is not None:
+            root = self.par[child]
+            self.par[child] = child
+            if rankBumped:
+                self.rank[root] -= 1
+
+        return key
+
+    def lastKey(self):
+        if len(self.history):
+            return self.history[-1][0]
+        return None
+
+    def lastCycle(self):
+        '''
+        Returns True if the most recent union closed a cycle.
+        '''
+        if len(self.history):
+            return self.history[-1][3]
+        return False
+
     def printSets(self):
         for v in self.par.keys():
             print(v, '->', self.par[v], self.rank[v])
@@ -61,34 +124,155 @@ class InputError(Exception):
         self.message = msg
 # -------------------------------------------------------------------
 class Cell:
+    __slots__ = ('pos', 'marksList', 'stable')
+
     def __init__(self, row, col):
         self.pos = (row,col)
         self.marksList = list()
         self.stable = None
 
 
+# Default board engine, maps each position on the board to its 'Cell'.
+# 'BitBoard' implements the same interface over integer bitboards.
+class DictBoard(dict):
+    def __init__(self, board_size):
+        dict.__init__(self)
+        self.board_size = board_size
+        for i in range(board_size):
+            for j in range(board_size):
+                self[(i,j)] = Cell(i,j)
+
+    def getStable(self, pos):
+        return self[pos].stable
+
+    def getMarks(self, pos):
+        return self[pos].marksList
+
+    def hasMark(self, pos, markValue):
+        return markValue in self[pos].marksList
+
+    def addMark(self, pos, markValue):
+        self[pos].marksList.append(markValue)
+
+    def removeMark(self, pos, markValue):
+        self[pos].marksList.remove(markValue)
+
+    def setStable(self, pos, markValue):
+        self[pos].stable = markValue
+
+    def clearStable(self, pos):
+        self[pos].stable = None
+
+    def unstableCells(self):
+        '''
+        Returns a list of non-stable positions in row-major order.
+        '''
+        return [pos for pos in self.keys() if not self[pos].stable]
+
+    def countUnstable(self):
+        count = 0
+        for cell in self.values():
+            if not cell.stable:
+                count += 1
+        return count
+
+
 # Implementation of the game.
 class Game:
-    def __init__(self, board_size):
+    def __init__(self, board_size, bitboard=False, winLength=None):
 
         '''
         Intialize data structures involved in the game.
         - board_size: size of the board. (#rows = #columns)
+        - bitboard: run the game on a 'BitBoard' instead of a
+            'DictBoard'.
+        - winLength: the game ends once a krist of this length is
+            made, if set. Longer krists score as this length. It must
+            be from 1 to 'board_size', see _krist.py.
         - board: maps position on the board to the cell instance
-            corresponding to that indexed position.
+            corresponding to that indexed position, see 'DictBoard'
+            and 'BitBoard'.
         - unionFind: an instance of 'UnionFind' with nodes 
-            representing each cell on the board.
+            representing each cell on the board. Unions are logged
+            under the moveNode that played them.
         - movesTree: stores a pointer to the current moveNode. Used for
             pointing to previous and next 
+        - markPos: maps each spooky mark value to the list of 
+            positions it was placed in.
+        - cyclePos: positions of the move that formed a cycle while
+            'cycleDetected' is set, otherwise None.
+        - keyShift: number of bits a cell index takes in a move key,
+            see getMoveKey().
+        - plies: number of completed placements, the parity gives the
+            side to move.
+        - krist: a 'KristCounter' of the stable cells, updated by 
+            stabilize() and unstabilize(), a 'BitKristCounter' on the
+            bitboard engine.
+        - openCells: sorted list of the positions that are not 
+            stable, updated by stabilize() and unstabilize().
+        - openMask: bitmask of the cell indices in 'openCells'.
+        - stats: a 'Stats' recording union-find operations and 
+            collapse chain lengths, or None, see setStats().
+        - nodes: list of the moveNodes of 'movesTree', indexed by id.
+            The root has id 0. The entry of a spilled moveNode is the
+            id of the moveNode holding its branch, the entry of a 
+            moveNode not read yet from 'index' is None, see getNode().
+        - nodeIds: maps the mark string and then the key of a move,
+            see getMoveKey(), to the ids of the moveNodes storing it,
+            in order of creation. Moves of 'index' are found in its
+            sidecar instead, see findNodes().
+        - index: 'TreeIndex' of the saved game the tree is read from
+            lazily, or None, see openIndex().
+        - treeBudget: number of moveNodes kept in memory at most, or
+            None, see setTreeBudget().
+        - stores: stores holding branches of 'movesTree' out of 
+            memory, see addStore().
+        - inMemory: number of moveNodes in memory.
+        - coldNodes: ids of the moveNodes left by undo and jumps, 
+            least recently left first. Their branches are spilled 
+            first.
+        - positions: the position tuples of the board, indexed by
+            cell index. Moves of 'movesTree' share them, see addNode().
+        - hashKey: zobrist hash of the position, covering spooky 
+            marks, stable cells, the side to move and a pending 
+            collapse, or None until it is first read through 'hash'.
+            Once computed it is kept up to date by every move, plain
+            play without a search or table pays nothing for it.
         '''
 
         self.board_size = board_size
+        self.keyShift = max(4, (board_size*board_size - 1).bit_length())
+        self.bitboard = bitboard
+        self.winLength = winLength
         self.movesTree = MoveNode()
-        self.board = dict()
+        self.nodes = list()
+        self.nodeIds = dict()
+        self.positions = list()
+        self.board = None
         self.unionFind = UnionFind()
         self.cycleDetected = False
+        self.cyclePos = None
         self.score = {'x': 0, 'o': 0}
+        self.markPos = dict()
+        self.plies = 0
+        self.zobrist = getKeys(board_size)
+        self.hashKey = None
+        if bitboard:
+            self.krist = BitKristCounter(board_size, winLength)
+        else:
+            self.krist = KristCounter(board_size, winLength)
+        self.openCells = list()
+        self.openMask = 0
+        self.stats = None
+        self.treeBudget = None
+        self.trimAt = None
+        self.spillStore = None
+        self.stores = list()
+        self.index = None
+        self.inMemory = 0
+        self.coldNodes = collections.OrderedDict()
         
+        self.registerNode(self.movesTree)
         self.initializeStruct()
 
     def initializeStruct(self):
@@ -96,57 +280,546 @@ class Game:
         Initialize 'board' and 'unionFind'.
         '''
 
+        if self.bitboard:
+            self.board = BitBoard(self.board_size)
+        else:
+            self.board = DictBoard(self.board_size)
+
         for i in range(0, self.board_size):
             for j in range(0, self.board_size):
-                self.board[(i,j)] = Cell(i,j)
                 self.unionFind.makeSet((i,j))
 
+        self.positions = list(self.board.keys())
+        self.openCells = self.positions[:]
+        self.openMask = (1 << len(self.openCells)) - 1
+
+    def setStats(self, stats):
+        '''
+        Records union-find operations and collapse chain lengths in
+        'stats', or stops recording if None.
+        '''
+        self.stats = stats
+        self.unionFind.stats = stats
+
+    def setTreeBudget(self, maxNodes):
+        '''
+        Keeps at most 'maxNodes' moveNodes in memory, or lifts the 
+        bound if None. Cold branches are spilled to a temporary file,
+        in the directory given by $TMPDIR if set.
+        '''
+        self.treeBudget = maxNodes
+        self.trimAt = maxNodes
+        if maxNodes is not None and self.spillStore is None:
+            self.spillStore = SpillStore()
+            self.addStore(self.spillStore)
+        self.trimTree()
+
+    def addStore(self, store):
+        '''
+        Numbers 'store', a store of branches, see _spill.py.
+        '''
+        store.number = len(self.stores)
+        self.stores.append(store)
+
+    def openIndex(self, index):
+        '''
+        Reads the moves tree from 'index', a 'TreeIndex' of a saved 
+        game, as it is visited. The tree must be empty. The moveNode 
+        of each entry of the index takes its index as id.
+        '''
+        self.index = index
+        self.addStore(index)
+        self.nodes.extend([None]*(index.count-1))
+
+        root = self.movesTree.get_root()
+        children = index.entry(0)[5]
+        if children:
+            root.children = Branch(self, root, index, 1, index.count-1, 
+                children)
+
     def getCellIndex(self, pos):
         return pos[0]*self.board_size + pos[1]
 
+    def getMoveKey(self, move):
+        '''
+        Returns the key of 'move' among the children of a moveNode.
+        Each cell index takes 'keyShift' bits. A placement packs both
+        indices, a collapse packs a flag bit above its index. Assumes
+        the positions of a placement are ordered by cell index.
+        '''
+        if move.isCollapse():
+            key = (1 << self.keyShift) | self.getCellIndex(move.posList[0])
+            return key << self.keyShift
+
+        key = self.getCellIndex(move.posList[0]) << self.keyShift
+        return key | self.getCellIndex(move.posList[1])
+
+    def registerNode(self, node):
+        '''
+        Gives 'node' the next id and adds it to 'nodes' and 'nodeIds'.
+        Ids stay the same when the moveNode is spilled and loaded back.
+        '''
+        node.id = len(self.nodes)
+        self.nodes.append(node)
+        self.inMemory += 1
+
+        if node.move is None:
+            return
+        keys = self.nodeIds.get(node.move.markValue)
+        if keys is None:
+            keys = self.nodeIds[node.move.markValue] = dict()
+        nodeIds = keys.get(node.key)
+        if nodeIds is None:
+            keys[node.key] = [node.id]
+        else:
+            nodeIds.append(node.id)
+
+    def addNode(self, node, move):
+        '''
+        Adds 'move' as a child of the moveNode 'node' and returns the
+        child. The positions of a placement are ordered by cell index
+        first, see getMoveKey(). New moveNodes are registered.
+
+        The tree is the bulk of the memory of long sessions: the move
+        of a new moveNode is made to share its mark string and
+        positions with the rest of the tree.
+        '''
+        posList = move.posList
+        if (not move.isCollapse() and 
+                self.getCellIndex(posList[1]) < self.getCellIndex(posList[0])):
+            posList[0], posList[1] = posList[1], posList[0]
+
+        self.shareMove(move)
+        child = node.add_child(self.getMoveKey(move), move)
+        if child.id is None:
+            self.registerNode(child)
+            if self.trimAt is not None and self.inMemory > self.trimAt:
+                self.trimTree(child)
+
+        return child
+
+    def shareMove(self, move):
+        '''
+        Interns the mark string of 'move' and replaces its positions
+        by the tuples of 'positions'.
+        '''
+        move.markValue = sys.intern(move.markValue)
+        posList = move.posList
+        for i in range(len(posList)):
+            posList[i] = self.positions[self.getCellIndex(posList[i])]
+
+    def getNode(self, nodeId):
+        '''
+        Returns the moveNode with id 'nodeId', or None. A spilled 
+        moveNode, or one not read yet from 'index', is loaded with the
+        branches holding it.
+        '''
+        if nodeId not in range(len(self.nodes)):
+            return None
+
+        while True:
+            node = self.nodes[nodeId]
+            if type(node) is MoveNode:
+                return node
+
+            # follow the spilled branches and the parents in 'index'
+            # up to a moveNode in memory.
+            holder = nodeId
+            while type(self.nodes[holder]) is not MoveNode:
+                if self.nodes[holder] is None:
+                    holder = self.index.parents[holder]
+                else:
+                    holder = self.nodes[holder]
+            self.loadBranch(self.nodes[holder])
+
+    def findNodes(self, moveStr):
+        '''
+        Returns the ids of the moveNodes storing the move 'moveStr', in
+        order of creation, or an empty list if it is not a move.
+        MoveNodes out of memory are not loaded.
+        '''
+        if moveStr == 'INIT_STATE':
+            return [0]
+
+        move = Move()
+        try:
+            move.read(moveStr)
+            flags, number, cell0, cell1 = encodeMove(move, self.board_size)
+        except (ValueError, IndexError):
+            return []
+
+        if (move.markValue[0] not in 'xo' or len(moveStr.split('-')) not in
+                (3, 5) or any(pos[0] not in range(self.board_size) or
+                pos[1] not in range(self.board_size) for pos in move.posList)):
+            return []
+
+        posList = move.posList
+        if (not move.isCollapse() and 
+                self.getCellIndex(posList[1]) < self.getCellIndex(posList[0])):
+            posList[0], posList[1] = posList[1], posList[0]
+        keys = self.nodeIds.get(move.markValue, {})
+        nodeIds = keys.get(self.getMoveKey(move), [])
+        if self.index is not None:
+            return self.index.find(moveCode(flags, number, cell0, cell1)) + \
+                nodeIds
+        return nodeIds[:]
+
+    def stateAt(self, nodeId):
+        '''
+        Returns the 'GameState' after the moveNode 'nodeId', or None.
+        The moves are played from the nearest ancestor holding a 
+        state, the moveNode keeps the result. The board of the game
+        is not used, states can be taken while it is being played.
+        As in jumpTo(), a moveNode inside a collapse chain stands for
+        the whole chain, see chainEnd().
+        '''
+        node = self.getNode(nodeId)
+        if node is None:
+            return None
+        node = end = self.chainEnd(node)
+
+        path = list()
+        while node.state is None and node.move is not None:
+            path.append(node)
+            node = node.parent
+
+        state = node.state
+        if state is None:
+            state = initialState(self.board_size)
+            node.state = state
+
+        while len(path):
+            state = state.play(path.pop().move)
+        end.state = state
+        return state
+
     def updateMovesHistory(self, move):
         '''
-        Computes key for each pos stored in 'move'. Creates a new
-        'moveNode' as a child at the computed key to the current 
-        moveNode 'movesTree' and stores 'move'. Sets the parent of 
-        the new moveNode to 'movesTree'. Updates 'movesTree'.
+        Creates a new 'moveNode' storing 'move' as a child of the 
+        current moveNode 'movesTree', see addNode(). Updates 
+        'movesTree'.
         '''
-        def update_pos_order(posList):
-            if self.getCellIndex(posList[1]) < self.getCellIndex(posList[0]):
-                tmp = posList[0]
-                posList[0] = posList[1]
-                posList[1] = tmp
+        self.movesTree = self.addNode(self.movesTree, move)
 
+    def leaveNode(self, node):
+        '''
+        Records that 'movesTree' left the moveNode 'node'.
+        '''
+        if self.treeBudget is not None:
+            self.coldNodes[node.id] = None
+            self.coldNodes.move_to_end(node.id)
 
-        if self.movesTree is None:
-            self.movesTree = MoveNode()
+    def trimTree(self, node=None):
+        '''
+        Spills branches until 3/4 of 'treeBudget' moveNodes are left in
+        memory, the least recently left first, then the branches off
+        the current line of play. The ancestors of 'movesTree' and of
+        'node' stay in memory.
+        '''
+        if self.treeBudget is None or self.inMemory <= self.trimAt:
+            return
+
+        kept = set()
+        for path in (self.movesTree, node):
+            while path is not None:
+                kept.add(path.id)
+                path = path.parent
+
+        target = self.treeBudget*3//4
+        while self.inMemory > target and len(self.coldNodes):
+            nodeId = self.coldNodes.popitem(last=False)[0]
+            cold = self.nodes[nodeId]
+            if (nodeId not in kept and type(cold) is not int and 
+                    type(cold.children) is dict):
+                self.spillBranch(cold)
+
+        path = list()
+        current = self.movesTree
+        while current is not None:
+            path.append(current)
+            current = current.parent
+
+        while self.inMemory > target and len(path):
+            children = path.pop().children
+            if type(children) is not dict:
+                continue
+            for child in children.values():
+                if child.id not in kept and type(child.children) is dict:
+                    self.spillBranch(child)
+                    if self.inMemory <= target:
+                        break
+
+        # A line of play longer than the budget stays in memory, the
+        # next trim waits for a quarter of the budget of new moveNodes.
+        self.trimAt = max(self.treeBudget, 
+            self.inMemory + self.treeBudget//4)
+
+    def spillBranch(self, node):
+        '''
+        Writes the descendants of 'node' to 'spillStore' and replaces
+        its children by a 'Branch'. Spilled branches below are kept 
+        as they are.
+        '''
+        records = list()
+        stack = [(child, -1) for child in reversed(node.children.values())]
+        while len(stack):
+            child, parent = stack.pop()
+            children = child.children
+            if type(children) is Branch:
+                branch = (children.store.number, children.offset, 
+                    children.length, children.count)
+            else:
+                branch = (0, -1, 0, 0)
+                for grandChild in reversed(children.values()):
+                    stack.append((grandChild, len(records)))
+
+            records.append((child.id, parent) + 
+                encodeMove(child.move, self.board_size) + branch)
+            self.nodes[child.id] = node.id
+
+        offset, length = self.spillStore.write(records)
+        node.children = Branch(self, node, self.spillStore, offset, length, 
+            len(node.children))
+        self.inMemory -= len(records)
+        if self.stats is not None:
+            self.stats.count('spilledNodes', len(records))
+
+    def readBranch(self, branch, load=False):
+        '''
+        Returns the children stored in 'branch', with their 
+        descendants. The moveNodes are only added to the index if 
+        'load' is set.
+        '''
+        children = dict()
+        nodes = list()
+        for (nodeId, parent, flags, number, cell0, cell1, 
+                store, offset, length, count) in branch.read():
+            move = decodeMove(flags, number, cell0, cell1, self.board_size)
+            self.shareMove(move)
+
+            child = MoveNode()
+            child.id = nodeId
+            child.move = move
+            child.key = self.getMoveKey(move)
+            if offset >= 0:
+                child.children = Branch(self, child, self.stores[store], 
+                    offset, length, count)
+
+            if parent < 0:
+                child.parent = branch.node
+                children[child.key] = child
+            else:
+                child.parent = nodes[parent]
+                if child.parent.children is NO_CHILDREN:
+                    child.parent.children = dict()
+                child.parent.children[child.key] = child
 
-        # Compute key for the move to be processed.
+            nodes.append(child)
+            if load:
+                self.nodes[nodeId] = child
+
+        if load:
+            self.inMemory += len(nodes)
+        return children
+
+    def loadBranch(self, node):
+        '''
+        Loads the spilled children of 'node' back into the tree.
+        '''
+        node.children = self.readBranch(node.children, True)
+
+    def walkTree(self):
+        '''
+        Generates (moveNode, depth) for every moveNode of the tree, in
+        depth-first order. Spilled branches are read without being 
+        loaded.
+        '''
+        stack = [(self.movesTree.get_root(), 0)]
+        while len(stack):
+            node, depth = stack.pop()
+            yield node, depth
+
+            children = node.children
+            if type(children) is Branch:
+                children = self.readBranch(children)
+            for child in reversed(children.values()):
+                stack.append((child, depth+1))
+
+    def markKey(self, markValue):
+        '''
+        Returns the zobrist key of the spooky mark 'markValue'.
+        '''
+        posList = self.markPos[markValue]
+        if len(posList) == 1:
+            return self.zobrist.half(self.getCellIndex(posList[0]), 
+                player(markValue))
+
+        return self.zobrist.edge(self.getCellIndex(posList[0]), 
+            self.getCellIndex(posList[1]), player(markValue))
+
+    def isLive(self, markValue):
+        '''
+        Returns True if no position of the spooky mark 'markValue' is
+        stable.
+        '''
+        for pos in self.markPos[markValue]:
+            if self.board.getStable(pos) is not None:
+                return False
+        return True
+
+    def statusKey(self):
+        '''
+        Returns the part of the hash covering the side to move and a
+        pending collapse.
+        '''
         key = 0
-        if move.isCollapse():
-            key = 1
-            key = key << 4
-            key += self.getCellIndex(move.posList[0])
-            key = key << 4
+        if self.plies % 2:
+            key ^= self.zobrist.side
 
-        else:
-            update_pos_order(move.posList)
+        if self.cycleDetected:
+            key ^= self.zobrist.collapse(self.getCellIndex(self.cyclePos[0]), 
+                self.getCellIndex(self.cyclePos[1]))
+
+        return key
+
+    def computeHash(self):
+        '''
+        Computes the hash of the position from scratch.
+        '''
+        key = self.statusKey()
+        for markValue in self.markPos.keys():
+            if self.isLive(markValue):
+                key ^= self.markKey(markValue)
+
+        for pos in self.board.keys():
+            markValue = self.board.getStable(pos)
+            if markValue is not None:
+                key ^= self.zobrist.stable(self.getCellIndex(pos), 
+                    player(markValue))
+
+        return key
+
+    @property
+    def hash(self):
+        '''
+        Zobrist hash of the position, see 'hashKey'.
+        '''
+        if self.hashKey is None:
+            self.hashKey = self.computeHash()
+        return self.hashKey
 
-            key = self.getCellIndex(move.posList[0])
-            key = key << 4
-            key += self.getCellIndex(move.posList[1])
+    def stabilize(self, pos, markValue):
+        '''
+        Turns 'pos' into the classical 'markValue'. Spooky marks in
+        'pos' leave the hash.
+        '''
+        i = self.getCellIndex(pos)
+        if self.hashKey is not None:
+            for mark in self.board.getMarks(pos):
+                if self.isLive(mark):
+                    self.hashKey ^= self.markKey(mark)
+            self.hashKey ^= self.zobrist.stable(i, player(markValue))
+
+        self.board.setStable(pos, markValue)
+        self.krist.add(i, player(markValue))
+
+        del self.openCells[bisect.bisect_left(self.openCells, pos)]
+        self.openMask &= ~(1 << i)
 
-        # Add move to the tree.
-        self.movesTree.add_child(key, move)
+    def unstabilize(self, pos):
+        '''
+        Brings 'pos' back to quantum state, inverse of stabilize().
+        '''
+        i = self.getCellIndex(pos)
+        markValue = self.board.getStable(pos)
+        self.board.clearStable(pos)
+        self.krist.remove(i, player(markValue))
 
-        # Update movesTree
-        self.movesTree = self.movesTree.children[key]
+        bisect.insort(self.openCells, pos)
+        self.openMask |= 1 << i
+
+        if self.hashKey is not None:
+            self.hashKey ^= self.zobrist.stable(i, player(markValue))
+            for mark in self.board.getMarks(pos):
+                if self.isLive(mark):
+                    self.hashKey ^= self.markKey(mark)
 
     def entangle(self, pos0, pos1):
         '''
-        Connects pos0 and pos1.
+        Connects pos0 and pos1. The union is logged under the current
+        moveNode 'movesTree'.
         '''
-        self.cycleDetected = not self.unionFind.union(pos0, pos1)
+        self.cycleDetected = not self.unionFind.union(pos0, pos1, 
+            self.movesTree)
+        self.cyclePos = [pos0, pos1] if self.cycleDetected else None
+
+    def rebuildUnionFind(self):
+        '''
+        Recreates the UnionFind data structure from the moves played
+        from the root up to 'movesTree'.
+        '''
+        self.unionFind = UnionFind(self.stats)
+        self.cycleDetected = False
+        self.cyclePos = None
+        if self.stats is not None:
+            self.stats.count('rebuildUnionFind')
+
+        for i in range(self.board_size):
+            for j in range(self.board_size):
+                self.unionFind.makeSet((i, j))
+
+        path = list()
+        node = self.movesTree
+        while node.move is not None:
+            path.append(node)
+            node = node.parent
+
+        current = self.movesTree
+        while len(path):
+            self.movesTree = path.pop()
+            if not self.movesTree.move.isCollapse():
+                self.entangle(self.movesTree.move.posList[0], 
+                    self.movesTree.move.posList[1])
+        self.movesTree = current
+
+    def checkMove(self, move):
+        '''
+        Returns None if 'move' can be played from the current
+        position, otherwise the reason it cannot. A placement must be
+        the next mark of the side to move, in two distinct cells that
+        are not stable. A collapse is the first evaluated cell of its
+        chain: the mark of the move that formed the cycle, in one of
+        its positions.
+        '''
+        for pos in move.posList:
+            if (pos[0] not in range(self.board_size) or
+                pos[1] not in range(self.board_size)):
+                return '({},{}) out of bounds.'.format(pos[0], pos[1])
+
+            if self.board.getStable(pos) is not None:
+                return '({},{}) is stable.'.format(pos[0], pos[1])
+
+        if move.isCollapse():
+            markValue = ('x' if self.plies % 2 else 'o') + str(self.plies)
+            if not self.cycleDetected or move.posList[0] not in self.cyclePos:
+                return '({},{}) does not begin a collapse.'.format(
+                    move.posList[0][0], move.posList[0][1])
+            if move.markValue != markValue:
+                return 'the collapse is of '+markValue+'.'
+            return None
+
+        if self.cycleDetected:
+            return 'a collapse is pending.'
+        if self.gameOver():
+            return 'the game is over.'
+        if move.posList[0] == move.posList[1]:
+            return 'both marks of {} are in ({},{}).'.format(move.markValue,
+                move.posList[0][0], move.posList[0][1])
+
+        markValue = ('o' if self.plies % 2 else 'x') + str(self.plies+1)
+        if move.markValue != markValue:
+            return 'the next move is '+markValue+'.'
+        return None
 
     def updateState(self, markValue, posList, collapse = False):
 
@@ -155,14 +828,16 @@ class Game:
         updated and the moves history is also updated.
         '''
 
-        # check if 'pos' is already stable.
+        # check if 'pos' is on the board and not already stable.
         for pos in posList:
-            if self.board[pos].stable is not None:
-                print('Error: ({},{}) is stable.'.format(pos[0], pos[1]))
+            if (pos[0] not in range(self.board_size) or 
+                pos[1] not in range(self.board_size)):
+                print('Error: ({},{}) out of bounds.'.format(pos[0], pos[1]))
                 return False
 
-            if pos[0] < 0 or pos[1] >= self.board_size:
-                print('Error: ({},{}) out of bounds.'.format(pos[0], pos[1]))
+            if self.board.getStable(pos) is not None:
+                print('Error: ({},{}) is stable.'.format(pos[0], pos[1]))
+                return False
 
         # checks if the marks are placed in distinct cells.
         if len(posList) == 2:
@@ -174,16 +849,29 @@ class Game:
         # update board configuration with the move.
         move = Move(markValue, posList)
         if collapse:
-            if pos in self.movesTree.move.posList:
+            if self.cycleDetected and pos in self.cyclePos:
                 self.evaluateCell(move)
             else:
                 print('Error: Illegal move at ({0},{1}) to begin collapse.'.format(pos[0], pos[1]))
                 return False
         else:
-            self.board[posList[-1]].marksList.append(markValue)
+            hashing = self.hashKey is not None
+            if hashing:
+                status = self.statusKey()
+                if markValue in self.markPos:
+                    self.hashKey ^= self.markKey(markValue)
+
+            self.board.addMark(posList[-1], markValue)
+            self.markPos.setdefault(markValue, []).append(posList[-1])
+
             if len(posList) == 2:
-                self.entangle(posList[0], posList[1])
                 self.updateMovesHistory(move)
+                self.entangle(posList[0], posList[1])
+                self.plies += 1
+
+            if hashing:
+                self.hashKey ^= (self.markKey(markValue) ^ status ^
+                    self.statusKey())
 
         return True
 
@@ -191,16 +879,20 @@ class Game:
         '''
         Performs a previous move operation. Firstly, ensures that the
         'movesTree' has a parent. Brings states of the last played move
-        markValue back to quantum state. Recreates the UnionFind data 
-        structure.
+        markValue back to quantum state. Rolls back the union of the 
+        undone move, and restores 'cycleDetected' from the UnionFind 
+        history.
         '''
         moveNum = 0
+        hashing = self.hashKey is not None
+        if hashing:
+            status = self.statusKey()
         
         # Perform 'anti-collapse' move
         lastMove = self.movesTree
         undoCompleted = False
         while self.movesTree.move.isCollapse() and self.movesTree.parent is not None:
-            self.board[self.movesTree.move.posList[0]].stable = None
+            self.unstabilize(self.movesTree.move.posList[0])
             self.movesTree = self.movesTree.parent
 
             undoCompleted = True
@@ -208,32 +900,34 @@ class Game:
         if undoCompleted:
             moveNum  = int(self.movesTree.move.markValue[1:])+1
         else:
-            self.board[self.movesTree.move.posList[0]].marksList.remove(self.movesTree.move.markValue)
-            self.board[self.movesTree.move.posList[1]].marksList.remove(self.movesTree.move.markValue)
+            self.board.removeMark(self.movesTree.move.posList[0], self.movesTree.move.markValue)
+            self.board.removeMark(self.movesTree.move.posList[1], self.movesTree.move.markValue)
+            if hashing:
+                self.hashKey ^= self.markKey(self.movesTree.move.markValue)
+            del self.markPos[self.movesTree.move.markValue]
+            self.plies -= 1
             moveNum  = int(self.movesTree.move.markValue[1:])
 
-            self.movesTree = self.movesTree.parent
-
-        # Destroy the UnionFind data.
-        # Now reconnect each pair cells connected via superposition. Define
-        # a nested function that stores each pair of cells on the grid until
-        # the move that was undone.
-        self.unionFind = UnionFind()
-        self.cycleDetected = False
-
-        # Reinitialize unionFind
-        for i in range(self.board_size):
-            for j in range(self.board_size):
-                self.unionFind.makeSet((i, j))
-
-        moves = self.movesTree.get_moves()
-        while len(moves):
-            move = moves.pop()
-            if not move.isCollapse():
-                self.entangle(move.posList[0], move.posList[1])
+            # Revert the union played by the undone move. If the log
+            # does not belong to this line of play, rebuild it.
+            if self.unionFind.lastKey() is self.movesTree:
+                self.unionFind.rollback()
+                self.movesTree = self.movesTree.parent
+            else:
+                self.movesTree = self.movesTree.parent
+                self.rebuildUnionFind()
 
+        self.cycleDetected = self.unionFind.lastCycle()
         if self.cycleDetected and self.movesTree.move.isCollapse():
             self.cycleDetected = False
+        self.cyclePos = self.movesTree.move.posList if self.cycleDetected else None
+
+        while lastMove.parent is not self.movesTree:
+            lastMove = lastMove.parent
+        self.leaveNode(lastMove)
+
+        if hashing:
+            self.hashKey ^= status ^ self.statusKey()
 
         return moveNum
 
@@ -242,105 +936,420 @@ class Game:
         Perform the collapse move. Bring 'markValue' in 'pos0' back to
         classical state. Bring every other mark in 'pos0' back to their
         classical states wherever they exist apart from 'pos0'. 
-        Recursively perform this operation until each cell in the cycle
-        is evaluated.
+        Repeat this operation until each cell in the cycle is evaluated.
 
         Scores are updated as a cell is turned into a classical state.
         '''
-        self.updateMovesHistory(move)
-
-        # Get a list marks in the target cell. Remove the mark that is
-        # collapsing in the target cell.
-        marksList = self.board[move.posList[0]].marksList[:]
-        marksList.remove(move.markValue)
+        self.collapse(move.markValue, move.posList[0], True)
 
-        # Assign the classical state of the target cell.
-        self.board[move.posList[0]].stable = move.markValue
+    def collapse(self, markValue, pos, record=False):
+        '''
+        Collapses 'markValue' into 'pos', see evaluateCell(). Each
+        evaluated cell is added to 'movesTree' if 'record' is set.
+        Returns the list of evaluated positions in order.
 
-        # For each mark in 'marksList', find their respective twin location.
-        # Recursively play a collapse move on that cell.
-        for mark in marksList:
-            for pos1 in self.board.keys():
-                if mark in self.board[pos1].marksList and not self.board[pos1].stable:
-                    self.evaluateCell(Move(mark, [pos1]))
-                    break
+        Pending collapses are kept on a stack, in the order the
+        recursive definition visits them. 'markPos' gives the twin
+        location of each mark.
+        '''
+        hashing = self.hashKey is not None
+        if hashing:
+            status = self.statusKey()
+        evaluated = list()
+        stack = [(markValue, pos)]
+        while len(stack):
+            markValue, pos0 = stack.pop()
+
+            # The twin may have been evaluated earlier in the chain.
+            if self.board.getStable(pos0):
+                continue
+
+            if record:
+                self.updateMovesHistory(Move(markValue, [pos0]))
+
+            # Get a list marks in the target cell. Remove the mark that
+            # is collapsing in the target cell.
+            marksList = list(self.board.getMarks(pos0))
+            marksList.remove(markValue)
+
+            # Assign the classical state of the target cell.
+            self.stabilize(pos0, markValue)
+            evaluated.append(pos0)
+
+            # For each mark in 'marksList', push a collapse move on its
+            # twin location.
+            for mark in reversed(marksList):
+                for pos1 in self.markPos[mark]:
+                    if pos1 != pos0:
+                        stack.append((mark, pos1))
 
         # Collapse procedure has terminated.
         self.cycleDetected = False
+        self.cyclePos = None
+        if hashing:
+            self.hashKey ^= status ^ self.statusKey()
+        if self.stats is not None:
+            self.stats.observe('collapseChain', len(evaluated))
+
+        return evaluated
+
+    def playNode(self, node):
+        '''
+        Plays the move stored in 'node', a child of 'movesTree', and
+        sets 'movesTree' to 'node'. A collapse chain is played one 
+        evaluated cell per node, as recorded by evaluateCell().
+        '''
+        move = node.move
+        hashing = self.hashKey is not None
+        if hashing:
+            status = self.statusKey()
+
+        if move.isCollapse():
+            self.cycleDetected = False
+            self.cyclePos = None
+            self.stabilize(move.posList[0], move.markValue)
+            self.movesTree = node
+
+        else:
+            pos0 = move.posList[0]
+            pos1 = move.posList[1]
+            self.board.addMark(pos0, move.markValue)
+            self.board.addMark(pos1, move.markValue)
+            self.markPos[move.markValue] = [pos0, pos1]
+            if hashing:
+                self.hashKey ^= self.markKey(move.markValue)
+
+            self.movesTree = node
+            self.entangle(pos0, pos1)
+            self.plies += 1
+
+        if hashing:
+            self.hashKey ^= status ^ self.statusKey()
+
+    def playPath(self, node):
+        '''
+        Plays the moves from the root of 'movesTree' down to 'node'.
+        Assumes the board is at the root.
+        '''
+        path = list()
+        while node.move is not None:
+            path.append(node)
+            node = node.parent
+
+        while len(path):
+            self.playNode(path.pop())
 
-    def printTree(self, file=None):
+    def make_move(self, markValue, posList, collapse=False, record=False):
+        '''
+        Plays the placement of 'markValue' at the two positions of
+        'posList', or its collapse at posList[0] if 'collapse' is set.
+        The move is assumed to be legal. It is only added to 
+        'movesTree' if 'record' is set.
+
+        Returns an undo record for unmake_move(). Moves must be unmade
+        in the reverse order they were made.
+        '''
+        undo = (collapse, markValue, posList, record, self.hashKey, 
+            self.cycleDetected, self.cyclePos)
+
+        if collapse:
+            return undo + (self.collapse(markValue, posList[0], record),)
+
+        pos0 = posList[0]
+        pos1 = posList[1]
+        hashing = self.hashKey is not None
+        if hashing:
+            status = self.statusKey()
+
+        self.board.addMark(pos0, markValue)
+        self.board.addMark(pos1, markValue)
+        self.markPos[markValue] = [pos0, pos1]
+
+        key = None
+        if record:
+            self.updateMovesHistory(Move(markValue, [pos0, pos1]))
+            key = self.movesTree
+
+        self.cycleDetected = not self.unionFind.union(pos0, pos1, key)
+        self.cyclePos = [pos0, pos1] if self.cycleDetected else None
+        self.plies += 1
+        if hashing:
+            self.hashKey ^= (self.markKey(markValue) ^ status ^
+                self.statusKey())
+
+        return undo + (None,)
+
+    def unmake_move(self, undo):
+        '''
+        Reverts the move that returned the undo record 'undo'.
+        '''
+        (collapse, markValue, posList, record, hashKey, cycleDetected, 
+            cyclePos, evaluated) = undo
+
+        if collapse:
+            for pos in reversed(evaluated):
+                self.unstabilize(pos)
+                if record:
+                    self.movesTree = self.movesTree.parent
+
+        else:
+            self.unionFind.rollback()
+            self.board.removeMark(posList[0], markValue)
+            self.board.removeMark(posList[1], markValue)
+            del self.markPos[markValue]
+            self.plies -= 1
+            if record:
+                self.movesTree = self.movesTree.parent
+
+        self.cycleDetected = cycleDetected
+        self.cyclePos = cyclePos
+        self.hashKey = hashKey
+
+    def getWinner(self):
+        '''
+        Returns 'x' or 'o' if that player has more of the longest
+        krists, otherwise None.
+        '''
+        maxLen, bestkrist = self.kristScore()
+        if bestkrist['x'] > bestkrist['o']:
+            return 'x'
+        if bestkrist['o'] > bestkrist['x']:
+            return 'o'
+        return None
+
+    def gameOver(self):
+        '''
+        Returns True once at most one cell is left to play, or a krist
+        of 'winLength' was made.
+        '''
+        if self.winLength is not None and self.krist.maxLen >= self.winLength:
+            return True
+        return self.board_size*self.board_size - self.krist.numStable <= 1
+
+    def kristScore(self):
+        '''
+        Returns the length of the longest krist on the board, and the
+        number of krists of that length made by each player.
+        '''
+        return self.krist.score()
+
+    def computeKristScore(self):
+        '''
+        Computes kristScore() from scratch by walking the four 
+        directions from every stable cell. Krists longer than 
+        'winLength' are not capped.
+        '''
+
+        def evaluateCell(row, col, changePos, valueDict, initMark):
+            currVal = 1
+            while (row in range(self.board_size) and 
+                col in range(self.board_size)):
+                
+                if self.board.getStable((row,col)) is None:
+                    break
+
+                mark = self.board.getStable((row,col))[0]
+                if mark == initMark:
+                    valueDict[(row,col)] = max(currVal, valueDict[(row,col)])
+                    currVal += 1
+                    row += changePos[0]
+                    col += changePos[1]
+                else:
+                    break
+
+        value = dict()
+        for i in range(self.board_size):
+            for j in range(self.board_size):
+                value[(i,j)] = 0
+
+        for i in range(self.board_size):
+            for j in range(self.board_size):
+                if self.board.getStable((i,j)) is not None:
+                    mark = self.board.getStable((i,j))[0]
+                    evaluateCell(i,j,(0,1),value,mark)
+                    evaluateCell(i,j,(1,0),value,mark)
+                    evaluateCell(i,j,(1,1),value,mark)
+                    evaluateCell(i,j,(1,-1),value,mark)
+
+        maxLen = 1
+        bestkrist = {'x':0, 'o':0}
+        for k in value.keys():
+            if self.board.getStable(k) is None:
+                continue
+
+            mark = self.board.getStable(k)[0]
+            
+            if value[k] == maxLen:
+                bestkrist[mark] += 1
+
+            elif value[k] > maxLen:
+                maxLen = value[k]
+                bestkrist['x'] = 0
+                bestkrist['o'] = 0
+                bestkrist[mark] = 1
+
+        return maxLen, bestkrist
+
+    def printTree(self, file=None, echo=True):
         '''
         Output moves in chronological order, using depth-first traversal.
+        The tree is written to 'file' if given, and to stdio if 'echo'
+        is set.
         '''
-        root = self.movesTree.get_root()
-        def dfs(node, depth):
-            if node is None:
-                return
+        if file is not None:
+            file.write('SIZE='+str(self.board_size)+'\n')
 
+        for node, depth in self.walkTree():
             if node.move is None:
                 if file is not None:
                     file.write('INIT_STATE ')
-                print('INIT_STATE', end=' ')
+                if echo:
+                    print('INIT_STATE', end=' ')
 
             else:
                 if file is not None:
                     file.write(('.'*depth)+str(node.move)+' ')
-                print(('.'*depth)+str(node.move), end=' ')
+                if echo:
+                    print(('.'*depth)+str(node.move), end=' ')
 
             if node.move == self.movesTree.move:
                 if file is not None:
                     file.write('<---')
-                print('<---')
-            else:
+                if echo:
+                    print('<---')
+            elif echo:
                 print()
 
             if file is not None:
                 file.write('\n')
 
-            for key in node.children.keys():
-                dfs(node.children[key], depth+1)
-
-        if file is not None:
-            file.write('SIZE='+str(self.board_size)+'\n')
+    def resetTree(self, moveStr):
+        '''
+        resets the position of the board to the first move created
+        whose string is 'moveStr', see jumpTo(). Returns False if there
+        is none.
+        '''
+        nodeIds = self.findNodes(moveStr)
+        if not nodeIds:
+            return False
 
-        dfs(root, 0)
+        self.jumpTo(nodeIds[0])
+        return True
 
-    def resetTree(self, moveStr):
+    def backNode(self):
         '''
-        resets the display position of the board to the 
-        move whose string is 'moveStr'
+        Undoes the move of 'movesTree' alone, a single evaluated cell
+        for a collapse, and sets 'movesTree' to its parent.
         '''
-        def dfs(node):
-            if node.move.__str__() == moveStr:
-                self.movesTree = node
+        node = self.movesTree
+        move = node.move
+        hashing = self.hashKey is not None
+        if hashing:
+            status = self.statusKey()
+
+        if move.isCollapse():
+            self.unstabilize(move.posList[0])
+            self.movesTree = node.parent
 
+        else:
+            self.board.removeMark(move.posList[0], move.markValue)
+            self.board.removeMark(move.posList[1], move.markValue)
+            if hashing:
+                self.hashKey ^= self.markKey(move.markValue)
+            del self.markPos[move.markValue]
+            self.plies -= 1
+
+            self.movesTree = node.parent
+            if self.unionFind.lastKey() is node:
+                self.unionFind.rollback()
             else:
-                for key in node.children.keys():
-                    dfs(node.children[key])
+                self.rebuildUnionFind()
 
-        root = self.movesTree.get_root()
-        dfs(root)
+        # A cycle is pending only right after the placement closing it.
+        move = self.movesTree.move
+        self.cycleDetected = (move is not None and not move.isCollapse() 
+            and self.unionFind.lastCycle())
+        self.cyclePos = move.posList if self.cycleDetected else None
+
+        self.leaveNode(node)
+        if hashing:
+            self.hashKey ^= status ^ self.statusKey()
+
+    def jumpTo(self, nodeId):
+        '''
+        Sets the board to the position after the moveNode 'nodeId'.
+        Moves of 'movesTree' are undone up to the common ancestor of
+        both moveNodes, then the moves down to 'nodeId' are played.
+        Spilled branches on the way are loaded, others may be spilled
+        once there. A moveNode inside a collapse chain stands for the
+        whole chain, the board is set after its last evaluated cell,
+        see chainEnd().
+        '''
+        path = list()
+        node = self.getNode(nodeId)
+        if node is not None:
+            node = self.chainEnd(node)
+        while node is not None:
+            path.append(node)
+            node = node.parent
+
+        onPath = set(node.id for node in path)
+        while self.movesTree.id not in onPath:
+            self.backNode()
+
+        i = 0
+        while path[i] is not self.movesTree:
+            i += 1
+
+        while i:
+            i -= 1
+            self.playNode(path[i])
+
+        self.trimTree()
+
+    def chainEnd(self, node):
+        '''
+        Returns the moveNode of the last evaluated cell of the collapse
+        chain through 'node', or 'node' if it is not a collapse. The
+        cells of a chain only become stable together, a position in
+        the middle of a chain is not a position of the game.
+        '''
+        while node.move is not None and node.move.isCollapse():
+            for child in node.children.values():
+                if child.move.isCollapse():
+                    node = child
+                    break
+            else:
+                break
+        return node
 
     def getMoves(self):
         '''
         Return a list of legal moves from the current
-        state of the board.
-
-        NEED TO TEST
+        state of the board: the positions of the move to collapse if
+        'cycleDetected', otherwise every position that is not stable,
+        in row-major order.
+        '''
+        return self.moveCells()[:]
 
-        Implement in server.py for player-computer 
-        interaction.
+    def moveCells(self):
+        '''
+        Same as getMoves(), without copying. The list is owned by the 
+        game and changes as moves are played, it must not be modified.
         '''
         if self.cycleDetected:
-            return self.movesTree.move.posList
+            return self.cyclePos
 
-        else:
-            posList = list()
-            for row in range(self.board_size):
-                for col in range(self.board_size):
-                    if not self.board[(row,col)].stable:
-                        posList.append((row,col))
+        return self.openCells
+
+    def moveMask(self):
+        '''
+        Returns the cells of getMoves() as a bitmask of cell indices.
+        '''
+        if self.cycleDetected:
+            return ((1 << self.getCellIndex(self.cyclePos[0])) | 
+                (1 << self.getCellIndex(self.cyclePos[1])))
 
-            return posList
+        return self.openMask
 
 # -------------------------------------------------------------------
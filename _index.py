@@ -0,0 +1,283 @@
+'''
+_index.py opens saved games lazily, for browsing large analysis files
+without building their whole moves tree.
+
+Features:
+- an index of the saved moves tree, built in one pass over a text or
+    binary saved game and kept in a sidecar file next to it.
+- the sidecar is memory-mapped, later opens of an unchanged file only
+    read its header.
+- search of the entries by move, see Game.findNodes().
+- the index serves the children of any saved move as a branch of
+    _spill.py: moveNodes are created the first time the game goes
+    into them, see Game.openIndex().
+
+Sidecar format (little-endian), '<file>.q3i':
+- header: magic 'Q3TI', version, board size, number of entries, index
+    of the current entry, size and modification time of the saved
+    game it was built from.
+- parents: index of the parent entry of each entry, -1 for the root.
+- entries, in the depth-first order of printTree(): the move as in
+    _record.py, the index of the first entry after its subtree and its
+    number of children.
+- moves: the code of the move of every entry but the root, see
+    moveCode() in _record.py, sorted, then the index of the entry of
+    each code.
+
+The id of the moveNode of an entry is its index. The moves are
+checked to be legal when the index is built, see TreeReplay in
+_record.py. Saved games written by printTree() never repeat a move
+among siblings, of a repeated move only the first subtree is indexed.
+'''
+
+import bisect
+import mmap
+import os
+import struct
+
+from _game import Game
+from _record import (RecordFile, RecordError, TreeReplay, COLLAPSE,
+    isRecord, textRecords, decodeMove, moveCode)
+
+MAGIC = b'Q3TI'
+VERSION = 3
+HEADER = struct.Struct('<4sHHIIqq')
+PARENT = struct.Struct('<i')
+ENTRY = struct.Struct('<BxHHHII')
+CODE = struct.Struct('<Q')
+ID = struct.Struct('<I')
+
+def indexPath(filePath):
+    return filePath + '.q3i'
+
+def sidecarSize(count):
+    return (HEADER.size + (PARENT.size + ENTRY.size)*count +
+        (CODE.size + ID.size)*(count-1))
+
+def buildIndex(filePath, maxSize=None):
+    '''
+    Reads the saved game 'filePath' and returns the bytes of its
+    sidecar. Raises RecordError at the first move out of order or not
+    legal, or if the board is larger than 'maxSize'.
+    '''
+    if isRecord(filePath):
+        record = RecordFile(filePath)
+        try:
+            board_size, records, current = (record.board_size,
+                list(record), record.current)
+        finally:
+            record.close()
+    else:
+        file = open(filePath, 'r')
+        try:
+            board_size, records, current = textRecords(file)
+        except ValueError:
+            raise RecordError('Invalid board size.')
+        finally:
+            file.close()
+
+    if board_size < 1:
+        raise RecordError('Invalid board size.')
+    if maxSize is not None and board_size > maxSize:
+        raise RecordError('Board size out of range.')
+
+    if not len(records) or records[0][1] >= 0:
+        raise RecordError('Missing INIT_STATE.')
+    if current >= len(records):
+        raise RecordError('Invalid current record.')
+
+    # entries of the index, the moves being played to check they are
+    # legal. 'entries' gives the entry of each record: a repeated move
+    # among siblings maps to the entry of the first one, and so does
+    # the same line below it. Lines only in a repeated subtree map to
+    # None.
+    replay = TreeReplay(Game(board_size), record=False)
+    kept = [records[0]]
+    entries = [0] + [None]*(len(records)-1)
+    isEntry = [True] + [False]*(len(records)-1)
+    siblings = dict()
+    parents = [0]
+    for i in range(1, len(records)):
+        depth, parent, flags, number, cell0, cell1 = records[i]
+        if depth < 1 or depth > len(parents) or parent != parents[depth-1]:
+            raise RecordError('Invalid parent in record.')
+        del parents[depth:]
+        parents.append(i)
+
+        entry = entries[parent]
+        if entry is None:
+            continue
+        if not flags & COLLAPSE and cell1 < cell0:
+            cell0, cell1 = cell1, cell0
+        key = (entry, flags, number, cell0, cell1)
+        if key in siblings:
+            entries[i] = siblings[key]
+            continue
+        if not isEntry[parent]:
+            continue
+
+        replay.add(depth, decodeMove(flags, number, cell0, cell1, board_size))
+        entries[i] = siblings[key] = len(kept)
+        isEntry[i] = True
+        kept.append((depth, entry, flags, number, cell0, cell1))
+
+    while entries[current] is None:
+        current = records[current][1]
+    current = entries[current]
+    records = kept
+    count = len(records)
+
+    # end of each subtree, and number of children.
+    ends = [count]*count
+    children = [0]*count
+    stack = list()
+    for i, (depth, parent, flags, number, cell0, cell1) in enumerate(records):
+        while len(stack) and records[stack[-1]][0] >= depth:
+            ends[stack.pop()] = i
+        stack.append(i)
+        if parent >= 0:
+            children[parent] += 1
+
+    codes = sorted((moveCode(*record[2:]), i)
+        for i, record in enumerate(records) if i)
+
+    stat = os.stat(filePath)
+    data = bytearray(sidecarSize(count))
+    HEADER.pack_into(data, 0, MAGIC, VERSION, board_size, count, current,
+        stat.st_size, stat.st_mtime_ns)
+
+    offset = HEADER.size
+    for record in records:
+        PARENT.pack_into(data, offset, record[1])
+        offset += PARENT.size
+    for i, record in enumerate(records):
+        ENTRY.pack_into(data, offset, *(record[2:] + (ends[i], children[i])))
+        offset += ENTRY.size
+    for code, i in codes:
+        CODE.pack_into(data, offset, code)
+        offset += CODE.size
+    for code, i in codes:
+        ID.pack_into(data, offset, i)
+        offset += ID.size
+
+    return data
+
+class TreeIndex:
+    def __init__(self, filePath, maxSize=None):
+        '''
+        Index of the saved game 'filePath'. The sidecar is used if it
+        matches the file, otherwise it is rebuilt, and kept in memory
+        if it cannot be written. Raises RecordError if the board is
+        larger than 'maxSize'.
+        - board_size, current: from the saved game.
+        - count: number of entries.
+        - parents: parent of each entry, a view of the sidecar.
+        - codes, ids: the moves column of the sidecar, see find().
+        - number: set by Game.addStore().
+        '''
+        self.file = None
+        self.mmap = None
+        self.number = None
+
+        stat = os.stat(filePath)
+        self.data = self.openSidecar(indexPath(filePath), stat)
+        if self.data is None:
+            self.data = buildIndex(filePath, maxSize)
+            self.writeSidecar(indexPath(filePath))
+
+        magic, version, self.board_size, self.count, self.current, size, \
+            mtime = HEADER.unpack_from(self.data, 0)
+        if maxSize is not None and self.board_size > maxSize:
+            if self.mmap is not None:
+                self.mmap.close()
+                self.file.close()
+            raise RecordError('Board size out of range.')
+
+        self.entries = HEADER.size + PARENT.size*self.count
+        self.view = memoryview(self.data)
+        self.parents = self.view[HEADER.size:self.entries].cast('i')
+        start = self.entries + ENTRY.size*self.count
+        end = start + CODE.size*(self.count-1)
+        self.codes = self.view[start:end].cast('Q')
+        self.ids = self.view[end:].cast('I')
+
+    def openSidecar(self, sidecarPath, stat):
+        '''
+        Maps the sidecar at 'sidecarPath', returns None if missing or
+        built from another version of the saved game.
+        '''
+        try:
+            file = open(sidecarPath, 'rb')
+        except OSError:
+            return None
+
+        header = file.read(HEADER.size)
+        if len(header) == HEADER.size:
+            magic, version, board_size, count, current, size, mtime = \
+                HEADER.unpack(header)
+            length = sidecarSize(count)
+            if (magic == MAGIC and version == VERSION and
+                    size == stat.st_size and mtime == stat.st_mtime_ns and
+                    os.fstat(file.fileno()).st_size == length):
+                self.file = file
+                self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                return self.mmap
+
+        file.close()
+        return None
+
+    def writeSidecar(self, sidecarPath):
+        '''
+        Writes 'data' to the sidecar. It is replaced in one step, maps
+        of the previous sidecar stay valid.
+        '''
+        tmpPath = sidecarPath + '.tmp'
+        try:
+            file = open(tmpPath, 'wb')
+            file.write(self.data)
+            file.close()
+            os.replace(tmpPath, sidecarPath)
+        except OSError:
+            pass
+
+    def entry(self, i):
+        '''
+        Returns (flags, number, cell0, cell1, end, children) of entry
+        'i'.
+        '''
+        return ENTRY.unpack_from(self.data, self.entries + ENTRY.size*i)
+
+    def read(self, offset, length):
+        '''
+        Returns the children stored in the entries 'offset' to
+        'offset'+'length', the subtrees of 'length' entries, as
+        records of _spill.py. Their own children are branches of the
+        index.
+        '''
+        records = list()
+        i = offset
+        while i < offset+length:
+            flags, number, cell0, cell1, end, children = self.entry(i)
+            branch = (self.number, i+1, end-i-1, children) if children \
+                else (0, -1, 0, 0)
+            records.append((i, -1, flags, number, cell0, cell1) + branch)
+            i = end
+        return records
+
+    def find(self, code):
+        '''
+        Returns the indices of the entries whose move has the code
+        'code', in increasing order.
+        '''
+        start = bisect.bisect_left(self.codes, code)
+        end = bisect.bisect_right(self.codes, code, start)
+        return list(self.ids[start:end])
+
+    def close(self):
+        self.codes.release()
+        self.ids.release()
+        self.parents.release()
+        self.view.release()
+        if self.mmap is not None:
+            self.mmap.close()
+            self.file.close()
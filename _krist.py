@@ -0,0 +1,151 @@
+'''
+_krist.py implements incremental krist scoring.
+
+Features:
+- run lengths of the stable cells of each line, in the four directions
+    walked by krist scoring, updated as single cells become stable or
+    quantum again.
+- an update only walks the runs through the changed cell, at most the
+    maximum length in each direction, and needs no table of the board.
+- longest krist, number of krists of that length per player and the
+    number of stable cells in O(1).
+
+A krist of length L ends at a cell if the L cells ending there in one
+direction are stable and owned by a single player. The krists of a
+player are the cells where a krist of the longest length ends, as
+counted by Game.kristScore().
+'''
+
+# directions walked by krist scoring, a run ends at its last cell.
+DIRECTIONS = ((0,1), (1,0), (1,1), (1,-1))
+
+class KristCounter:
+    def __init__(self, board_size, maxLength=None):
+        '''
+        Counters of the krists on a board of size 'board_size'.
+        Krists longer than 'maxLength' (default: board_size) count as
+        krists of length 'maxLength', which must be from 1 to
+        'board_size'. Cells are referred to by their cell index.
+        - owner: player of each stable cell, None for the others.
+        - runs: for each direction, the number of cells of the same
+            player ending at each cell, at most 'maxLength'.
+        - reach: longest run ending at each cell, 0 if not stable.
+        - krists: number of cells of each player whose reach is each
+            length.
+        - maxLen: length of the longest krist, at least 1.
+        - numStable: number of stable cells.
+        '''
+        if maxLength is None:
+            maxLength = board_size
+        if maxLength < 1 or maxLength > board_size:
+            raise ValueError('Win length out of range 1-{0}.'.format(
+                board_size))
+
+        numCells = board_size*board_size
+        self.board_size = board_size
+        self.maxLength = maxLength
+        self.owner = [None]*numCells
+        self.runs = [[0]*numCells for direction in DIRECTIONS]
+        self.reach = [0]*numCells
+        self.krists = [[0, 0] for length in range(maxLength+1)]
+        self.maxLen = 1
+        self.numStable = 0
+
+    def add(self, cell, player):
+        '''
+        Counts the cell index 'cell' as stable for 'player' (0: x,
+        1: o).
+        '''
+        n = self.board_size
+        maxLength = self.maxLength
+        owner = self.owner
+        owner[cell] = player
+        row, col = divmod(cell, n)
+
+        # the runs through 'cell' now join the run ending before it.
+        changed = [cell]
+        for runs, (dr, dc) in zip(self.runs, DIRECTIONS):
+            r = row - dr
+            c = col - dc
+            run = 1
+            if 0 <= r < n and 0 <= c < n and owner[r*n + c] == player:
+                run = min(maxLength, runs[r*n + c] + 1)
+            runs[cell] = run
+
+            # cells k steps after held a run of k before.
+            k = 1
+            r = row + dr
+            c = col + dc
+            while k < maxLength and 0 <= r < n and 0 <= c < n:
+                i = r*n + c
+                if owner[i] != player:
+                    break
+                runs[i] = min(maxLength, run + k)
+                changed.append(i)
+                k += 1
+                r += dr
+                c += dc
+
+        self.update(changed, player)
+        self.numStable += 1
+
+    def remove(self, cell, player):
+        '''
+        Inverse of add().
+        '''
+        n = self.board_size
+        maxLength = self.maxLength
+        owner = self.owner
+        owner[cell] = None
+        row, col = divmod(cell, n)
+
+        changed = list()
+        for runs, (dr, dc) in zip(self.runs, DIRECTIONS):
+            runs[cell] = 0
+            k = 1
+            r = row + dr
+            c = col + dc
+            while k < maxLength and 0 <= r < n and 0 <= c < n:
+                i = r*n + c
+                if owner[i] != player:
+                    break
+                runs[i] = k
+                changed.append(i)
+                k += 1
+                r += dr
+                c += dc
+
+        self.krists[self.reach[cell]][player] -= 1
+        self.reach[cell] = 0
+        self.update(changed, player)
+
+        while self.maxLen > 1 and not any(self.krists[self.maxLen]):
+            self.maxLen -= 1
+
+        self.numStable -= 1
+
+    def update(self, cells, player):
+        '''
+        Recounts the reach of 'cells', stable cells of 'player' whose
+        runs changed.
+        '''
+        runs0, runs1, runs2, runs3 = self.runs
+        reach = self.reach
+        krists = self.krists
+        for i in cells:
+            length = max(runs0[i], runs1[i], runs2[i], runs3[i])
+            if length != reach[i]:
+                if reach[i]:
+                    krists[reach[i]][player] -= 1
+                krists[length][player] += 1
+                reach[i] = length
+                if length > self.maxLen:
+                    self.maxLen = length
+
+    def score(self):
+        '''
+        Returns the length of the longest krist, and the number of
+        krists of that length made by each player.
+        '''
+        krists = self.krists[self.maxLen]
+        return self.maxLen, {'x': krists[0], 'o': krists[1]}
@@ -1,9 +1,20 @@
 '''
 _move.py implements classes storing information about
 an action in the game.
+
+Both classes are slotted, and leaves of the moves tree share an empty
+read-only map of children, since long analysis sessions keep millions
+of moveNodes.
 '''
 
+from types import MappingProxyType
+
+# children of every moveNode without children.
+NO_CHILDREN = MappingProxyType({})
+
 class Move:
+    __slots__ = ('markValue', 'posList')
+
     def __init__(self, markValue = None, posList = None):
         '''
         Stores the value of the marks placed, where the marks were 
@@ -57,6 +68,8 @@ class TypeError(Exception):
         self.message = msg
 
 class MoveNode:
+    __slots__ = ('parent', 'move', 'key', 'id', 'children', 'state')
+
     def __init__(self):
 
         '''
@@ -66,31 +79,51 @@ class MoveNode:
         parent   - stores a pointer to the parent of the node.
         move     - stores an instance of the 'Move' class associating 
             the node.
-        children - map from (index,index) to an instance of move class
-            referring to the move placed at positions corresponding to
-            the two indices by the get_key() method.
+        key      - key of the node among the children of its parent.
+        id       - integer id of the node in the index of its game,
+            see Game.addNode().
+        children - map from move keys to child nodes. A key packs the
+            cell indices of the move into a single integer, see
+            Game.getMoveKey(). NO_CHILDREN until a child is added.
+        state    - 'GameState' after the move, or None, see 
+            Game.stateAt().
         '''
 
         self.parent = None
         self.move = None
-        self.children = dict()
+        self.key = None
+        self.id = None
+        self.children = NO_CHILDREN
+        self.state = None
 
     def add_child(self, key, move):
         '''
         Creates/updates the child corresponding to 'move' with key 
         'key'. Assumes 'key' is suitable to store 'move' as 
         a child. Checks if 'move' is indeed an instance of the 
-        'Move' class.
+        'Move' class. Returns the child.
         '''
 
         if not isinstance(move, Move):
             raise TypeError("Argument not of 'MoveNode' type.")
 
-        if key not in list(self.children.keys()):
-            self.children[key] = MoveNode()
+        child = self.children.get(key)
+        if child is None:
+            if self.children is NO_CHILDREN:
+                self.children = dict()
+            child = MoveNode()
+            child.key = key
+            self.children[key] = child
+
+        child.parent = self
+        child.move = move
+        return child
 
-        self.children[key].parent = self
-        self.children[key].move = move
+    def get_child(self, key):
+        '''
+        Returns the child stored at 'key', or None.
+        '''
+        return self.children.get(key)
 
     def get_moves(self):
         '''
@@ -0,0 +1,354 @@
+'''
+_players.py implements computer players for the game.
+
+Features:
+- legal actions of a server state and terminal test.
+- search state over Game.make_move/unmake_move.
+- random player.
+- monte carlo tree search player using UCT selection, with rollouts
+    run on a process pool.
+- endgame tablebase player, see _tablebase.py.
+- opening book player, see _book.py.
+
+An action is a tuple of positions passed to Server.update() in order:
+two positions to place a move, or one position to begin a collapse.
+Players implement choose(server), returning the action to play from
+the current state of 'server'.
+'''
+
+import math
+import multiprocessing
+import os
+import random
+import time
+
+def isCollapsing(server):
+    return server.curr_state[1:] == '_COLLAPSE'
+
+def legalActions(server):
+    '''
+    Returns a list of actions playable from the state of 'server'.
+    '''
+    posList = server.game.moveCells()
+    if isCollapsing(server):
+        return [(pos,) for pos in posList]
+
+    if server.curr_state[1:] != '_0':
+        return []
+
+    actions = list()
+    for i in range(len(posList)):
+        for j in range(i+1, len(posList)):
+            actions.append((posList[i], posList[j]))
+    return actions
+
+def isTerminal(server):
+    '''
+    Returns True if no more moves can be placed on the board.
+    '''
+    return not isCollapsing(server) and server.game.gameOver()
+
+def pathActions(game):
+    '''
+    Returns the list of actions that replays the moves from the root
+    of 'game.movesTree' to the current moveNode. Only the first move
+    of a collapse chain is an action.
+    '''
+    actions = list()
+    node = game.movesTree
+    while node.move is not None:
+        if not node.move.isCollapse():
+            actions.append(tuple(node.move.posList))
+        elif not node.parent.move.isCollapse():
+            actions.append((node.move.posList[0],))
+        node = node.parent
+
+    actions.reverse()
+    return actions
+
+def replay(serverClass, board_size, bitboard, winLength, actions):
+    '''
+    Creates a new server and plays 'actions' on it.
+    '''
+    server = serverClass(board_size, bitboard, winLength)
+    for action in actions:
+        server.playAction(action)
+    return server
+
+def opponent(side):
+    return 'o' if side == 'x' else 'x'
+
+class SearchState:
+    def __init__(self, game, moveNum, side):
+        '''
+        Position of 'game' for search, following the state machine of
+        Server on top of Game.make_move() and Game.unmake_move(). 
+        Moves are not added to the movesTree of 'game'.
+        - moveNum: number of the next move to place.
+        - side: 'x' or 'o', the player to collapse or place next.
+        - undoStack: undo records of the actions played.
+        '''
+        self.game = game
+        self.moveNum = moveNum
+        self.side = side
+        self.undoStack = list()
+
+    @staticmethod
+    def fromServer(server):
+        '''
+        Search state of a server in a placement or collapse state.
+        '''
+        return SearchState(server.game, server.moveNum, 
+            server.curr_state[0].lower())
+
+    def actions(self):
+        posList = self.game.moveCells()
+        if self.game.cycleDetected:
+            return [(pos,) for pos in posList]
+
+        actions = list()
+        for i in range(len(posList)):
+            for j in range(i+1, len(posList)):
+                actions.append((posList[i], posList[j]))
+        return actions
+
+    def randomAction(self, rng):
+        posList = self.game.moveCells()
+        if self.game.cycleDetected:
+            return (rng.choice(posList),)
+        return tuple(rng.sample(posList, 2))
+
+    def isTerminal(self):
+        return not self.game.cycleDetected and self.game.gameOver()
+
+    def play(self, action):
+        self.undoStack.append((self.moveNum, self.side))
+        if len(action) == 1:
+            # collapse the move that formed the cycle.
+            markValue = opponent(self.side) + str(self.moveNum-1)
+            self.undoStack.append(self.game.make_move(markValue, 
+                [action[0]], True))
+        else:
+            markValue = self.side + str(self.moveNum)
+            self.undoStack.append(self.game.make_move(markValue, 
+                [action[0], action[1]]))
+            self.moveNum += 1
+            self.side = opponent(self.side)
+
+    def undo(self):
+        self.game.unmake_move(self.undoStack.pop())
+        self.moveNum, self.side = self.undoStack.pop()
+
+    def rewind(self):
+        '''
+        Undoes every action played on the state.
+        '''
+        while len(self.undoStack):
+            self.undo()
+
+class RandomPlayer:
+    def __init__(self, rng=None):
+        '''
+        Plays uniformly random actions. 'rng' is an instance of 
+        random.Random, defaults to the 'random' module.
+        '''
+        self.rng = rng if rng is not None else random
+
+    def choose(self, server):
+        posList = server.game.moveCells()
+        if isCollapsing(server):
+            return (self.rng.choice(posList),)
+        return tuple(self.rng.sample(posList, 2))
+
+class TablebasePlayer:
+    def __init__(self, tablebase, player):
+        '''
+        Plays the best action of 'tablebase', a 'Tablebase' of 
+        _tablebase.py, in the positions it holds, and the action of
+        'player' in the others.
+        '''
+        self.tablebase = tablebase
+        self.player = player
+
+    def choose(self, server):
+        action = self.tablebase.bestAction(server)
+        if action is None:
+            return self.player.choose(server)
+        return action
+
+class BookPlayer:
+    def __init__(self, book, player, maxPlies=None, minGames=1):
+        '''
+        Plays the best move of 'book', an 'OpeningBook' of _book.py, 
+        during the first 'maxPlies' plies (default: all of the book),
+        and the action of 'player' once out of the book. Moves played
+        in fewer than 'minGames' games are ignored.
+        '''
+        self.book = book
+        self.player = player
+        self.maxPlies = maxPlies
+        self.minGames = minGames
+
+    def choose(self, server):
+        action = self.book.bestAction(server, self.maxPlies, self.minGames)
+        if action is None:
+            return self.player.choose(server)
+        return action
+
+# -------------------------------------------------------------------
+# Monte Carlo Tree Search.
+class SearchNode:
+    def __init__(self, action=None, parent=None, player=None):
+        '''
+        Node of the search tree.
+        - action: action leading from the parent to this node.
+        - player: 'x' or 'o', the player who played 'action'.
+        - untried: actions not expanded yet, None until the node is
+            first reached.
+        - visits, wins: playout statistics from the point of view of
+            'player'. A draw counts as half a win.
+        '''
+        self.action = action
+        self.parent = parent
+        self.player = player
+        self.children = list()
+        self.untried = None
+        self.visits = 0
+        self.wins = 0.0
+
+    def select(self, c):
+        '''
+        Returns the child maximizing the UCT score.
+        '''
+        logVisits = math.log(self.visits)
+        best = None
+        bestScore = -1.0
+        for child in self.children:
+            score = (child.wins/child.visits + 
+                c*math.sqrt(logVisits/child.visits))
+            if score > bestScore:
+                best = child
+                bestScore = score
+        return best
+
+def search(args):
+    '''
+    Runs UCT from the state reached by replaying 'actions'. Playouts
+    make and unmake moves on a single game. Returns a
+    map from each root action to its (visits, wins). Defined at module
+    level so that it can be run by a process pool.
+    '''
+    (serverClass, board_size, bitboard, winLength, actions, playouts, 
+        timeLimit, c, seed) = args
+
+    rng = random.Random(seed)
+    state = SearchState.fromServer(replay(serverClass, board_size, 
+        bitboard, winLength, actions))
+    root = SearchNode()
+
+    start = time.time()
+    count = 0
+    while count < playouts:
+        if timeLimit is not None and time.time() - start > timeLimit:
+            break
+
+        # selection
+        node = root
+        while node.untried is not None and not node.untried and node.children:
+            node = node.select(c)
+            state.play(node.action)
+
+        # expansion, a finished game has no actions to expand.
+        if node.untried is None:
+            if state.isTerminal():
+                node.untried = list()
+            else:
+                node.untried = state.actions()
+                rng.shuffle(node.untried)
+
+        if node.untried:
+            action = node.untried.pop()
+            child = SearchNode(action, node, state.side)
+            node.children.append(child)
+            state.play(action)
+            node = child
+
+        # simulation, the winner of a terminal node is backed up as is.
+        while not state.isTerminal():
+            state.play(state.randomAction(rng))
+        winner = state.game.getWinner()
+        state.rewind()
+
+        # backpropagation
+        while node is not None:
+            node.visits += 1
+            if node.player == winner:
+                node.wins += 1.0
+            elif winner is None:
+                node.wins += 0.5
+            node = node.parent
+
+        count += 1
+
+    stats = dict()
+    for child in root.children:
+        stats[child.action] = (child.visits, child.wins)
+    return stats
+
+class MCTSPlayer:
+    def __init__(self, playouts=1000, timeLimit=None, workers=None, 
+        c=1.4, seed=None):
+        '''
+        - playouts: total number of playouts per decision.
+        - timeLimit: seconds per decision, or None.
+        - workers: number of processes sharing the playouts, defaults
+            to the number of cores. Each worker searches its own tree
+            from the current state and the root statistics are summed.
+        - c: exploration constant of UCT.
+        - seed: seed of the playouts, or None for a random seed.
+        '''
+        self.playouts = playouts
+        self.timeLimit = timeLimit
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.c = c
+        self.rng = random.Random(seed)
+        self.pool = None
+
+    def choose(self, server):
+        actions = legalActions(server)
+        if len(actions) == 1:
+            return actions[0]
+
+        path = pathActions(server.game)
+        jobs = list()
+        for i in range(self.workers):
+            playouts = self.playouts//self.workers
+            if i < self.playouts % self.workers:
+                playouts += 1
+            jobs.append((type(server), server.game.board_size, 
+                server.game.bitboard, server.game.winLength, path, 
+                playouts, self.timeLimit, self.c, 
+                self.rng.getrandbits(32)))
+
+        if self.workers > 1:
+            if self.pool is None:
+                self.pool = multiprocessing.Pool(self.workers)
+            results = self.pool.map(search, jobs)
+        else:
+            results = [search(jobs[0])]
+
+        # Most visited root action.
+        visits = dict()
+        for stats in results:
+            for action in stats.keys():
+                visits[action] = visits.get(action, 0) + stats[action][0]
+
+        if not len(visits):
+            return actions[0]
+        return max(visits.keys(), key=lambda action: visits[action])
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
@@ -0,0 +1,383 @@
+'''
+_record.py implements a compact binary format for saved games, as an
+alternative to the text grammar written by Game.printTree().
+
+Features:
+- fixed-width move records written in bulk.
+- memory-mapped reading, records are unpacked in place.
+- building the moves tree of a game from the records, move legality
+    checked.
+- lossless conversion to and from the text grammar.
+
+Format (little-endian):
+- header: magic 'Q3TR', version, board size, number of records, index
+    of the current record.
+- records, in the depth-first order of printTree(): depth, index of
+    the parent record (-1 for the root), flags (1: collapse, 2: o),
+    mark number and the cell indices of the move (NONE if unused).
+    Record 0 is INIT_STATE.
+
+Usage: python3 _record.py <input> <output> converts a saved game from
+text to binary or back, depending on the format of <input>.
+'''
+
+import mmap
+import struct
+import sys
+
+from _move import Move
+
+MAGIC = b'Q3TR'
+VERSION = 1
+HEADER = struct.Struct('<4sHHII')
+RECORD = struct.Struct('<iiBxHHH')
+NONE = 0xFFFF
+
+COLLAPSE = 1
+PLAYER_O = 2
+
+class RecordError(Exception):
+    def __init__(self, msg):
+        self.message = msg
+
+def isRecord(filePath):
+    '''
+    Returns True if 'filePath' starts with the magic of a record.
+    '''
+    file = open(filePath, 'rb')
+    magic = file.read(len(MAGIC))
+    file.close()
+    return magic == MAGIC
+
+def encodeMove(move, board_size):
+    '''
+    Returns (flags, number, cell0, cell1) of 'move'.
+    '''
+    flags = PLAYER_O if move.markValue[0] == 'o' else 0
+    cell0 = move.posList[0][0]*board_size + move.posList[0][1]
+    cell1 = NONE
+    if move.isCollapse():
+        flags |= COLLAPSE
+    else:
+        cell1 = move.posList[1][0]*board_size + move.posList[1][1]
+
+    return flags, int(move.markValue[1:]), cell0, cell1
+
+def decodeMove(flags, number, cell0, cell1, board_size):
+    '''
+    Returns the 'Move' stored in a record.
+    '''
+    numCells = board_size*board_size
+    if cell0 >= numCells or (not flags & COLLAPSE and cell1 >= numCells):
+        raise RecordError('Invalid cell in record.')
+
+    markValue = ('o' if flags & PLAYER_O else 'x') + str(number)
+    posList = [(cell0//board_size, cell0%board_size)]
+    if not flags & COLLAPSE:
+        posList.append((cell1//board_size, cell1%board_size))
+    return Move(markValue, posList)
+
+def moveCode(flags, number, cell0, cell1):
+    '''
+    Returns an integer identifying the move of a record on its board,
+    the same for both orders of the cells of a placement.
+    '''
+    if cell1 < cell0:
+        cell0, cell1 = cell1, cell0
+    return (((number << 2) | flags) << 32) | (cell0 << 16) | cell1
+
+def writeRecords(filePath, board_size, records, current):
+    '''
+    Writes 'records', a list of (depth, parent, flags, number, cell0,
+    cell1) tuples, in a single write.
+    '''
+    data = bytearray(HEADER.size + RECORD.size*len(records))
+    HEADER.pack_into(data, 0, MAGIC, VERSION, board_size, len(records), 
+        current)
+
+    offset = HEADER.size
+    for record in records:
+        RECORD.pack_into(data, offset, *record)
+        offset += RECORD.size
+
+    file = open(filePath, 'wb')
+    file.write(data)
+    file.close()
+
+def gameRecords(game):
+    '''
+    Returns (records, current) for the moves tree of 'game', in the
+    order of printTree().
+    '''
+    records = list()
+    current = 0
+    parents = list()
+    for node, depth in game.walkTree():
+        if node is game.movesTree:
+            current = len(records)
+
+        del parents[depth:]
+        parent = parents[-1] if len(parents) else -1
+        if node.move is None:
+            records.append((depth, parent, 0, 0, NONE, NONE))
+        else:
+            records.append((depth, parent) + 
+                encodeMove(node.move, game.board_size))
+        parents.append(len(records)-1)
+
+    return records, current
+
+def saveRecord(game, filePath):
+    records, current = gameRecords(game)
+    writeRecords(filePath, game.board_size, records, current)
+
+class RecordFile:
+    def __init__(self, filePath):
+        '''
+        Opens a record for reading through mmap.
+        - board_size, current: from the header.
+        - count: number of records.
+        '''
+        self.file = open(filePath, 'rb')
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mmap)
+
+        if len(self.mmap) < HEADER.size:
+            self.close()
+            raise RecordError('File too short for a record header.')
+
+        magic, version, self.board_size, self.count, self.current = \
+            HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise RecordError('Not a game record.')
+        if len(self.mmap) < HEADER.size + RECORD.size*self.count:
+            self.close()
+            raise RecordError('Truncated game record.')
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return RECORD.unpack_from(self.mmap, HEADER.size + RECORD.size*i)
+
+    def __iter__(self):
+        end = HEADER.size + RECORD.size*self.count
+        return RECORD.iter_unpack(self.view[HEADER.size:end])
+
+    def close(self):
+        self.view.release()
+        self.mmap.close()
+        self.file.close()
+
+class TreeReplay:
+    def __init__(self, game, record=True):
+        '''
+        Plays a saved moves tree on 'game' in the depth-first order of
+        printTree(), with Game.make_move(), rejecting the first move
+        that is not legal. 'game' must be at the root.
+        - record: adds the moves to the moves tree of 'game'.
+        - frames: for each depth of the current line, the undo record
+            of the move, the id of its moveNode (None if not recorded)
+            and the rest of its collapse chain, as (markValue, pos, id).
+        '''
+        self.game = game
+        self.record = record
+        self.frames = [(None, game.movesTree.id if record else None, ())]
+
+    def add(self, depth, move):
+        '''
+        Plays 'move' after the last move added at 'depth'-1, the root
+        being at depth 0. Returns the id of its moveNode. Raises
+        RecordError if the move is not legal there.
+
+        A collapse chain is played at once by its first evaluated
+        cell, the next moves must then follow the chain.
+        '''
+        if depth < 1 or depth > len(self.frames):
+            raise RecordError('Invalid depth.')
+        while len(self.frames) > depth:
+            self.pop()
+
+        chain = self.frames[-1][2]
+        if len(chain):
+            markValue, pos, nodeId = chain[0]
+            if (not move.isCollapse() or move.markValue != markValue or
+                    move.posList[0] != pos):
+                raise RecordError('Illegal move, the collapse continues '
+                    'with {}-{}-{}.'.format(markValue, pos[0], pos[1]))
+            self.frames.append((None, nodeId, chain[1:]))
+            return nodeId
+
+        game = self.game
+        error = game.checkMove(move)
+        if error is not None:
+            raise RecordError('Illegal move, '+error)
+
+        undo = game.make_move(move.markValue, move.posList,
+            move.isCollapse(), self.record)
+        if not move.isCollapse():
+            nodeId = game.movesTree.id if self.record else None
+            self.frames.append((undo, nodeId, ()))
+            return nodeId
+
+        # moveNodes of the evaluated cells, from the end of the chain.
+        evaluated = undo[-1]
+        nodeIds = [None]*len(evaluated)
+        if self.record:
+            node = game.movesTree
+            for i in reversed(range(len(evaluated))):
+                nodeIds[i] = node.id
+                node = node.parent
+
+        chain = tuple((game.board.getStable(pos), pos, nodeIds[i])
+            for i, pos in enumerate(evaluated))
+        self.frames.append((undo, nodeIds[0], chain[1:]))
+        return nodeIds[0]
+
+    def pop(self):
+        undo = self.frames.pop()[0]
+        if undo is not None:
+            self.game.unmake_move(undo)
+
+    def finish(self):
+        '''
+        Undoes every move, 'game' is left at the root.
+        '''
+        while len(self.frames) > 1:
+            self.pop()
+
+def buildTree(game, records):
+    '''
+    Adds the moves of 'records' to the moves tree of 'game', which
+    must be empty, playing them with a 'TreeReplay'. Returns the list
+    of moveNode ids, indexed by record. Siblings with the same move
+    share a node, see Game.addNode(). Raises RecordError at the first
+    record out of order or not legal.
+    '''
+    replay = None
+    nodes = list()
+    parents = list()
+    for depth, parent, flags, number, cell0, cell1 in records:
+        if parent < 0:
+            if depth != 0:
+                raise RecordError('Invalid depth in record.')
+            if replay is not None:
+                replay.finish()
+            replay = TreeReplay(game)
+            nodes.append(game.movesTree.id)
+            parents = [len(nodes)-1]
+            continue
+
+        if (replay is None or depth < 1 or depth > len(parents) or
+                parent != parents[depth-1]):
+            raise RecordError('Invalid parent in record.')
+
+        move = decodeMove(flags, number, cell0, cell1, game.board_size)
+        nodes.append(replay.add(depth, move))
+        del parents[depth:]
+        parents.append(len(nodes)-1)
+
+    if replay is not None:
+        replay.finish()
+    return nodes
+
+# -------------------------------------------------------------------
+# Conversion to and from the text grammar.
+def textRecords(file):
+    '''
+    Parses a game saved by printTree() from the lines of 'file'.
+    Returns (board_size, records, current).
+    '''
+    board_size = None
+    records = list()
+    current = 0
+    parents = list()
+
+    for line in file:
+        tokens = line.split()
+        if not len(tokens):
+            continue
+
+        if tokens[0][0:5] == 'SIZE=':
+            board_size = int(tokens[0][5:])
+            continue
+
+        if board_size is None:
+            raise RecordError('Missing SIZE before > ' + line.strip())
+
+        if len(tokens) > 1 and tokens[1] == '<---':
+            current = len(records)
+
+        if tokens[0] == 'INIT_STATE':
+            parents = [0]
+            records.append((0, -1, 0, 0, NONE, NONE))
+            continue
+
+        depth = len(tokens[0]) - len(tokens[0].lstrip('.'))
+        if depth < 1 or depth > len(parents):
+            raise RecordError('Invalid depth in line > ' + line.strip())
+
+        try:
+            move = Move()
+            move.read(tokens[0][depth:])
+            if (move.markValue[0:1] not in ('x', 'o') or
+                    not move.markValue[1:].isdigit()):
+                raise RecordError('Invalid mark.')
+            flags, number, cell0, cell1 = encodeMove(move, board_size)
+            decodeMove(flags, number, cell0, cell1, board_size)
+        except (ValueError, IndexError, RecordError):
+            raise RecordError('Invalid move in line > ' + line.strip())
+
+        del parents[depth:]
+        records.append((depth, parents[depth-1], flags, number, cell0, cell1))
+        parents.append(len(records)-1)
+
+    if board_size is None:
+        raise RecordError('Missing SIZE.')
+
+    return board_size, records, current
+
+def writeText(file, board_size, records, current):
+    '''
+    Writes records using the grammar of printTree().
+    '''
+    file.write('SIZE='+str(board_size)+'\n')
+    for i, record in enumerate(records):
+        depth, parent, flags, number, cell0, cell1 = record
+        if parent < 0:
+            file.write('INIT_STATE ')
+        else:
+            move = decodeMove(flags, number, cell0, cell1, board_size)
+            file.write(('.'*depth)+str(move)+' ')
+
+        if i == current:
+            file.write('<---')
+        file.write('\n')
+
+def textToRecord(textPath, recordPath):
+    file = open(textPath, 'r')
+    board_size, records, current = textRecords(file)
+    file.close()
+    writeRecords(recordPath, board_size, records, current)
+
+def recordToText(recordPath, textPath):
+    record = RecordFile(recordPath)
+    records = list(record)
+    board_size = record.board_size
+    current = record.current
+    record.close()
+
+    file = open(textPath, 'w')
+    writeText(file, board_size, records, current)
+    file.close()
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('Usage: python3 _record.py <input> <output>')
+        sys.exit(1)
+
+    if isRecord(sys.argv[1]):
+        recordToText(sys.argv[1], sys.argv[2])
+    else:
+        textToRecord(sys.argv[1], sys.argv[2])
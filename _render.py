@@ -0,0 +1,145 @@
+'''
+_render.py draws the board to a terminal.
+
+Features:
+- each frame is composed into a list of lines and written at once.
+- on ANSI terminals, only the characters that changed since the
+    previous frame are redrawn.
+- the text of a frame is the drawing of server.printBoard().
+'''
+
+import shutil
+import sys
+
+CELL_WIDTH = 12
+
+# rows of a stable cell, indexed by k//3 - 1, see boardLines().
+STABLE_ROWS = {
+    'x': ('            ', '     \\/     ', '     /\\     ', '            '),
+    'o': ('     __     ', '    |  |    ', '    |__|    ', '            '),
+}
+
+def cellRow(game, pos, k):
+    '''
+    Returns row 'k' (3, 6, 9 or 12) of the cell at 'pos', without the
+    border.
+    '''
+    stable = game.board.getStable(pos)
+    if stable is not None:
+        return STABLE_ROWS[stable[0]][k//3 - 1]
+
+    # Otherwise, write each spooky mark in the cell.
+    marksList = game.board.getMarks(pos)
+    numMarks = len(marksList)
+    outStr = ''
+    i = k-3
+    while i < k and i < numMarks:
+        outStr += marksList[i]
+
+        # If moveNum of the move is a single digit number, pad an
+        # extra space to 'outStr'
+        if len(marksList[i]) < 3:
+            outStr += ' '
+
+        if i < numMarks-1:
+            outStr += ' '
+        i += 1
+
+    return outStr.ljust(CELL_WIDTH)
+
+def boardLines(game):
+    '''
+    Returns the lines of the drawing of 'game'.
+    '''
+    n = game.board_size
+    colNumbers = ''.join('      {0}      '.format(col) for col in range(n))
+    dashes = '    '+'-'*(n*13)
+
+    lines = ['', colNumbers]
+    for row in range(n):
+        lines.append(dashes)
+        for k in range(3, 13, 3):
+            line = (str(row)+'  | ') if k == 6 else '   | '
+            line += ''.join(cellRow(game, (row, col), k)+'|'
+                for col in range(n))
+            if k == 6:
+                line += '  '+str(row)
+            lines.append(line)
+
+    lines.append(dashes)
+    lines.append(colNumbers)
+    lines.append('')
+    return lines
+
+class BoardRenderer:
+    def __init__(self, out=None, ansi=False, quiet=False):
+        '''
+        Writes frames to 'out' (default: stdout).
+        - ansi: after the first frame, move the cursor to redraw only
+            the changed characters. The frame is drawn at the top of
+            the screen.
+        - quiet: draw nothing.
+        - frame: lines of the last frame drawn.
+        '''
+        self.out = out
+        self.ansi = ansi
+        self.quiet = quiet
+        self.frame = None
+
+    def changes(self, row, line, prev):
+        '''
+        Returns the escape sequences redrawing each run of characters
+        of 'line' that differ from 'prev', on screen row 'row'.
+        '''
+        buf = list()
+        end = max(len(line), len(prev))
+        col = 0
+        while col < end:
+            if col < len(line) and col < len(prev) and line[col] == prev[col]:
+                col += 1
+                continue
+
+            start = col
+            while col < end and not (col < len(line) and 
+                col < len(prev) and line[col] == prev[col]):
+                col += 1
+            buf.append('\x1b[{0};{1}H'.format(row+1, start+1))
+            buf.append(line[start:col].ljust(col-start))
+
+        return ''.join(buf)
+
+    def draw(self, game, status=()):
+        '''
+        Draws the board of 'game', followed by the lines of 'status'.
+        '''
+        if self.quiet:
+            return
+
+        out = self.out if self.out is not None else sys.stdout
+        lines = boardLines(game) + list(status)
+
+        if not self.ansi:
+            out.write('\n'.join(lines)+'\n')
+
+        elif (self.frame is None or 
+            len(lines) >= shutil.get_terminal_size().lines):
+            # a frame taller than the screen scrolls, it is drawn in 
+            # full and the next one too.
+            out.write('\x1b[H\x1b[2J'+'\n'.join(lines)+'\n')
+            if len(lines) >= shutil.get_terminal_size().lines:
+                lines = None
+
+        else:
+            buf = list()
+            for row, line in enumerate(lines):
+                prev = self.frame[row] if row < len(self.frame) else ''
+                if line != prev:
+                    buf.append(self.changes(row, line, prev))
+
+            # clear the rest of the previous frame, leave the cursor
+            # below the frame.
+            buf.append('\x1b[{0};1H\x1b[J'.format(len(lines)+1))
+            out.write(''.join(buf))
+
+        out.flush()
+        self.frame = lines
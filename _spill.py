@@ -0,0 +1,99 @@
+'''
+_spill.py keeps cold branches of a moves tree on disk, for bounding
+the memory of long analysis sessions.
+
+Features:
+- the descendants of a moveNode are written to a store in a single
+    write, the moveNode keeps a 'Branch' in place of its children.
+- a 'Branch' is read back transparently the first time the children
+    are accessed, see Game.loadBranch().
+- a branch can be read without being loaded, for traversals of the
+    complete tree, see Game.walkTree().
+
+Store format: records of the descendants, in depth-first order. Each
+record holds the id of the moveNode, the index of its parent record
+(-1 for the children of the branch), the move as in _record.py, and
+the branch of the moveNode if it was spilled itself (offset -1
+otherwise): the number of its store, see Game.addStore(), offset, 
+length and number of children.
+'''
+
+import struct
+import tempfile
+
+from collections.abc import Mapping
+
+RECORD = struct.Struct('<IiBxHHHBqII')
+
+class Branch(Mapping):
+    __slots__ = ('game', 'node', 'store', 'offset', 'length', 'count')
+
+    def __init__(self, game, node, store, offset, length, count):
+        '''
+        Children of the moveNode 'node' of 'game', held by 'store' at
+        'offset'. 'length' is the size of the branch in the store,
+        'count' the number of children.
+        '''
+        self.game = game
+        self.node = node
+        self.store = store
+        self.offset = offset
+        self.length = length
+        self.count = count
+
+    def read(self):
+        return self.store.read(self.offset, self.length)
+
+    def load(self):
+        '''
+        Loads the branch into the moves tree, returns the children.
+        '''
+        if self.node.children is self:
+            self.game.loadBranch(self.node)
+        return self.node.children
+
+    def __getitem__(self, key):
+        return self.load()[key]
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __len__(self):
+        return self.count
+
+class SpillStore:
+    def __init__(self, directory=None):
+        '''
+        Append-only temporary file holding spilled branches. The file
+        is deleted when closed. Space of reloaded branches is not
+        reclaimed. 'number' is set by Game.addStore().
+        '''
+        self.file = tempfile.TemporaryFile(dir=directory)
+        self.size = 0
+        self.number = None
+
+    def write(self, records):
+        '''
+        Appends 'records', returns (offset, length).
+        '''
+        data = bytearray(RECORD.size*len(records))
+        offset = 0
+        for record in records:
+            RECORD.pack_into(data, offset, *record)
+            offset += RECORD.size
+
+        self.file.seek(self.size)
+        self.file.write(data)
+        offset = self.size
+        self.size += len(data)
+        return offset, len(data)
+
+    def read(self, offset, length):
+        '''
+        Returns the records of the branch at 'offset'.
+        '''
+        self.file.seek(offset)
+        return list(RECORD.iter_unpack(self.file.read(length)))
+
+    def close(self):
+        self.file.close()
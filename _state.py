@@ -0,0 +1,222 @@
+'''
+_state.py implements immutable game states, for analysing positions
+of a moves tree without replaying them on the 'Game'.
+
+Features:
+- a 'GameState' is never modified: playing a move returns a new
+    state, and the previous one stays valid. States can be shared by
+    threads without locks.
+- the board and the union-find links are tuples of rows. A move
+    copies the rows it changes and shares the others with the state
+    it was played from.
+- the hash of a state equals Game.hash in the same position.
+- states of the moveNodes of a game are derived from the nearest
+    ancestor holding one, see Game.stateAt().
+
+A cell is either the classical mark of a stable cell, a string, or the
+tuple of the spooky marks in it, each as (markValue, cell index of
+its twin).
+'''
+
+from _krist import KristCounter
+from _zobrist import getKeys, player
+
+def getItem(rows, i, n):
+    return rows[i//n][i%n]
+
+def setItem(rows, i, n, value):
+    '''
+    Returns 'rows' with item 'i' set to 'value'. Only the row holding
+    it is copied.
+    '''
+    r = i//n
+    c = i%n
+    row = rows[r]
+    return rows[:r] + (row[:c] + (value,) + row[c+1:],) + rows[r+1:]
+
+class GameState:
+    __slots__ = ('board_size', 'rows', 'links', 'cyclePos', 'plies',
+        'hash', 'numStable')
+
+    def __init__(self, board_size, rows, links, cyclePos, plies, hash,
+        numStable):
+        '''
+        Use initialState() or the moves of an existing state.
+        - rows: cells of the board, 'board_size' tuples of
+            'board_size' cells.
+        - links: parent of each cell in the union-find of entangled
+            cells, with the same layout. Roots link to themselves.
+        - cyclePos: positions of the move that formed a cycle, while
+            its collapse is pending, otherwise None.
+        - plies: number of completed placements.
+        - hash: zobrist hash, see _zobrist.py.
+        - numStable: number of stable cells.
+        '''
+        self.board_size = board_size
+        self.rows = rows
+        self.links = links
+        self.cyclePos = cyclePos
+        self.plies = plies
+        self.hash = hash
+        self.numStable = numStable
+
+    def getCellIndex(self, pos):
+        return pos[0]*self.board_size + pos[1]
+
+    def getPos(self, i):
+        return (i//self.board_size, i%self.board_size)
+
+    def getStable(self, pos):
+        cell = getItem(self.rows, self.getCellIndex(pos), self.board_size)
+        return cell if type(cell) is str else None
+
+    def getMarks(self, pos):
+        '''
+        Returns the spooky marks of 'pos', none if it is stable.
+        '''
+        cell = getItem(self.rows, self.getCellIndex(pos), self.board_size)
+        if type(cell) is str:
+            return []
+        return [mark for mark, twin in cell]
+
+    def isCycleDetected(self):
+        return self.cyclePos is not None
+
+    def find(self, i):
+        n = self.board_size
+        while getItem(self.links, i, n) != i:
+            i = getItem(self.links, i, n)
+        return i
+
+    def statusKey(self):
+        '''
+        Part of the hash covering the side to move and a pending
+        collapse, see Game.statusKey().
+        '''
+        keys = getKeys(self.board_size)
+        key = keys.side if self.plies % 2 else 0
+        if self.cyclePos is not None:
+            key ^= keys.collapse(self.getCellIndex(self.cyclePos[0]),
+                self.getCellIndex(self.cyclePos[1]))
+        return key
+
+    def place(self, markValue, pos0, pos1):
+        '''
+        Returns the state after placing 'markValue' in 'pos0' and
+        'pos1', two cells that are not stable.
+        '''
+        n = self.board_size
+        i0 = self.getCellIndex(pos0)
+        i1 = self.getCellIndex(pos1)
+
+        rows = setItem(self.rows, i0, n,
+            getItem(self.rows, i0, n) + ((markValue, i1),))
+        rows = setItem(rows, i1, n, getItem(rows, i1, n) + ((markValue, i0),))
+
+        links = self.links
+        root0 = self.find(i0)
+        root1 = self.find(i1)
+        cyclePos = None
+        if root0 == root1:
+            cyclePos = (pos0, pos1)
+        else:
+            links = setItem(links, root0, n, root1)
+
+        state = GameState(n, rows, links, cyclePos, self.plies+1, 0,
+            self.numStable)
+        state.hash = (self.hash ^ self.statusKey() ^ state.statusKey() ^
+            getKeys(n).edge(i0, i1, player(markValue)))
+        return state
+
+    def stabilize(self, pos, markValue):
+        '''
+        Returns the state after turning 'pos' into the classical
+        'markValue', a single evaluated cell of a collapse. A pending
+        collapse is cleared, as in Game.playNode().
+        '''
+        n = self.board_size
+        keys = getKeys(n)
+        i = self.getCellIndex(pos)
+
+        state = GameState(n, setItem(self.rows, i, n, markValue),
+            self.links, None, self.plies, self.hash ^ self.statusKey(),
+            self.numStable+1)
+
+        # spooky marks of 'pos' whose twin is not stable leave the hash.
+        for mark, twin in getItem(self.rows, i, n):
+            if type(getItem(self.rows, twin, n)) is not str:
+                state.hash ^= keys.edge(i, twin, player(mark))
+
+        state.hash ^= keys.stable(i, player(markValue)) ^ state.statusKey()
+        return state
+
+    def collapse(self, markValue, pos):
+        '''
+        Returns the state after collapsing 'markValue' into 'pos' and
+        the whole chain it starts, see Game.collapse().
+        '''
+        state = self
+        stack = [(markValue, pos)]
+        while len(stack):
+            markValue, pos0 = stack.pop()
+            if state.getStable(pos0) is not None:
+                continue
+
+            cell = getItem(state.rows, state.getCellIndex(pos0),
+                state.board_size)
+            state = state.stabilize(pos0, markValue)
+            for mark, twin in reversed(cell):
+                if mark != markValue:
+                    stack.append((mark, state.getPos(twin)))
+
+        return state
+
+    def play(self, move):
+        '''
+        Returns the state after the 'Move' of a moveNode: a placement,
+        or a single evaluated cell of a collapse.
+        '''
+        if move.isCollapse():
+            return self.stabilize(move.posList[0], move.markValue)
+        return self.place(move.markValue, move.posList[0], move.posList[1])
+
+    def moves(self):
+        '''
+        Returns the legal cells, as Game.getMoves().
+        '''
+        if self.cyclePos is not None:
+            return list(self.cyclePos)
+
+        n = self.board_size
+        return [(r, c) for r in range(n) for c in range(n)
+            if type(self.rows[r][c]) is not str]
+
+    def kristScore(self, winLength=None):
+        '''
+        Returns the krist score, as Game.kristScore().
+        '''
+        krist = KristCounter(self.board_size, winLength)
+        for i in range(self.board_size*self.board_size):
+            cell = getItem(self.rows, i, self.board_size)
+            if type(cell) is str:
+                krist.add(i, player(cell))
+        return krist.score()
+
+    def gameOver(self, winLength=None):
+        '''
+        Returns True once at most one cell is left to play, or a krist
+        of 'winLength' was made, as Game.gameOver().
+        '''
+        if self.board_size*self.board_size - self.numStable <= 1:
+            return True
+        return (winLength is not None and
+            self.kristScore(winLength)[0] >= winLength)
+
+def initialState(board_size):
+    '''
+    Returns the state of an empty board.
+    '''
+    n = board_size
+    rows = tuple(((),)*n for r in range(n))
+    links = tuple(tuple(range(r*n, (r+1)*n)) for r in range(n))
+    return GameState(n, rows, links, None, 0, 0, 0)
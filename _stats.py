@@ -0,0 +1,183 @@
+'''
+_stats.py implements optional instrumentation of a server.
+
+Features:
+- latency histograms per command of Server.run().
+- counters of union-find operations and histograms of collapse chain
+    lengths, recorded by Game when a 'Stats' is attached to it.
+- cProfile and tracemalloc sampling toggled on demand.
+- every statistic can be dumped as JSON.
+
+Nothing is recorded unless the 'stats on' command of Server.run()
+attached a 'Stats' to the server.
+'''
+
+import cProfile
+import io
+import json
+import pstats
+import time
+import tracemalloc
+
+class Histogram:
+    def __init__(self):
+        '''
+        Histogram of non-negative values with power of two buckets.
+        Bucket k counts the values v with 2^(k-1) <= v < 2^k, bucket 0
+        the values below 1.
+        '''
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = dict()
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+        k = int(value).bit_length()
+        self.buckets[k] = self.buckets.get(k, 0) + 1
+
+    def percentile(self, p):
+        '''
+        Returns the upper bound of the bucket holding the 'p'
+        percentile, capped by the maximum value.
+        '''
+        if not self.count:
+            return 0
+        rank = p/100.0*self.count
+        seen = 0
+        for k in sorted(self.buckets):
+            seen += self.buckets[k]
+            if seen >= rank:
+                return min(1 << k, self.max)
+        return self.max
+
+    def toDict(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.total/self.count if self.count else 0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': {'<'+str(1 << k): self.buckets[k]
+                for k in sorted(self.buckets)},
+        }
+
+class Stats:
+    def __init__(self):
+        '''
+        Statistics of a server.
+        - latency: maps a command to a histogram of its latency in
+            microseconds.
+        - counters: maps an event to the number of times it happened.
+        - values: maps a quantity to a histogram of its values.
+        - profile: running cProfile.Profile, or None.
+        - profileStats: top functions of the last profile.
+        - memory: top allocation sites of the last tracemalloc
+            snapshot.
+        '''
+        self.latency = dict()
+        self.counters = dict()
+        self.values = dict()
+        self.profile = None
+        self.profileStats = None
+        self.memory = None
+
+    def time(self, cmd, seconds):
+        histogram = self.latency.get(cmd)
+        if histogram is None:
+            histogram = Histogram()
+            self.latency[cmd] = histogram
+        histogram.add(seconds*1e6)
+
+    def count(self, event, n=1):
+        self.counters[event] = self.counters.get(event, 0) + n
+
+    def observe(self, name, value):
+        histogram = self.values.get(name)
+        if histogram is None:
+            histogram = Histogram()
+            self.values[name] = histogram
+        histogram.add(value)
+
+    def startProfile(self):
+        if self.profile is None:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def stopProfile(self, top=20):
+        '''
+        Stops the profiler, keeps and returns the report of the 'top'
+        functions by cumulative time.
+        '''
+        if self.profile is None:
+            return self.profileStats
+
+        self.profile.disable()
+        out = io.StringIO()
+        report = pstats.Stats(self.profile, stream=out)
+        report.sort_stats('cumulative').print_stats(top)
+        self.profile = None
+        self.profileStats = out.getvalue()
+        return self.profileStats
+
+    def startMemory(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stopMemory(self, top=10):
+        '''
+        Takes a snapshot, stops tracing and keeps the 'top' allocation
+        sites by size.
+        '''
+        if not tracemalloc.is_tracing():
+            return self.memory
+
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+        sites = list()
+        for stat in snapshot.statistics('lineno')[:top]:
+            frame = stat.traceback[0]
+            sites.append({'file': frame.filename, 'line': frame.lineno,
+                'size': stat.size, 'count': stat.count})
+        self.memory = {'current': current, 'peak': peak, 'top': sites}
+        return self.memory
+
+    def toDict(self, game=None):
+        '''
+        Returns every statistic, with the size of the moves tree of
+        'game' if given and the number of its moveNodes in memory.
+        '''
+        stats = {
+            'time': time.time(),
+            'latencyUs': {cmd: self.latency[cmd].toDict()
+                for cmd in sorted(self.latency)},
+            'counters': dict(self.counters),
+            'values': {name: self.values[name].toDict()
+                for name in sorted(self.values)},
+            'profiling': self.profile is not None,
+            'profile': self.profileStats,
+            'tracingMemory': tracemalloc.is_tracing(),
+            'memory': self.memory,
+        }
+        if game is not None:
+            stats['treeSize'] = len(game.nodes)
+            stats['treeInMemory'] = game.inMemory
+        return stats
+
+    def dump(self, filePath, game=None):
+        file = open(filePath, 'w')
+        json.dump(self.toDict(game), file, indent=1)
+        file.write('\n')
+        file.close()
@@ -0,0 +1,395 @@
+'''
+_tablebase.py implements endgame tablebases: positions with few cells
+left to play, solved exactly and stored in a file for computer players.
+
+Features:
+- retrograde solving: positions are enumerated from the end of the
+    game backwards, by number of cells left to play and then by number
+    of spooky marks, so that every move leads to a position that is
+    already solved or over.
+- a position is solved for the krist margin, the number of longest
+    krists of x minus those of o at the end of the game, x maximizing
+    it. Its sign is the outcome: win, draw or loss.
+- compact file of fixed-width entries sorted by zobrist hash, looked
+    up by binary search over a memory map.
+- best action of a server state, see TablebasePlayer in _players.py.
+
+A position without a pending collapse is its stable cells, the spooky
+marks between the other cells, a forest since every cycle collapses,
+and the side to move. The side to move is given by the counts: each
+stable cell holds a collapsed mark, so x placed as many marks as o,
+or one more when o is to move. Every such combination is solved,
+including some that cannot be reached from the empty board.
+
+Format (little-endian):
+- header: magic 'Q3TB', version, board size, win length (0 if none),
+    maximum number of cells left to play, number of entries.
+- entries, sorted: the zobrist hash of a position with its low byte
+    replaced by the krist margin plus 128.
+
+Usage: python3 _tablebase.py <board-size> <output> [open=<k>] [win=<k>]
+solves the positions with 2 to k (default 4) cells left to play.
+'''
+
+import bisect
+import itertools
+import mmap
+import struct
+import sys
+
+from _krist import KristCounter
+from _players import SearchState
+from _zobrist import getKeys
+
+MAGIC = b'Q3TB'
+VERSION = 1
+HEADER = struct.Struct('<4sHHHHI')
+ENTRY = struct.Struct('<Q')
+MARGIN = 0xFF
+
+class TablebaseError(Exception):
+    def __init__(self, msg):
+        self.message = msg
+
+def margin(krist):
+    '''
+    Returns the krist margin of a 'KristCounter'.
+    '''
+    krists = krist.krists[krist.maxLen]
+    return krists[0] - krists[1]
+
+# -------------------------------------------------------------------
+# Solving.
+def forests(numCells):
+    '''
+    Returns the spooky marks of every position of 'numCells' cells
+    without a pending collapse, as lists of (cell, cell, player)
+    between local cell indices. Forests with more marks come first.
+    '''
+    pairs = list(itertools.combinations(range(numCells), 2))
+    result = list()
+
+    def extend(start, links, edges):
+        result.append(list(edges))
+        for k in range(start, len(pairs)):
+            i0, i1 = pairs[k]
+            root0 = root(links, i0)
+            root1 = root(links, i1)
+            if root0 == root1:
+                continue
+            links[root0] = root1
+            for p in (0, 1):
+                edges.append((i0, i1, p))
+                extend(k+1, links, edges)
+                edges.pop()
+            links[root0] = root0
+
+    def root(links, i):
+        while links[i] != i:
+            i = links[i]
+        return i
+
+    extend(0, list(range(numCells)), list())
+    result.sort(key=len, reverse=True)
+    return result
+
+def placements(numCells, edges):
+    '''
+    Returns the outcome of placing a mark on each pair of 'numCells'
+    cells holding the forest 'edges', as ((i0, i1), collapses).
+    'collapses' is None if the mark leaves a forest, otherwise the
+    component of the cycle it forms, for collapsing the mark into i0
+    and into i1: (cells, edges of the component, stable cells). The
+    player of a stable cell is None for the collapsed mark itself.
+    '''
+    adjacent = [list() for i in range(numCells)]
+    for edge in edges:
+        adjacent[edge[0]].append(edge)
+        adjacent[edge[1]].append(edge)
+
+    component = [None]*numCells
+    for i in range(numCells):
+        if component[i] is not None:
+            continue
+        stack = [i]
+        component[i] = i
+        while len(stack):
+            j = stack.pop()
+            for edge in adjacent[j]:
+                k = edge[0] + edge[1] - j
+                if component[k] is None:
+                    component[k] = i
+                    stack.append(k)
+
+    def collapse(start):
+        # each other cell takes the mark linking it towards 'start'.
+        stable = [(start, None)]
+        stack = [start]
+        seen = {start}
+        while len(stack):
+            j = stack.pop()
+            for edge in adjacent[j]:
+                k = edge[0] + edge[1] - j
+                if k not in seen:
+                    seen.add(k)
+                    stable.append((k, edge[2]))
+                    stack.append(k)
+        return stable
+
+    result = list()
+    for i0, i1 in itertools.combinations(range(numCells), 2):
+        if component[i0] != component[i1]:
+            result.append(((i0, i1), None))
+            continue
+
+        cells = [i for i in range(numCells) if component[i] == component[i0]]
+        cycleEdges = [edge for edge in edges if component[edge[0]] ==
+            component[i0]]
+        result.append(((i0, i1), (cells, cycleEdges,
+            [collapse(i0), collapse(i1)])))
+    return result
+
+def solve(board_size, maxOpen=4, winLength=None, progress=None):
+    '''
+    Returns a map from the hash of every position with 2 to 'maxOpen'
+    cells left to play, without a pending collapse and before the end
+    of the game, to its krist margin under perfect play.
+    'progress', if given, is called with the number of cells left to
+    play each time a new number is reached.
+    '''
+    n = board_size
+    numCells = n*n
+    keys = getKeys(n)
+    table = dict()
+
+    for numOpen in range(2, min(maxOpen, numCells)+1):
+        if progress is not None:
+            progress(numOpen)
+
+        shapes = [(edges, sum(1 for edge in edges if edge[2] == 0),
+            sum(1 for edge in edges if edge[2] == 1),
+            placements(numOpen, edges)) for edges in forests(numOpen)]
+
+        for cells in itertools.combinations(range(numCells), numOpen):
+            others = [i for i in range(numCells) if i not in cells]
+            edgeKeys = dict()
+            for i0, i1 in itertools.combinations(range(numOpen), 2):
+                for p in (0, 1):
+                    edgeKeys[(i0, i1, p)] = keys.edge(cells[i0], cells[i1], p)
+
+            for pattern in range(1 << len(others)):
+                krist = KristCounter(n, winLength)
+                stableHash = 0
+                numO = 0
+                for k, i in enumerate(others):
+                    p = (pattern >> k) & 1
+                    krist.add(i, p)
+                    stableHash ^= keys.stable(i, p)
+                    numO += p
+
+                if winLength is not None and krist.maxLen >= winLength:
+                    continue
+
+                numX = len(others) - numO
+                for edges, edgesX, edgesO, moves in shapes:
+                    side = numX + edgesX - numO - edgesO
+                    if side not in (0, 1):
+                        continue
+
+                    hash = stableHash ^ (keys.side if side else 0)
+                    for edge in edges:
+                        hash ^= edgeKeys[edge]
+
+                    table[hash] = solvePosition(table, keys, krist, cells,
+                        numOpen, hash, side, moves, winLength)
+
+    return table
+
+def solvePosition(table, keys, krist, cells, numOpen, hash, side, moves,
+    winLength):
+    '''
+    Returns the krist margin of the position 'hash', 'side' (0: x,
+    1: o) to move. Children are read from 'table'.
+    '''
+    best = None
+    for (i0, i1), collapses in moves:
+        childHash = hash ^ keys.side
+        if collapses is None:
+            value = table[childHash ^ keys.edge(cells[i0], cells[i1], side)]
+
+        else:
+            # the opponent collapses the mark that formed the cycle.
+            component, edges, choices = collapses
+            for edge in edges:
+                childHash ^= keys.edge(cells[edge[0]], cells[edge[1]],
+                    edge[2])
+
+            value = None
+            for stable in choices:
+                collapsedHash = childHash
+                for i, p in stable:
+                    if p is None:
+                        p = side
+                    krist.add(cells[i], p)
+                    collapsedHash ^= keys.stable(cells[i], p)
+
+                if (numOpen - len(component) <= 1 or (winLength is not None
+                        and krist.maxLen >= winLength)):
+                    collapsed = margin(krist)
+                else:
+                    collapsed = table[collapsedHash]
+
+                for i, p in stable:
+                    krist.remove(cells[i], side if p is None else p)
+
+                if value is None or (collapsed < value if side == 0 else
+                        collapsed > value):
+                    value = collapsed
+
+        if best is None or (value > best if side == 0 else value < best):
+            best = value
+
+    return best
+
+def writeTablebase(filePath, board_size, maxOpen, winLength, table):
+    '''
+    Writes the map 'table' returned by solve() in a single write.
+    '''
+    entries = sorted((hash & ~MARGIN) | (value+128)
+        for hash, value in table.items())
+
+    data = bytearray(HEADER.size + ENTRY.size*len(entries))
+    HEADER.pack_into(data, 0, MAGIC, VERSION, board_size,
+        winLength if winLength is not None else 0, maxOpen, len(entries))
+
+    offset = HEADER.size
+    for entry in entries:
+        ENTRY.pack_into(data, offset, entry)
+        offset += ENTRY.size
+
+    file = open(filePath, 'wb')
+    file.write(data)
+    file.close()
+
+# -------------------------------------------------------------------
+# Lookup.
+class Tablebase:
+    def __init__(self, filePath):
+        '''
+        Opens a tablebase for reading through mmap.
+        - board_size, winLength, maxOpen, count: from the header.
+        '''
+        self.file = open(filePath, 'rb')
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.mmap) < HEADER.size:
+            self.close()
+            raise TablebaseError('File too short for a tablebase header.')
+
+        magic, version, self.board_size, winLength, self.maxOpen, \
+            self.count = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise TablebaseError('Not a tablebase.')
+        if len(self.mmap) != HEADER.size + ENTRY.size*self.count:
+            self.close()
+            raise TablebaseError('Truncated tablebase.')
+
+        self.winLength = winLength if winLength else None
+        self.view = memoryview(self.mmap)
+        self.entries = self.view[HEADER.size:].cast('Q')
+
+    def matches(self, game):
+        return (game.board_size == self.board_size and
+            game.winLength == self.winLength)
+
+    def lookup(self, hash):
+        '''
+        Returns the krist margin of the position 'hash', or None.
+        '''
+        key = hash & ~MARGIN
+        i = bisect.bisect_left(self.entries, key)
+        if i == self.count or self.entries[i] & ~MARGIN != key:
+            return None
+        return (self.entries[i] & MARGIN) - 128
+
+    def value(self, state):
+        '''
+        Returns the krist margin of the 'SearchState' 'state' under
+        perfect play, or None if it is not in the tablebase.
+        '''
+        game = state.game
+        if state.isTerminal():
+            maxLen, krists = game.kristScore()
+            return krists['x'] - krists['o']
+
+        if not game.cycleDetected:
+            return self.lookup(game.hash)
+
+        best = None
+        for action in state.actions():
+            state.play(action)
+            value = self.value(state)
+            state.undo()
+            if value is None:
+                return None
+            if best is None or (value > best if state.side == 'x' else
+                    value < best):
+                best = value
+        return best
+
+    def bestAction(self, server):
+        '''
+        Returns the action of the best value for the side to move in
+        the state of 'server', or None if the tablebase does not hold
+        it.
+        '''
+        if not self.matches(server.game):
+            return None
+
+        state = SearchState.fromServer(server)
+        if state.isTerminal() or (not state.game.cycleDetected and
+                self.lookup(state.game.hash) is None):
+            return None
+
+        best = None
+        bestValue = None
+        for action in state.actions():
+            state.play(action)
+            value = self.value(state)
+            state.undo()
+            if value is None:
+                return None
+            if best is None or (value > bestValue if state.side == 'x'
+                    else value < bestValue):
+                best = action
+                bestValue = value
+        return best
+
+    def close(self):
+        if hasattr(self, 'entries'):
+            self.entries.release()
+            self.view.release()
+        self.mmap.close()
+        self.file.close()
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print('Usage: python3 _tablebase.py <board-size> <output> '
+            '[open=<k>] [win=<k>]')
+        sys.exit(1)
+
+    board_size = int(sys.argv[1])
+    maxOpen = 4
+    winLength = None
+    for arg in sys.argv[3:]:
+        if arg[0:5] == 'open=':
+            maxOpen = int(arg[5:])
+        elif arg[0:4] == 'win=':
+            winLength = int(arg[4:])
+
+    table = solve(board_size, maxOpen, winLength,
+        lambda numOpen: print('Solving positions with '+str(numOpen)+
+            ' cells left to play.'))
+    writeTablebase(sys.argv[2], board_size, maxOpen, winLength, table)
+    print(str(len(table))+' positions saved to '+sys.argv[2])
@@ -0,0 +1,75 @@
+'''
+_zobrist.py implements Zobrist hashing of game positions.
+
+Features:
+- 64-bit keys for spooky marks, stable cells, the side to move and
+    a pending collapse.
+- keys are derived from their index with splitmix64, so they do not
+    depend on the order they are first requested in.
+'''
+
+MASK = (1 << 64) - 1
+
+# kinds of keys
+HALF     = 0    # first mark of a move that is not complete yet.
+EDGE     = 1    # spooky mark connecting two cells.
+STABLE   = 2    # classical mark.
+SIDE     = 3    # o to move.
+COLLAPSE = 4    # collapse pending on the cycle-forming move.
+
+def splitmix64(x):
+    x = (x + 0x9E3779B97F4A7C15) & MASK
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK
+    return x ^ (x >> 31)
+
+def player(markValue):
+    return 0 if markValue[0] == 'x' else 1
+
+class ZobristKeys:
+    def __init__(self, board_size, seed=0):
+        '''
+        Keys for a board of size 'board_size'. Cells are referred to
+        by their cell index. Spooky marks are keyed by the pair of 
+        cells they connect and their player, so that positions reached
+        by different move orders share a hash.
+        '''
+        self.board_size = board_size
+        self.numCells = board_size*board_size
+        self.seed = splitmix64(seed)
+        self.cache = dict()
+
+        self.side = self.key(SIDE, 0, 0)
+
+    def key(self, kind, index, player):
+        k = (((kind << 24) | index) << 1) | player
+        value = self.cache.get(k)
+        if value is None:
+            value = splitmix64(k ^ self.seed)
+            self.cache[k] = value
+        return value
+
+    def half(self, i, player):
+        return self.key(HALF, i, player)
+
+    def edge(self, i0, i1, player):
+        if i1 < i0:
+            i0, i1 = i1, i0
+        return self.key(EDGE, i0*self.numCells + i1, player)
+
+    def stable(self, i, player):
+        return self.key(STABLE, i, player)
+
+    def collapse(self, i0, i1):
+        if i1 < i0:
+            i0, i1 = i1, i0
+        return self.key(COLLAPSE, i0*self.numCells + i1, 0)
+
+# Keys are shared by every game on the same board size, so that hashes
+# can be compared across games.
+_keys = dict()
+
+def getKeys(board_size):
+    if board_size not in _keys:
+        _keys[board_size] = ZobristKeys(board_size)
+    return _keys[board_size]
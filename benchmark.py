@@ -0,0 +1,331 @@
+'''
+benchmark.py times the hot paths of the engine, for catching
+performance regressions.
+
+Features:
+- benchmarks of Game.updateState, Game.evaluateCell,
+    Game.previousState, Game.getMoves, Game.make_move/unmake_move,
+    Server.evaluateGame, Server.saveGame/loadGame on the files of
+    games/ and complete random games, over board sizes 3 to 8.
+- every benchmark replays games generated from a fixed seed, so runs
+    are comparable.
+- results as JSON: nanoseconds per operation, best of the repeats.
+    The repeats are interleaved over the run and the file benchmarks
+    keep the best time of each file, to keep timing noise below the
+    regression threshold.
+- comparison against a stored baseline, the exit status is 1 if a
+    benchmark got slower than the threshold.
+
+Usage: python3 benchmark.py [options], see --help.
+
+    python3 benchmark.py --save benchmark_baseline.json
+    python3 benchmark.py --compare benchmark_baseline.json
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from server import Server
+from _game import Game
+from _players import RandomPlayer, isTerminal
+
+GAMES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'games')
+
+# runs of each file benchmark per repeat.
+FILE_LOOPS = 4
+
+def randomGame(board_size, seed, bitboard=False):
+    '''
+    Plays a random game and returns its moves, a list of
+    (markValue, posList, collapse) in the order Game.updateState()
+    receives them, with the server at the end of the game.
+    '''
+    server = Server(board_size, bitboard)
+    player = RandomPlayer(random.Random(seed))
+    moves = list()
+    while not isTerminal(server):
+        collapsing = server.curr_state[1:] == '_COLLAPSE'
+        action = player.choose(server)
+        if collapsing:
+            # the side to move collapses the last move of the other.
+            mark = 'o' if server.curr_state[0] == 'X' else 'x'
+            moves.append((mark+str(server.moveNum-1), [action[0]], True))
+        else:
+            moves.append((server.currMark(), [action[0], action[1]], False))
+        server.playAction(action)
+    return moves, server
+
+def replayMoves(board_size, moves, bitboard, timers):
+    '''
+    Replays 'moves' on a new game through updateState(), timing each
+    kind of call into 'timers'. Returns the game.
+    '''
+    clock = time.perf_counter
+    game = Game(board_size, bitboard)
+    for markValue, posList, collapse in moves:
+        t0 = clock()
+        game.getMoves()
+        t1 = clock()
+        timers['getMoves'] += t1 - t0
+
+        if collapse:
+            t0 = clock()
+            game.updateState(markValue, posList, True)
+            timers['evaluateCell'] += clock() - t0
+        else:
+            t0 = clock()
+            game.updateState(markValue, posList[:1])
+            game.updateState(markValue, posList)
+            timers['updateState'] += clock() - t0
+    return game
+
+class Suite:
+    def __init__(self, sizes, games, repeat, bitboard=False):
+        '''
+        - sizes: board sizes to run.
+        - games: number of random games per size and repeat.
+        - repeat: each benchmark keeps its best time of 'repeat' runs.
+        - results: maps 'name/size' to {'ops', 'nsPerOp'}.
+        '''
+        self.sizes = sizes
+        self.games = games
+        self.repeat = repeat
+        self.bitboard = bitboard
+        self.results = dict()
+
+    def record(self, name, ops, seconds):
+        '''
+        Keeps the best time per operation of 'name'.
+        '''
+        if not ops:
+            return
+        nsPerOp = seconds*1e9/ops
+        best = self.results.get(name)
+        if best is None or nsPerOp < best['nsPerOp']:
+            self.results[name] = {'ops': ops, 'nsPerOp': round(nsPerOp, 1)}
+
+    def engine(self, board_size, games):
+        '''
+        updateState, evaluateCell, getMoves, previousState,
+        make_move/unmake_move and evaluateGame on 'games', seeded
+        random games from randomGame().
+        '''
+        clock = time.perf_counter
+        timers = dict.fromkeys(['getMoves', 'updateState',
+            'evaluateCell', 'previousState', 'make_move',
+            'evaluateGame'], 0.0)
+        ops = dict.fromkeys(timers, 0)
+
+        for moves, server in games:
+            game = replayMoves(board_size, moves, self.bitboard, timers)
+            ops['getMoves'] += len(moves)
+            for markValue, posList, collapse in moves:
+                ops['evaluateCell' if collapse else 'updateState'] += 1
+
+            # evaluateGame on the final position.
+            out = io.StringIO()
+            t0 = clock()
+            with contextlib.redirect_stdout(out):
+                server.evaluateGame()
+            timers['evaluateGame'] += clock() - t0
+            ops['evaluateGame'] += 1
+
+            # undo the whole game.
+            t0 = clock()
+            while game.movesTree.move is not None:
+                game.previousState()
+                ops['previousState'] += 1
+            timers['previousState'] += clock() - t0
+
+            # make and unmake the whole game.
+            t0 = clock()
+            undo = list()
+            for markValue, posList, collapse in moves:
+                undo.append(game.make_move(markValue, posList, collapse))
+            while len(undo):
+                game.unmake_move(undo.pop())
+            timers['make_move'] += clock() - t0
+            ops['make_move'] += len(moves)
+
+        for name in timers:
+            self.record(name+'/'+str(board_size), ops[name], timers[name])
+
+    def randomGames(self, board_size):
+        '''
+        Complete random games on the server, as in simulate.py.
+        '''
+        start = time.perf_counter()
+        for seed in range(self.games):
+            server = Server(board_size, self.bitboard)
+            player = RandomPlayer(random.Random(seed))
+            while not isTerminal(server):
+                server.playAction(player.choose(server))
+        self.record('randomGame/'+str(board_size), self.games,
+            time.perf_counter() - start)
+
+    def files(self, directory):
+        '''
+        saveGame and loadGame on the files of games/, in the text and
+        binary formats, saved to 'directory'. A single load takes well
+        under a millisecond, so each file keeps its best time of
+        FILE_LOOPS runs.
+        '''
+        names = sorted(os.listdir(GAMES_DIR))
+        best = dict()
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            for r in range(FILE_LOOPS):
+                for name in names:
+                    server = Server(3, self.bitboard)
+                    self.keep(best, 'loadGame', name, self.timed(
+                        server.loadGame, os.path.join(GAMES_DIR, name)))
+
+                    for ext in ('', '.q3r'):
+                        path = os.path.join(directory, name+ext)
+                        self.keep(best, 'saveGame'+ext, name, 
+                            self.timed(server.saveGame, path))
+
+                    server = Server(3, self.bitboard)
+                    self.keep(best, 'loadGame.q3r', name, self.timed(
+                        server.loadGame,
+                        os.path.join(directory, name+'.q3r')))
+
+        for name in best:
+            self.record(name, len(names), sum(best[name].values()))
+
+    def keep(self, best, name, fileName, seconds):
+        '''
+        Keeps the best time of 'name' on the file 'fileName'.
+        '''
+        times = best.setdefault(name, dict())
+        if fileName not in times or seconds < times[fileName]:
+            times[fileName] = seconds
+
+    def timed(self, function, *args):
+        start = time.perf_counter()
+        function(*args)
+        return time.perf_counter() - start
+
+    def run(self):
+        '''
+        Runs every benchmark 'repeat' times. The repeats are spread
+        over the whole run rather than run back to back, so that a
+        busy stretch of the machine slows a single repeat of each
+        benchmark rather than all of them.
+        '''
+        games = dict()
+        for board_size in self.sizes:
+            games[board_size] = [randomGame(board_size, seed, 
+                self.bitboard) for seed in range(self.games)]
+
+        directory = tempfile.mkdtemp()
+        try:
+            for r in range(self.repeat):
+                for board_size in self.sizes:
+                    self.engine(board_size, games[board_size])
+                    self.randomGames(board_size)
+                self.files(directory)
+        finally:
+            shutil.rmtree(directory)
+        return self.results
+
+def compare(results, baseline, threshold):
+    '''
+    Returns a list of (name, baseline, current, ratio) for every
+    benchmark of 'baseline' found in 'results', and the names of the
+    ones slower than 1 + 'threshold' times their baseline.
+    '''
+    rows = list()
+    regressions = list()
+    for name in sorted(baseline):
+        if name not in results:
+            continue
+        before = baseline[name]['nsPerOp']
+        after = results[name]['nsPerOp']
+        ratio = after/before if before > 0 else 1.0
+        rows.append((name, before, after, ratio))
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return rows, regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Engine benchmarks.')
+    parser.add_argument('--sizes', default='3-8',
+        help='board sizes, as a range 3-8 or a list 3,5')
+    parser.add_argument('--games', type=int, default=20,
+        help='random games per board size')
+    parser.add_argument('--repeat', type=int, default=15,
+        help='runs per benchmark, the best one is kept')
+    parser.add_argument('--bitboard', action='store_true',
+        help='run on the bitboard engine')
+    parser.add_argument('--save', default=None, metavar='FILE',
+        help='write the results to FILE as a baseline')
+    parser.add_argument('--compare', default=None, metavar='FILE',
+        help='compare with the baseline stored in FILE')
+    parser.add_argument('--threshold', type=float, default=0.25,
+        help='fraction slower than the baseline reported as a regression')
+    parser.add_argument('--json', action='store_true',
+        help='print the results as JSON')
+    args = parser.parse_args()
+
+    if '-' in args.sizes:
+        low, high = args.sizes.split('-')
+        sizes = list(range(int(low), int(high)+1))
+    else:
+        sizes = [int(size) for size in args.sizes.split(',')]
+
+    results = Suite(sizes, args.games, args.repeat, args.bitboard).run()
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'bitboard': args.bitboard,
+        'games': args.games,
+        'results': results,
+    }
+
+    if args.save is not None:
+        file = open(args.save, 'w')
+        json.dump(report, file, indent=1, sort_keys=True)
+        file.write('\n')
+        file.close()
+
+    regressions = list()
+    if args.compare is not None:
+        file = open(args.compare, 'r')
+        baseline = json.load(file)
+        file.close()
+        rows, regressions = compare(results, baseline['results'],
+            args.threshold)
+        report['regressions'] = regressions
+
+    if args.json:
+        print(json.dumps(report, sort_keys=True))
+
+    elif args.compare is not None:
+        print('{0:<24}{1:>14}{2:>14}{3:>8}'.format('Benchmark',
+            'baseline ns', 'current ns', 'ratio'))
+        for name, before, after, ratio in rows:
+            print('{0:<24}{1:>14.1f}{2:>14.1f}{3:>8.2f}{4}'.format(name,
+                before, after, ratio,
+                '  <-- slower' if name in regressions else ''))
+
+    else:
+        print('{0:<24}{1:>10}{2:>14}'.format('Benchmark', 'ops', 'ns/op'))
+        for name in sorted(results):
+            print('{0:<24}{1:>10}{2:>14.1f}'.format(name,
+                results[name]['ops'], results[name]['nsPerOp']))
+
+    if len(regressions):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+'''
+netserver.py serves games over TCP, many games per process.
+
+Features:
+- asyncio server, one task per connection.
+- games are 'Server' instances keyed by a random game id, shared by
+    every connection that knows it.
+- line protocol reusing the commands of Server.run().
+- compact state replies instead of the board drawn by printBoard().
+
+Protocol: one command per line. Every reply ends with a line starting
+with 'ok' or 'err'. Messages printed by a command come before it on
+lines starting with 'msg'.
+
+    new [n] [bitboard] [win=<k>] [tree=<k>]
+                                   create a game and join it, n from
+                                   2 to --max-size and k from 2 to n.
+                                   'tree' keeps at most k moveNodes of
+                                   its moves tree in memory.
+    join <id>                      join an existing game.
+    close                          delete the joined game.
+    state                          state of the joined game.
+    games                          number of games hosted.
+    quit                           close the connection.
+    play, undo, tree, goto, find, save, load, random
+                                   commands of Server.run() played on
+                                   the joined game. The counts of
+                                   'undo' and 'random' go from 1 to
+                                   --max-count, files loaded are of
+                                   boards up to --max-size. Moves are
+                                   refused once the game is over.
+
+The state of a game is replied as
+
+    ok <id> <curr_state> <moveNum> <cells> [over <length> <x> <o>]
+
+where <cells> lists the cells in row-major order separated by '/'. A
+stable cell is written as its mark in upper case ('X3'), a quantum
+cell as its spooky marks separated by '.' ('x1.o2'), an empty cell as
+'-'. 'over' gives the krist score once the game is over.
+
+Files given to 'save' and 'load' are read from and written to the
+directory given by --dir.
+
+Commands run on the event loop one at a time, their counts are
+bounded so that no connection holds it for long.
+
+Usage: python3 netserver.py [--host HOST] [--port PORT] [--dir DIR]
+    [--max-games N] [--max-count N] [--max-size N]
+'''
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import secrets
+
+from server import Server
+
+# commands of Server.run() that can be played on a game.
+COMMANDS = ('play', 'undo', 'tree', 'goto', 'find', 'save', 'load', 'random')
+
+def stateReply(gameId, server):
+    '''
+    Returns the compact state line of 'server'.
+    '''
+    game = server.game
+    cells = list()
+    for pos in game.board.keys():
+        stable = game.board.getStable(pos)
+        if stable is not None:
+            cells.append(stable.upper())
+        else:
+            cells.append('.'.join(game.board.getMarks(pos)) or '-')
+
+    reply = 'ok {0} {1} {2} {3}'.format(gameId, server.curr_state,
+        server.moveNum, '/'.join(cells))
+    if server.gameOver():
+        maxLen, bestkrist = server.kristScore()
+        reply += ' over {0} {1} {2}'.format(maxLen, bestkrist['x'],
+            bestkrist['o'])
+    return reply
+
+class GameHost:
+    def __init__(self, directory='.', maxGames=10000, maxCount=256,
+        maxSize=16):
+        '''
+        Hosts games for every connection.
+        - games: maps a game id to its 'Server'. Ids are random, a
+            game can only be joined by those given its id.
+        - directory: where 'save' and 'load' read and write files.
+        - maxGames: number of games hosted at most.
+        - maxCount: largest count of 'undo' and 'random'.
+        - maxSize: largest board size of the games created or loaded.
+        '''
+        self.games = dict()
+        self.directory = directory
+        self.maxGames = maxGames
+        self.maxCount = maxCount
+        self.maxSize = maxSize
+
+    def newGame(self, args):
+        '''
+        Creates a game from the arguments of 'new', returns its id.
+        Raises ValueError with the reason if they are out of range.
+        '''
+        board_size = 4
+        bitboard = False
+        winLength = None
+        treeBudget = None
+        for arg in args:
+            if arg == 'bitboard':
+                bitboard = True
+            elif arg[0:4] == 'win=':
+                winLength = int(arg[4:])
+            elif arg[0:5] == 'tree=':
+                treeBudget = int(arg[5:])
+            else:
+                board_size = int(arg)
+
+        if board_size < 2 or board_size > self.maxSize:
+            raise ValueError('board size out of range 2-{0}'.format(
+                self.maxSize))
+        if winLength is not None and (winLength < 2 or 
+                winLength > board_size):
+            raise ValueError('win length out of range 2-{0}'.format(
+                board_size))
+
+        gameId = secrets.token_hex(8)
+        while gameId in self.games:
+            gameId = secrets.token_hex(8)
+        self.games[gameId] = Server(board_size, bitboard, winLength)
+        self.games[gameId].maxSize = self.maxSize
+        if treeBudget is not None:
+            self.games[gameId].game.setTreeBudget(treeBudget)
+        return gameId
+
+    def filePath(self, name):
+        '''
+        Returns the path of the file 'name' in 'directory'.
+        '''
+        name = os.path.basename(name)
+        if name in ('', '.', '..'):
+            raise ValueError('invalid file name')
+        return os.path.join(self.directory, name)
+
+    def execute(self, gameId, cmdList):
+        '''
+        Runs a command of Server.run() on game 'gameId'. Returns the
+        lines it printed.
+        '''
+        server = self.games[gameId]
+        if cmdList[0] in ('save', 'load'):
+            cmdList = [cmdList[0], self.filePath(cmdList[1])] + cmdList[2:3]
+        if cmdList[0] == 'random' and len(cmdList) < 2:
+            cmdList = ['random', '1']
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            server.run(' '.join(cmdList))
+        return out.getvalue().splitlines()
+
+    def handle(self, session, line):
+        '''
+        Handles one line of a connection. 'session' is a dict holding
+        the id of the joined game. Returns the reply lines.
+        '''
+        cmdList = line.split()
+        if not len(cmdList):
+            return []
+
+        cmd = cmdList[0]
+        if cmd == 'games':
+            return ['ok {0}'.format(len(self.games))]
+
+        if cmd == 'new':
+            if len(self.games) >= self.maxGames:
+                return ['err too many games']
+            try:
+                session['game'] = self.newGame(cmdList[1:])
+            except ValueError as e:
+                return ['err ' + str(e)]
+            return [stateReply(session['game'], self.games[session['game']])]
+
+        if cmd == 'join':
+            if len(cmdList) != 2 or cmdList[1] not in self.games:
+                return ['err no such game']
+            session['game'] = cmdList[1]
+            return [stateReply(session['game'], self.games[session['game']])]
+
+        gameId = session.get('game')
+        if gameId not in self.games:
+            return ['err no game joined']
+
+        if cmd == 'state':
+            return [stateReply(gameId, self.games[gameId])]
+
+        if cmd == 'close':
+            del self.games[gameId]
+            del session['game']
+            return ['ok']
+
+        if cmd not in COMMANDS:
+            return ['err unknown command ' + cmd]
+
+        if cmd in ('undo', 'random') and len(cmdList) > 1:
+            count = int(cmdList[1])
+            if count < 1 or count > self.maxCount:
+                return ['err count out of range 1-{0}'.format(self.maxCount)]
+
+        if cmd in ('play', 'random') and self.games[gameId].gameOver():
+            return ['err game over']
+
+        lines = self.execute(gameId, cmdList)
+        reply = ['msg ' + msg for msg in lines if len(msg.strip())]
+        reply.append(stateReply(gameId, self.games[gameId]))
+        return reply
+
+    async def serve(self, reader, writer):
+        session = dict()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                line = line.decode('utf-8', 'replace').strip()
+                if line == 'quit':
+                    break
+
+                try:
+                    reply = self.handle(session, line)
+                except (ValueError, IndexError, KeyError):
+                    reply = ['err bad command: ' + line]
+
+                if len(reply):
+                    writer.write(('\n'.join(reply) + '\n').encode())
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+async def main(address, port, directory, maxGames, maxCount, maxSize):
+    gameHost = GameHost(directory, maxGames, maxCount, maxSize)
+    listener = await asyncio.start_server(gameHost.serve, address, port)
+    async with listener:
+        await listener.serve_forever()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Network game server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--dir', default='.',
+        help='directory of the files saved and loaded by clients')
+    parser.add_argument('--max-games', type=int, default=10000)
+    parser.add_argument('--max-count', type=int, default=256,
+        help='largest count of undo and random')
+    parser.add_argument('--max-size', type=int, default=16,
+        help='largest board size of the games created or loaded')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(main(args.host, args.port, args.dir, args.max_games,
+            args.max_count, args.max_size))
+    except KeyboardInterrupt:
+        pass
@@ -8,13 +8,31 @@ Features:
 - calculates the winner of a game.
 - saves game to a file using grammar implemented in game.py.
 - loads game from a file with error-check execution.
+- saves and loads games in the binary format of _record.py.
 - previous move in a game.
-- displays to the standard i/o.
+- computer players, see _players.py.
+- endgame tablebase consulted by the computer players, see 
+    _tablebase.py.
+- opening book consulted by the computer players, see _book.py.
+- optional latency, union-find and profiling statistics, see 
+    _stats.py.
+- displays to the standard i/o, see _render.py.
 '''
 
-import random
+import contextlib
+import io
+import json
 import sys
+import time
 from _game import *
+from _players import RandomPlayer, MCTSPlayer, TablebasePlayer, BookPlayer
+from _record import (RecordFile, RecordError, isRecord, saveRecord, buildTree,
+    TreeReplay)
+from _index import TreeIndex
+from _tablebase import Tablebase, TablebaseError
+from _book import OpeningBook
+from _render import BoardRenderer
+from _stats import Stats
 
 class Server:
 
@@ -22,11 +40,20 @@ class Server:
     curr_state = "X_0"    # x plays the first move.
     moveNum   = 1         # the number of moves
 
-    def __init__(self, board_size):
+    def __init__(self, board_size, bitboard=False, winLength=None):
         
         # class constructor
         self.posList = list()
-        self.game = Game(board_size)
+        self.game = Game(board_size, bitboard, winLength)
+        self.mcts = None
+        self.tablebase = None
+        self.book = None
+        self.bookPlies = None
+        self.bookGames = 1
+        self.stats = None
+
+        # largest board size of the games loaded, or None.
+        self.maxSize = None
 
     def currMark(self):
         return self.curr_state[0].lower()+str(self.moveNum)
@@ -36,6 +63,10 @@ class Server:
         Implementation of state transitions of the
         server. 'pos', a 2-tuple is required by this function.
         '''
+        if self.curr_state in ('X_0', 'O_0') and self.gameOver():
+            print('Error: The game is over.')
+            return
+
         if self.curr_state == "X_0":
             if self.game.updateState('x'+str(self.moveNum), [pos]):
                 self.posList = [pos]
@@ -74,74 +105,47 @@ class Server:
             if self.game.updateState('x'+str(self.moveNum-1), [pos], True):
                 self.curr_state = "O_0"
 
-    def terminateGame(self):
-        if self.moveNum >= self.game.board_size**2:
-            count = 0
-            for k in self.game.board.keys():
-                if not self.game.board[k].stable:
-                    count += 1
+    def gameOver(self):
+        '''
+        Returns True once at most one cell is left to play, or a krist
+        of the win length of the game was made.
+        '''
+        return self.game.gameOver()
 
-            if count <= 1:
+    def terminateGame(self):
+        if self.gameOver():
 
-                # calculate scores
-                self.evaluateGame()
+            # calculate scores
+            self.evaluateGame()
 
-                # end game
-                sys.exit(0)
+            # end game
+            self.close()
+            sys.exit(0)
 
     def evaluateGame(self):
+        maxLen, bestkrist = self.kristScore()
+        print('Krist length:', maxLen)
+        print(bestkrist)
 
+    def getWinner(self):
+        return self.game.getWinner()
 
-        def evaluateCell(row, col, changePos, valueDict, initMark):
-            currVal = 1
-            while (row in range(self.game.board_size) and 
-                col in range(self.game.board_size)):
-                
-                if self.game.board[(row,col)].stable is None:
-                    break
-
-                mark = self.game.board[(row,col)].stable[0]
-                if mark == initMark:
-                    valueDict[(row,col)] = max(currVal, valueDict[(row,col)])
-                    currVal += 1
-                    row += changePos[0]
-                    col += changePos[1]
-                else:
-                    break
-
-        value = dict()
-        for i in range(self.game.board_size):
-            for j in range(self.game.board_size):
-                value[(i,j)] = 0
-
-        for i in range(self.game.board_size):
-            for j in range(self.game.board_size):
-                if self.game.board[(i,j)].stable is not None:
-                    mark = self.game.board[(i,j)].stable[0]
-                    evaluateCell(i,j,(0,1),value,mark)
-                    evaluateCell(i,j,(1,0),value,mark)
-                    evaluateCell(i,j,(1,1),value,mark)
-                    evaluateCell(i,j,(1,-1),value,mark)
-
-        maxLen = 1
-        bestkrist = {'x':0, 'o':0}
-        for k in value.keys():
-            if self.game.board[k].stable is None:
-                continue
-
-            mark = self.game.board[k].stable[0]
-            
-            if value[k] == maxLen:
-                bestkrist[mark] += 1
+    def kristScore(self):
+        return self.game.kristScore()
 
-            elif value[k] > maxLen:
-                maxLen = value[k]
-                bestkrist['x'] = 0
-                bestkrist['o'] = 0
-                bestkrist[mark] = 1
+    def syncState(self):
+        '''
+        Sets 'curr_state' and 'moveNum' from the position of 'game',
+        after the game was moved to a complete move.
+        '''
+        self.posList = list()
+        self.moveNum = self.game.plies + 1
 
-        print('Krist length:', maxLen)
-        print(bestkrist)
+        mark = 'X' if self.moveNum % 2 else 'O'
+        if self.game.cycleDetected:
+            self.curr_state = mark+'_COLLAPSE'
+        else:
+            self.curr_state = mark+'_0'
 
     def previousMove(self):
         '''
@@ -173,160 +177,412 @@ class Server:
             else:
                 self.curr_state = mark+'_0'
 
+    def jumpTo(self, nodeId):
+        '''
+        Sets the game to the move with id 'nodeId' in the moves tree,
+        provided that the current move is complete. A move inside a
+        collapse chain sets the game after the whole collapse.
+        '''
+        if self.curr_state == 'X_1' or self.curr_state == 'O_1':
+            print('Error: Current state does not allow jumping to a move.')
+            return
+
+        if self.game.getNode(nodeId) is None:
+            print('Error: No move with id {0}.'.format(nodeId))
+            return
+
+        self.game.jumpTo(nodeId)
+        self.syncState()
+
     def saveGame(self, filePath):
         '''
         Saves game to the provided 'filePath'. Creates a
         file if it does not exist, otherwise replaces the
-        original file.
+        original file. Paths ending with '.q3r' are saved in the
+        binary format of _record.py.
         '''
-        file = open(filePath, 'w+')
-        self.game.printTree(file)
-        file.close()
+        if filePath.endswith('.q3r'):
+            saveRecord(self.game, filePath)
+        else:
+            file = open(filePath, 'w+')
+            self.game.printTree(file)
+            file.close()
 
         print ('Game saved to '+filePath)
 
     def loadGame(self, filePath):
         '''
-        Loads a game from the passed in 'filePath'.
-        TO DO: Improve error-checking in the file grammar.
+        Loads a game from the passed in 'filePath'. The file is read
+        line by line, and each line is played after the last move read
+        one level above it, see TreeReplay in _record.py. The file is
+        rejected at the first line that is not a legal move. The board
+        is then set at the move marked with '<---'.
         '''
 
-        def validMarkValue(server, moveStr):
-            return moveStr[0] in 'xo'
+        def validMarkValue(moveStr):
+            return moveStr[0] in 'xo' and moveStr[1:].isdigit()
 
-        def validMarkPos(pos):
-            return (pos[0] in range(0,self.game.board_size) 
-                and pos[1] in range(0,self.game.board_size))
-
-        loadingGame = False
-        errorDetected = False
-        collapsing = False
-        prevDepth = 0
-        currMoveStr = None
+        def validMarkPos(game, pos):
+            return (pos[0] in range(0,game.board_size) 
+                and pos[1] in range(0,game.board_size))
 
         try:
+            if isRecord(filePath):
+                self.loadRecord(filePath)
+                return
             file = open(filePath, 'r')
-                
-            for line in file:
-                line = line.strip()
+        except OSError:
+            print('File "'+filePath+'" not found.')
+            return
 
-                # Set board size and create an instance of
-                # the server.
-                # format: SIZE=<n>
-                if line[0:5] == 'SIZE=':
-                    server = Server(int(line[5]))
+        game = None
+        replay = None
+        current = None
 
-                # Start reading the game.
-                elif line == 'INIT_STATE':
-                    loadingGame = True
+        for line in file:
+            line = line.strip()
+            if not len(line):
+                continue
 
-                # read move string and update server state.
-                else:
+            # Set board size and create an instance of the game.
+            # format: SIZE=<n>
+            if line[0:5] == 'SIZE=':
+                if not line[5:].isdigit() or int(line[5:]) < 1:
+                    print('Load error: Invalid board size in line > '+line)
+                    file.close()
+                    return
+                if self.maxSize is not None and int(line[5:]) > self.maxSize:
+                    print('Load error: Board size out of range in line > '+
+                        line)
+                    file.close()
+                    return
+                if (self.game.winLength is not None and 
+                        int(line[5:]) < self.game.winLength):
+                    print('Load error: Board size below the win length in '
+                        'line > '+line)
+                    file.close()
+                    return
+                game = Game(int(line[5:]), self.game.bitboard, 
+                    self.game.winLength)
+                game.setTreeBudget(self.game.treeBudget)
+                continue
 
-                    strList = line.split(' ')
-                    
-                    if not loadingGame:
-                        break
-
-                    # input move string
-                    currDepth = strList[0].count('.')
-                    moveStr = strList[0].lstrip('.')
-
-                    # validate moveStr
-                    if not validMarkValue(server, moveStr):
-                        errorDetected = False
-                        print('Load error: Invalid mark value detecting in line > '+line)
-                        return
-
-                    moveStrList = moveStr.split('-')
-                    for val in moveStrList[1:]:
-                        if val not in '0123456789':
-                            errorDetected = True
-                            print('Load error: Invalid pos value detecting in line > '+line)
-                            return
-
-                    posList = list()
-                    pos0 = (int(moveStrList[1]), int(moveStrList[2]))
-                    if not validMarkPos(pos0):
-                        errorDetected = True
-                        print('Load error: Invalid pos value detecting in line > '+line)
-                        return
-                    posList.append(pos0)
-
-                    if len(moveStrList) == 5:
-                        pos1 = (int(moveStrList[3]), int(moveStrList[4]))
-                        if not validMarkPos(pos1):
-                            errorDetected = True
-                            print('Load error: Invalid pos value detecting in line > '+line)
-                            return
-                        posList.append(pos1)
-
-                    # create move object
-                    move = Move(moveStrList[0], posList)
-                    print(move)
-
-                    # assign the move where the board 
-                    # was saved from.
-                    if len(strList) == 2:
-                        if strList[1] == '<---':
-                            currMoveStr = move.__str__()
-
-                    if prevDepth >= currDepth:
-                        while move.markValue != server.game.movesTree.move.markValue:
-                            server.previousMove()
-
-                        server.previousMove()
-
-                    prevDepth = currDepth
-
-                    # update server by playing the move.
-                    if move.isCollapse():
-                        if collapsing:
-                            continue
-                        else:
-                            collapsing = True
-                            server.update(move.posList[0])
-                    else:
-                        collapsing = False
-                        server.update(move.posList[0])
-                        server.update(move.posList[1])
-            
-            file.close()
+            if game is None:
+                print('Load error: Missing board size before line > '+line)
+                file.close()
+                return
+
+            strList = line.split(' ')
+
+            # Start reading the game.
+            if strList[0] == 'INIT_STATE':
+                if replay is not None:
+                    replay.finish()
+                replay = TreeReplay(game)
+                if len(strList) == 2 and strList[1] == '<---':
+                    current = game.movesTree.id
+                continue
+
+            # input move string
+            currDepth = len(strList[0]) - len(strList[0].lstrip('.'))
+            moveStr = strList[0][currDepth:]
+            if replay is None or currDepth < 1 or currDepth > len(replay.frames):
+                print('Load error: Invalid depth detected in line > '+line)
+                file.close()
+                return
+
+            # validate moveStr
+            moveStrList = moveStr.split('-')
+            if not validMarkValue(moveStrList[0]):
+                print('Load error: Invalid mark value detecting in line > '+line)
+                file.close()
+                return
+
+            if (len(moveStrList) not in (3, 5) or 
+                    not all(val.isdigit() for val in moveStrList[1:])):
+                print('Load error: Invalid pos value detecting in line > '+line)
+                file.close()
+                return
+
+            posList = list()
+            for i in range(1, len(moveStrList), 2):
+                pos = (int(moveStrList[i]), int(moveStrList[i+1]))
+                if not validMarkPos(game, pos):
+                    print('Load error: Invalid pos value detecting in line > '+line)
+                    file.close()
+                    return
+                posList.append(pos)
+
+            # play the move after the last move read one level above.
+            try:
+                nodeId = replay.add(currDepth, Move(moveStrList[0], posList))
+            except RecordError as e:
+                print('Load error: '+e.message+' in line > '+line)
+                file.close()
+                return
+
+            # assign the move where the board was saved from.
+            if len(strList) == 2 and strList[1] == '<---':
+                current = nodeId
+
+        file.close()
+
+        if game is None or replay is None:
+            print('Error detected in the file '+filePath)
+            return
+        replay.finish()
+
+        # set the board at the saved move.
+        if current is not None:
+            game.jumpTo(current)
+
+        self.game = game
+        self.syncState()
+
+        print('Game loaded from '+filePath)
+
+    def loadRecord(self, filePath):
+        '''
+        Loads a game saved in the binary format of _record.py. The
+        moves tree is built from the records, rejecting the first
+        illegal one, then the moves from the root to the saved move
+        are played.
+        '''
+        try:
+            record = RecordFile(filePath)
+        except RecordError as e:
+            print('Load error: '+e.message)
+            return
+
+        try:
+            if self.maxSize is not None and record.board_size > self.maxSize:
+                raise RecordError('Board size out of range.')
+            if (self.game.winLength is not None and 
+                    record.board_size < self.game.winLength):
+                raise RecordError('Board size below the win length.')
+            game = Game(record.board_size, self.game.bitboard, 
+                self.game.winLength)
+            game.setTreeBudget(self.game.treeBudget)
+            nodes = buildTree(game, record)
+            if record.current >= len(nodes):
+                raise RecordError('Invalid current record.')
+            game.jumpTo(nodes[record.current])
+        except RecordError as e:
+            print('Load error: '+e.message)
+            return
+        finally:
+            record.close()
+
+        self.game = game
+        self.syncState()
 
+        print('Game loaded from '+filePath)
+
+    def loadIndex(self, filePath):
+        '''
+        Opens a game saved in either format lazily: only the moves 
+        from the root to the saved move are read, other moves are 
+        read when the game goes into them. The file is indexed on 
+        the first open, see _index.py.
+        '''
+        try:
+            index = TreeIndex(filePath, self.maxSize)
         except OSError:
             print('File "'+filePath+'" not found.')
             return
+        except RecordError as e:
+            print('Load error: '+e.message)
+            return
 
-        # if error was detected, destroy the server.
-        if errorDetected:
-            del server
-            print('Error detected in the file '+filePath)
-        
-        # otherwise, assign server to self.
-        else:
-            # set information in self to the information
-            # stored in server
-            self.posList = server.posList[:]
-            self.game = server.game
-            self.moveNum = server.moveNum
-            self.curr_state = server.curr_state
+        if (self.game.winLength is not None and 
+                index.board_size < self.game.winLength):
+            index.close()
+            print('Load error: Board size below the win length.')
+            return
+
+        game = Game(index.board_size, self.game.bitboard, 
+            self.game.winLength)
+        game.setTreeBudget(self.game.treeBudget)
+        game.openIndex(index)
+        game.jumpTo(index.current)
+
+        self.game = game
+        self.syncState()
+
+        print('Game loaded from '+filePath)
+
+    def playAction(self, action):
+        '''
+        Plays each position of 'action' in order, see _players.py.
+        '''
+        for pos in action:
+            self.update(pos)
 
-            # set movesTree at currMove
-            self.game.resetTree(currMoveStr)
+    def openTablebase(self, filePath):
+        '''
+        Opens the tablebase at 'filePath', or closes the current one
+        if 'filePath' is 'off'.
+        '''
+        if self.tablebase is not None:
+            self.tablebase.close()
+            self.tablebase = None
+        if filePath == 'off':
+            return
+
+        try:
+            self.tablebase = Tablebase(filePath)
+        except OSError:
+            print('File "'+filePath+'" not found.')
+            return
+        except TablebaseError as e:
+            print('Tablebase error: '+e.message)
+            return
+
+        if not self.tablebase.matches(self.game):
+            print('Warning: the tablebase was solved for another board '
+                'size or win length, it is not used for this game.')
+
+    def close(self):
+        '''
+        Stops the workers of the computer player and closes the 
+        tablebase and the opening book.
+        '''
+        if self.mcts is not None:
+            self.mcts.close()
+            self.mcts = None
+        self.openTablebase('off')
+        self.openBook('off')
+
+    def openBook(self, filePath, maxPlies=None, minGames=1):
+        '''
+        Opens the opening book at 'filePath', used for the first 
+        'maxPlies' plies, or closes the current one if 'filePath' is
+        'off'.
+        '''
+        if self.book is not None:
+            self.book.close()
+            self.book = None
+        if filePath == 'off':
+            return
+
+        try:
+            self.book = OpeningBook(filePath)
+        except OSError:
+            print('File "'+filePath+'" not found.')
+            return
+        except RecordError as e:
+            print('Book error: '+e.message)
+            return
+
+        self.bookPlies = maxPlies
+        self.bookGames = minGames
+        if not self.book.matches(self.game):
+            print('Warning: the book was built for another board size '
+                'or win length, it is not used for this game.')
+
+    def playComputer(self, player, numMoves):
+        '''
+        Lets 'player' play 'numMoves' moves. A collapse and the move
+        following it count as one move. Positions held by the 
+        tablebase are played perfectly, the first plies follow the
+        opening book.
+        '''
+        if self.tablebase is not None:
+            player = TablebasePlayer(self.tablebase, player)
+        if self.book is not None:
+            player = BookPlayer(self.book, player, self.bookPlies, 
+                self.bookGames)
+
+        while numMoves:
+            if self.game.gameOver():
+                break
+
+            if self.curr_state[1:] == '_COLLAPSE':
+                self.playAction(player.choose(self))
+
+                if self.game.gameOver():
+                    break
+                self.playAction(player.choose(self))
+
+            elif self.curr_state[1:] == '_0':
+                self.playAction(player.choose(self))
 
-            print('Game loaded from '+filePath)
+            numMoves -= 1
 
     def run(self, cmd):
+        '''
+        Runs the command 'cmd'. Its latency is recorded while stats
+        are on.
+        '''
         cmdList = cmd.split(' ')
+        if cmdList[0] == 'stats':
+            self.runStats(cmdList[1:])
+            return
+
+        if self.stats is None:
+            self.runCommand(cmdList)
+            return
+
+        start = time.perf_counter()
+        self.runCommand(cmdList)
+        self.stats.time(cmdList[0], time.perf_counter() - start)
+
+        # 'load' replaces the game.
+        if self.game.stats is not self.stats:
+            self.game.setStats(self.stats)
+
+    def runStats(self, args):
+        '''
+        usage: stats [on | off | reset | profile on|off | 
+            memory on|off | dump <file-path>]
+        Without arguments, prints the stats as JSON.
+        '''
+        if len(args) and args[0] in ('on', 'reset', 'profile', 'memory'):
+            if self.stats is None or args[0] == 'reset':
+                self.stats = Stats()
+                self.game.setStats(self.stats)
+
+        if self.stats is None:
+            print('Stats are off.')
+
+        elif not len(args):
+            print(json.dumps(self.stats.toDict(self.game), indent=1))
+
+        elif args[0] == 'off':
+            self.stats.stopProfile()
+            self.stats.stopMemory()
+            self.stats = None
+            self.game.setStats(None)
+
+        elif args[0] == 'profile' and args[1:] == ['on']:
+            self.stats.startProfile()
+
+        elif args[0] == 'profile' and args[1:] == ['off']:
+            print(self.stats.stopProfile())
+
+        elif args[0] == 'memory' and args[1:] == ['on']:
+            self.stats.startMemory()
+
+        elif args[0] == 'memory' and args[1:] == ['off']:
+            print(json.dumps(self.stats.stopMemory(), indent=1))
+
+        elif args[0] == 'dump' and len(args) == 2:
+            self.stats.dump(args[1], self.game)
+            print('Stats saved to '+args[1])
+
+        elif args[0] not in ('on', 'reset'):
+            print('Error: Unknown stats command.')
+
+    def runCommand(self, cmdList):
         if cmdList[0] == 'play':
 
             # play a move
             pos = (int(cmdList[1]), int(cmdList[2]))
-            server.update(pos)
+            self.update(pos)
 
             if len(cmdList) == 5:
                 pos = (int(cmdList[3]), int(cmdList[4]))
-                server.update(pos)
+                self.update(pos)
 
         elif cmdList[0] == 'undo':
             count = 1
@@ -334,129 +590,74 @@ class Server:
                 count = int(cmdList[1])
 
             while count:
-                server.previousMove()
+                self.previousMove()
                 count -= 1
 
         elif cmdList[0] == 'tree':
-            server.game.printTree()
+            self.game.printTree()
+
+        elif cmdList[0] == 'goto':
+            self.jumpTo(int(cmdList[1]))
+
+        elif cmdList[0] == 'find':
+            print(' '.join(str(nodeId) for nodeId in 
+                self.game.findNodes(cmdList[1])))
 
         elif cmdList[0] == 'save':
-            server.saveGame(cmdList[1])
+            self.saveGame(cmdList[1])
 
         elif cmdList[0] == 'load':
-            server.loadGame(cmdList[1])
+            if cmdList[2:] == ['lazy']:
+                self.loadIndex(cmdList[1])
+            else:
+                self.loadGame(cmdList[1])
 
         elif cmdList[0] == 'random':
             '''
             Implementation of a built-in random player.
             '''
+            self.playComputer(RandomPlayer(), int(cmdList[1]))
 
-            def randCollapse(posList):
-                server.update(random.choice(posList))
-
-            def randPlay(posList):
-                posList = random.sample(posList, 2)
-                server.update(posList[0])
-                server.update(posList[1])
-
-            numMoves = int(cmdList[1])
-            while numMoves:
-                posList = server.game.getMoves()
-
-                if len(posList) < 2:
-                    break
-
-                if server.curr_state[1:] == '_COLLAPSE':
-                    randCollapse(posList)
+        elif cmdList[0] == 'mcts':
+            '''
+            Monte Carlo Tree Search player.
+            usage: mcts <k> [playouts] [seconds]
+            '''
+            if self.mcts is None:
+                self.mcts = MCTSPlayer()
 
-                    posList = server.game.getMoves()
+            if len(cmdList) > 2:
+                self.mcts.playouts = int(cmdList[2])
+            if len(cmdList) > 3:
+                self.mcts.timeLimit = float(cmdList[3])
 
-                    if len(posList) < 2:
-                        break
-                    randPlay(posList)
+            self.playComputer(self.mcts, int(cmdList[1]))
 
-                elif server.curr_state[1:] == '_0':
-                    randPlay(posList)
+        elif cmdList[0] == 'tablebase':
+            '''
+            Endgame tablebase of the computer players.
+            usage: tablebase <file-path> | off
+            '''
+            self.openTablebase(cmdList[1])
 
-                numMoves -= 1
+        elif cmdList[0] == 'book':
+            '''
+            Opening book of the computer players.
+            usage: book <file-path> [plies] [games] | off
+            '''
+            self.openBook(cmdList[1], 
+                int(cmdList[2]) if len(cmdList) > 2 else None,
+                int(cmdList[3]) if len(cmdList) > 3 else 1)
 
         elif cmdList[0] == 'exit':
+            self.close()
             sys.exit(0)
 
 def printBoard(game):
     '''
     Given 'game', an instance of game.Game class, print the board to stdio.
     '''
-
-    def printColNumbers():
-        for col in range(game.board_size):
-            print('      {0}      '.format(col), end='')
-
-    def printDashes():
-        print('\n    '+'-'*(game.board_size*13))
-
-    def printCell(row, col, k):
-        if game.board[(row,col)].stable is not None:
-
-            # If stable, print a big X or a big O
-
-            # draw an evaluated mark
-            if game.board[(row,col)].stable[0] == 'x':
-                if k == 3  :  print("            |", end="")
-                elif k == 6:  print("     \/     |", end="")
-                elif k == 9:  print("     /\     |", end="")
-                else       :  print("            |", end="")
-
-            elif game.board[(row,col)].stable[0] == 'o':
-                if k == 3  :  print("     __     |", end="")
-                elif k == 6:  print("    |  |    |", end="")
-                elif k == 9:  print("    |__|    |", end="")
-                else       :  print("            |", end="")
-
-            return
-
-        # Otherwise, print each spooky mark in the cell.
-        numMarks = len(game.board[(row,col)].marksList)
-        outStr = ""
-        i = k-3
-        while i < k and i < numMarks:
-            outStr += game.board[(row,col)].marksList[i]
-
-            # If moveNum of the move is a single digit
-            # number, pad an extra space to 'outStr'
-            if len(game.board[(row,col)].marksList[i]) < 3:
-                outStr += " "
-
-            if i < numMarks-1:
-                outStr += " "
-            i += 1
-
-        while len(outStr) < 12:
-            outStr += " "
-        outStr += "|"
-
-        print(outStr, end="")
-
-    print()
-    printColNumbers()
-    for row in range(game.board_size):
-        printDashes()
-        for k in range(3, 13, 3):
-            if k == 6:
-                print(str(row)+'  | ', end='')
-            else:
-                print('   | ', end='')
-            for col in range(game.board_size):
-                printCell(row,col,k)
-            if k < 12:
-                if k == 6:
-                    print('  '+str(row))
-                else:
-                    print()
-    
-    printDashes()
-    printColNumbers()
-    print('\n')
+    BoardRenderer().draw(game)
 
 if __name__ == '__main__':
 
@@ -465,19 +666,60 @@ if __name__ == '__main__':
         size = int(sys.argv[1])
     else:
         size = 4
+    bitboard = 'bitboard' in sys.argv[2:]
+    winLength = None
+    for arg in sys.argv[2:]:
+        if arg[0:4] == 'win=':
+            winLength = int(arg[4:])
 
     # Initialize server
-    server = Server(size)
+    if winLength is not None and winLength not in range(1, size+1):
+        print('Error: The win length must be from 1 to the board size.')
+        sys.exit(1)
+    server = Server(size, bitboard, winLength)
+
+    # 'tree=<k>' keeps at most k moveNodes in memory.
+    for arg in sys.argv[2:]:
+        if arg[0:5] == 'tree=':
+            server.game.setTreeBudget(int(arg[5:]))
+
+    # 'tablebase=<file>' lets the computer players look up endgames.
+    for arg in sys.argv[2:]:
+        if arg[0:10] == 'tablebase=':
+            server.openTablebase(arg[10:])
+
+    # 'book=<file>' lets the computer players follow an opening book.
+    for arg in sys.argv[2:]:
+        if arg[0:5] == 'book=':
+            server.openBook(arg[5:])
+
+    # 'quiet' draws nothing, for scripted use. 'ansi' redraws only the
+    # changed parts of the board, messages are shown below it.
+    quiet = 'quiet' in sys.argv[2:]
+    ansi = 'ansi' in sys.argv[2:] and not quiet
+    renderer = BoardRenderer(ansi=ansi, quiet=quiet)
 
     # Run game
-    printBoard(server.game)
+    renderer.draw(server.game)
     while True:
-        cmd = input('[{}] '.format(server.moveNum))
-        server.run(cmd)
+        # end of piped input ends the session like 'exit'.
+        try:
+            cmd = input('' if quiet else '[{}] '.format(server.moveNum))
+        except EOFError:
+            server.close()
+            sys.exit(0)
+        messages = list()
+        if ansi:
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                server.run(cmd)
+            messages = out.getvalue().splitlines()
+        else:
+            server.run(cmd)
 
-        printBoard(server.game)
-        print('Server state:', server.curr_state)
-        print('Last move:', server.game.movesTree.move)
+        renderer.draw(server.game, messages + [
+            'Server state: '+server.curr_state,
+            'Last move: '+str(server.game.movesTree.move)])
 
         # terminate game if done
-        server.terminateGame()
\ No newline at end of file
+        server.terminateGame()
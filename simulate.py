@@ -0,0 +1,168 @@
+'''
+simulate.py plays games between computer players without a terminal,
+for generating training and regression data.
+
+Features:
+- plays N complete games on a process pool.
+- each game is seeded from the base seed and its index, so results do
+    not depend on the number of workers.
+- aggregate results: wins, krist lengths, game lengths and games/sec.
+- optionally saves every game using the grammar of Game.printTree().
+
+Usage: python3 simulate.py <games> [options], see --help.
+'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import time
+
+from server import Server
+from _players import RandomPlayer, MCTSPlayer, isTerminal
+
+def makePlayer(spec, rng):
+    '''
+    Creates a player from 'spec': 'random' or 
+    'mcts[:playouts[:seconds]]'. MCTS players search in-process since
+    games already run on a pool.
+    '''
+    args = spec.split(':')
+    if args[0] == 'random':
+        return RandomPlayer(rng)
+
+    if args[0] == 'mcts':
+        playouts = int(args[1]) if len(args) > 1 else 1000
+        timeLimit = float(args[2]) if len(args) > 2 else None
+        return MCTSPlayer(playouts, timeLimit, workers=1, 
+            seed=rng.getrandbits(32))
+
+    raise ValueError('Unknown player: ' + spec)
+
+def playGame(args):
+    '''
+    Plays game number 'index' to the end. Returns a dict of results.
+    '''
+    index, board_size, bitboard, winLength, specs, seed, saveDir = args
+
+    rng = random.Random(seed + index)
+    players = {'x': makePlayer(specs[0], rng), 'o': makePlayer(specs[1], rng)}
+
+    start = time.time()
+    server = Server(board_size, bitboard, winLength)
+    collapses = 0
+    while not isTerminal(server):
+        if server.curr_state[1:] == '_COLLAPSE':
+            collapses += 1
+
+        player = players[server.curr_state[0].lower()]
+        server.playAction(player.choose(server))
+
+    maxLen, bestkrist = server.kristScore()
+    if saveDir is not None:
+        file = open(os.path.join(saveDir, 'game'+str(index)), 'w')
+        server.game.printTree(file, echo=False)
+        file.close()
+
+    return {
+        'game': index,
+        'winner': server.getWinner(),
+        'kristLength': maxLen,
+        'krists': bestkrist,
+        'moves': server.moveNum - 1,
+        'collapses': collapses,
+        'seconds': time.time() - start,
+    }
+
+def summarize(results, seconds):
+    '''
+    Aggregates the results of every game.
+    '''
+    wins = {'x': 0, 'o': 0, 'draw': 0}
+    kristLengths = dict()
+    for result in results:
+        wins[result['winner'] or 'draw'] += 1
+        length = str(result['kristLength'])
+        kristLengths[length] = kristLengths.get(length, 0) + 1
+
+    moves = [result['moves'] for result in results]
+    return {
+        'games': len(results),
+        'wins': wins,
+        'kristLengths': kristLengths,
+        'moves': {
+            'mean': sum(moves)/len(moves) if len(moves) else 0,
+            'min': min(moves) if len(moves) else 0,
+            'max': max(moves) if len(moves) else 0,
+        },
+        'collapses': sum(result['collapses'] for result in results),
+        'seconds': seconds,
+        'gamesPerSec': len(results)/seconds if seconds > 0 else 0,
+    }
+
+def simulate(games, board_size=4, playerX='random', playerO='random', 
+    seed=0, workers=None, bitboard=False, saveDir=None, winLength=None):
+    '''
+    Plays 'games' games and returns (summary, results).
+    '''
+    if saveDir is not None and not os.path.isdir(saveDir):
+        os.makedirs(saveDir)
+
+    jobs = [(i, board_size, bitboard, winLength, (playerX, playerO), seed, 
+        saveDir) for i in range(games)]
+
+    if workers is None:
+        workers = os.cpu_count()
+
+    start = time.time()
+    if workers == 1:
+        results = [playGame(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(workers)
+        results = pool.map(playGame, jobs, max(1, games//(4*workers)))
+        pool.close()
+        pool.join()
+    seconds = time.time() - start
+
+    return summarize(results, seconds), results
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless self-play.')
+    parser.add_argument('games', type=int, help='number of games')
+    parser.add_argument('--size', type=int, default=4, help='board size')
+    parser.add_argument('-x', default='random', 
+        help="x player: random or mcts[:playouts[:seconds]]")
+    parser.add_argument('-o', default='random', help='o player')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, 
+        help='number of processes, defaults to the number of cores')
+    parser.add_argument('--bitboard', action='store_true', 
+        help='run games on the bitboard engine')
+    parser.add_argument('--win', type=int, default=None, metavar='K',
+        help='end games once a krist of length K is made')
+    parser.add_argument('--save', default=None, metavar='DIR',
+        help='save every game to DIR')
+    parser.add_argument('--json', action='store_true', 
+        help='print the summary and every game as JSON')
+    args = parser.parse_args()
+    if args.win is not None and args.win not in range(1, args.size+1):
+        parser.error('--win must be from 1 to the board size')
+
+    summary, results = simulate(args.games, args.size, args.x, args.o, 
+        args.seed, args.workers, args.bitboard, args.save, args.win)
+
+    if args.json:
+        print(json.dumps({'summary': summary, 'games': results}))
+        return
+
+    print('Games:', summary['games'], ' x:', args.x, ' o:', args.o, 
+        ' size:', args.size)
+    print('Wins:', summary['wins'])
+    print('Krist lengths:', summary['kristLengths'])
+    print('Moves: mean {mean:.1f} min {min} max {max}'.format(**summary['moves']))
+    print('Collapses:', summary['collapses'])
+    print('Games/sec: {:.1f}'.format(summary['gamesPerSec']))
+
+if __name__ == '__main__':
+    main()
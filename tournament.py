@@ -0,0 +1,347 @@
+'''
+tournament.py plays matches between external engine programs, for
+evaluating engine builds against each other.
+
+Features:
+- engines are programs launched per game, talking over their stdin
+    and stdout with the line protocol below.
+- per-move time control, an engine that times out, plays an illegal
+    move or exits loses the game.
+- round robin between every pair of engines, both colours, with many
+    games run concurrently.
+- results table of every engine, or JSON.
+- any computer player of _players.py can be run as an engine.
+
+Engine protocol, one command per line. Actions are written as in
+Server.run(): 'r c r c' to place a move, 'r c' to begin a collapse.
+
+    new <n> <x|o> [win=<k>]
+                         a game starts on a board of size n, the
+                         engine plays x or o. With 'win', the game
+                         ends once a krist of length k is made. It
+                         replies 'ready' once it can play, within 10
+                         seconds.
+    opponent <action>    the opponent played <action>.
+    go <ms>              the engine is to play, it must reply with
+                         'move <action>' within <ms> milliseconds.
+    quit                 the game is over.
+
+Usage: python3 tournament.py NAME=COMMAND NAME=COMMAND ... [options],
+see --help. 'python3 tournament.py --play random' runs a random player
+as an engine, e.g.
+
+    python3 tournament.py 'rand=python3 tournament.py --play random' \\
+        'mcts=python3 tournament.py --play mcts:300' --games 20
+'''
+
+import argparse
+import asyncio
+import json
+import random
+import shlex
+import sys
+import time
+
+from server import Server
+from _players import isCollapsing, isTerminal
+
+# seconds an engine is given to start and reply 'ready'.
+STARTUP = 10.0
+
+def formatAction(action):
+    return ' '.join(str(v) for pos in action for v in pos)
+
+def parseAction(tokens):
+    '''
+    Returns the action written by 'tokens', or None.
+    '''
+    if len(tokens) not in (2, 4) or not all(v.isdigit() for v in tokens):
+        return None
+    values = [int(v) for v in tokens]
+    return tuple((values[i], values[i+1]) for i in range(0, len(values), 2))
+
+def isLegal(server, action):
+    '''
+    Returns True if 'action' can be played from the state of 'server'.
+    '''
+    moveCells = server.game.moveCells()
+    if isCollapsing(server):
+        return len(action) == 1 and action[0] in moveCells
+
+    return (len(action) == 2 and action[0] != action[1] and
+        action[0] in moveCells and action[1] in moveCells)
+
+class EngineError(Exception):
+    def __init__(self, msg):
+        self.message = msg
+
+class Engine:
+    def __init__(self, name, command):
+        '''
+        A running engine process.
+        '''
+        self.name = name
+        self.command = command
+        self.process = None
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(
+            *shlex.split(self.command), stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+
+    async def send(self, line):
+        try:
+            self.process.stdin.write((line + '\n').encode())
+            await self.process.stdin.drain()
+        except ConnectionError:
+            raise EngineError('exited')
+
+    async def readTokens(self, seconds):
+        try:
+            line = await asyncio.wait_for(self.process.stdout.readline(),
+                seconds)
+        except asyncio.TimeoutError:
+            raise EngineError('timeout')
+
+        tokens = line.decode('utf-8', 'replace').split()
+        if not len(tokens):
+            raise EngineError('exited')
+        return tokens
+
+    async def newGame(self, board_size, side, winLength=None):
+        await self.start()
+        line = 'new {0} {1}'.format(board_size, side)
+        if winLength is not None:
+            line += ' win={0}'.format(winLength)
+        await self.send(line)
+        if (await self.readTokens(STARTUP))[0] != 'ready':
+            raise EngineError('not ready')
+
+    async def play(self, server, seconds):
+        '''
+        Asks the engine for its move. Returns the action played.
+        '''
+        await self.send('go {0}'.format(int(seconds*1000)))
+        tokens = await self.readTokens(seconds)
+
+        action = parseAction(tokens[1:]) if tokens[0] == 'move' else None
+        if action is None or not isLegal(server, action):
+            raise EngineError('illegal move: ' + ' '.join(tokens))
+        return action
+
+    async def stop(self):
+        if self.process is None or self.process.returncode is not None:
+            return
+        try:
+            await self.send('quit')
+            await asyncio.wait_for(self.process.wait(), 1.0)
+        except (EngineError, asyncio.TimeoutError):
+            self.process.kill()
+            await self.process.wait()
+
+async def playMatch(index, engineX, engineO, board_size, seconds, winLength):
+    '''
+    Plays one game between two engines given as (name, command).
+    Returns a dict of results.
+    '''
+    engines = {'x': Engine(*engineX), 'o': Engine(*engineO)}
+    server = Server(board_size, winLength=winLength)
+    start = time.time()
+    winner = None
+    reason = None
+
+    try:
+        for side in 'xo':
+            try:
+                await engines[side].newGame(board_size, side, winLength)
+            except (EngineError, OSError) as e:
+                winner = 'o' if side == 'x' else 'x'
+                reason = engines[side].name + ' ' + getattr(e, 'message', 
+                    'failed to start')
+                break
+
+        while reason is None and not isTerminal(server):
+            side = server.curr_state[0].lower()
+            other = 'o' if side == 'x' else 'x'
+            try:
+                action = await engines[side].play(server, seconds)
+            except EngineError as e:
+                winner = other
+                reason = engines[side].name + ' ' + e.message
+                break
+
+            server.playAction(action)
+            try:
+                await engines[other].send('opponent ' + formatAction(action))
+            except EngineError as e:
+                winner = side
+                reason = engines[other].name + ' ' + e.message
+                break
+
+        if reason is None:
+            winner = server.getWinner()
+
+    finally:
+        for side in 'xo':
+            await engines[side].stop()
+
+    return {
+        'game': index,
+        'x': engineX[0],
+        'o': engineO[0],
+        'winner': winner,
+        'forfeit': reason,
+        'moves': server.moveNum - 1,
+        'seconds': time.time() - start,
+    }
+
+async def runTournament(engines, games, board_size, seconds, concurrency,
+    winLength):
+    '''
+    Plays 'games' games between every pair of 'engines', a list of
+    (name, command), alternating colours. At most 'concurrency' games
+    run at once.
+    '''
+    pairings = list()
+    for i in range(len(engines)):
+        for j in range(i+1, len(engines)):
+            for k in range(games):
+                if k % 2:
+                    pairings.append((engines[j], engines[i]))
+                else:
+                    pairings.append((engines[i], engines[j]))
+
+    limit = asyncio.Semaphore(concurrency)
+    async def run(index, pairing):
+        async with limit:
+            return await playMatch(index, pairing[0], pairing[1],
+                board_size, seconds, winLength)
+
+    return await asyncio.gather(*[run(i, pairing)
+        for i, pairing in enumerate(pairings)])
+
+def resultsTable(names, results):
+    '''
+    Returns a map from each engine name to its wins, draws, losses,
+    forfeits and score (a draw scores half a win).
+    '''
+    table = dict()
+    for name in names:
+        table[name] = {'games': 0, 'wins': 0, 'draws': 0, 'losses': 0,
+            'forfeits': 0, 'score': 0.0}
+
+    for result in results:
+        for side in 'xo':
+            row = table[result[side]]
+            row['games'] += 1
+            if result['winner'] is None:
+                row['draws'] += 1
+                row['score'] += 0.5
+            elif result['winner'] == side:
+                row['wins'] += 1
+                row['score'] += 1.0
+            else:
+                row['losses'] += 1
+                if result['forfeit'] is not None:
+                    row['forfeits'] += 1
+
+    return table
+
+def printTable(table):
+    print('{0:<16}{1:>7}{2:>7}{3:>7}{4:>7}{5:>9}{6:>8}'.format('Engine',
+        'Games', 'Wins', 'Draws', 'Losses', 'Forfeits', 'Score'))
+    for name in sorted(table, key=lambda name: -table[name]['score']):
+        row = table[name]
+        print('{0:<16}{games:>7}{wins:>7}{draws:>7}{losses:>7}'
+            '{forfeits:>9}{score:>8.1f}'.format(name, **row))
+
+# -------------------------------------------------------------------
+# Engine side of the protocol, for the players of _players.py.
+def playEngine(spec, seed=None):
+    '''
+    Runs the player 'spec' (see simulate.makePlayer()) as an engine
+    on stdin and stdout.
+    '''
+    from simulate import makePlayer
+
+    rng = random.Random(seed)
+    server = None
+    player = None
+    for line in sys.stdin:
+        tokens = line.split()
+        if not len(tokens):
+            continue
+
+        if tokens[0] == 'new':
+            winLength = None
+            for token in tokens[3:]:
+                if token[0:4] == 'win=':
+                    winLength = int(token[4:])
+            server = Server(int(tokens[1]), winLength=winLength)
+            player = makePlayer(spec, rng)
+            print('ready', flush=True)
+
+        elif tokens[0] == 'opponent':
+            server.playAction(parseAction(tokens[1:]))
+
+        elif tokens[0] == 'go':
+            action = player.choose(server)
+            server.playAction(action)
+            print('move ' + formatAction(action), flush=True)
+
+        elif tokens[0] == 'quit':
+            break
+
+def main():
+    parser = argparse.ArgumentParser(description='Engine tournament.')
+    parser.add_argument('engines', nargs='*', metavar='NAME=COMMAND',
+        help='engine name and the command launching it')
+    parser.add_argument('--games', type=int, default=10,
+        help='games per pair of engines')
+    parser.add_argument('--size', type=int, default=4, help='board size')
+    parser.add_argument('--time', type=float, default=1.0,
+        help='seconds per move')
+    parser.add_argument('--concurrency', type=int, default=8,
+        help='number of games played at once')
+    parser.add_argument('--win', type=int, default=None, metavar='K',
+        help='end games once a krist of length K is made')
+    parser.add_argument('--json', action='store_true',
+        help='print the table and every game as JSON')
+    parser.add_argument('--play', default=None, metavar='PLAYER',
+        help='run as an engine: random or mcts[:playouts[:seconds]]')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    if args.win is not None and args.win not in range(1, args.size+1):
+        parser.error('--win must be from 1 to the board size')
+
+    if args.play is not None:
+        playEngine(args.play, args.seed)
+        return
+
+    engines = list()
+    for spec in args.engines:
+        name, sep, command = spec.partition('=')
+        if not sep or not len(command):
+            parser.error('engines are given as NAME=COMMAND')
+        engines.append((name, command))
+    if len(engines) < 2:
+        parser.error('at least two engines are needed')
+
+    start = time.time()
+    results = asyncio.run(runTournament(engines, args.games, args.size,
+        args.time, args.concurrency, args.win))
+    table = resultsTable([name for name, command in engines], results)
+
+    if args.json:
+        print(json.dumps({'table': table, 'games': results}))
+        return
+
+    printTable(table)
+    print('Games: {0}  Seconds: {1:.1f}'.format(len(results),
+        time.time() - start))
+    for result in results:
+        if result['forfeit'] is not None:
+            print('Game {game}: {forfeit}'.format(**result))
+
+if __name__ == '__main__':
+    main()